@@ -0,0 +1,176 @@
+"""
+Load test title autocomplete against the fake Wikipedia's opensearch.
+
+Simulated users type article titles one keystroke at a time, at an overall
+rate of --rate autocomplete events per second, and every keystroke is
+answered the way the Wiki cog answers it. Two modes are compared:
+
+    suggester  the shared title_suggester: prefix cache, debouncing, coalescing
+    direct     one opensearch request per keystroke (what a plain autocomplete would do)
+
+Reported per mode: upstream requests per keystroke, answer latency, where the
+answers came from, and how often the answer to a user's last keystroke matched
+what the upstream itself would have returned.
+
+Usage:
+    python -m benchmarks.autocomplete
+    python -m benchmarks.autocomplete --rate 500 --users 400 --duration 30 --latency 0.15
+"""
+import argparse
+import asyncio
+import datetime
+import json
+import platform
+import random
+import sys
+import time
+from pathlib import Path
+
+ROOT_PATH = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT_PATH))
+
+from benchmarks.fake_upstreams import WIKIPEDIA, FakeUpstreams, Fault
+from benchmarks.load_test import _milliseconds, git_commit, percentile
+from utils import autocomplete
+from utils import http
+from utils import metrics
+from utils import wikipedia_api
+
+DEFAULT_OUTPUT = ROOT_PATH / 'benchmarks' / 'results' / 'autocomplete.json'
+MODES = ('suggester', 'direct')
+
+
+class FakeUser:
+    def __init__(self, user_id: int):
+        self.id = user_id
+
+
+class FakeAutocomplete:
+    """
+    Just enough of discord.Interaction for an autocomplete callback.
+    """
+
+    def __init__(self, user_id: int):
+        self.created_at = datetime.datetime.now(datetime.timezone.utc)
+        self.user = FakeUser(user_id)
+
+
+async def answer(mode: str, user_id: int, text: str) -> list:
+    if mode == 'direct':
+        titles = await wikipedia_api.opensearch_titles(text, autocomplete.MAX_CHOICES)
+        return autocomplete.to_choices(titles or [])
+    return await wikipedia_api.title_suggester.choices(FakeAutocomplete(user_id), text)
+
+
+async def simulate(mode: str, upstreams: FakeUpstreams, args) -> dict:
+    rng = random.Random(args.seed)
+    latencies = []
+    finals = []  # (typed, answered titles) for each user's last keystroke on a title
+    tasks = set()
+    # Each user waits this long between keystrokes on average, for the overall rate
+    mean_delay = args.users / args.rate
+    stop_at = time.perf_counter() + args.duration
+
+    async def keystroke(user_id, text, final):
+        started_at = time.perf_counter()
+        choices = await answer(mode, user_id, text)
+        latencies.append(time.perf_counter() - started_at)
+        if final:
+            finals.append((text, [choice.value for choice in choices]))
+
+    async def user(user_id):
+        await asyncio.sleep(rng.uniform(0, mean_delay))
+        while time.perf_counter() < stop_at:
+            # Popular titles are looked up far more often, like real traffic
+            title = upstreams.titles[int(len(upstreams.titles) * rng.random() ** 3)]
+            typed = rng.randint(min(3, len(title)), len(title))
+            for length in range(1, typed + 1):
+                task = asyncio.create_task(keystroke(user_id, title[:length], length == typed))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+                await asyncio.sleep(rng.expovariate(1 / mean_delay))
+
+    requests_before = sum(upstreams.requests[WIKIPEDIA].values())
+    started_at = time.perf_counter()
+    await asyncio.gather(*(user(user_id) for user_id in range(args.users)))
+    await asyncio.gather(*tasks)
+    elapsed = time.perf_counter() - started_at
+    upstream_requests = sum(upstreams.requests[WIKIPEDIA].values()) - requests_before
+
+    matched = sum(answered == upstreams.opensearch(typed, autocomplete.MAX_CHOICES)[1]
+                  for typed, answered in finals)
+    return {
+        'keystrokes': len(latencies),
+        'keystrokes_per_second': round(len(latencies) / elapsed, 1),
+        'upstream_requests': upstream_requests,
+        'upstream_requests_per_keystroke': round(upstream_requests / len(latencies), 4) if latencies else None,
+        'answer_p50_ms': _milliseconds(percentile(latencies, 0.50)),
+        'answer_p99_ms': _milliseconds(percentile(latencies, 0.99)),
+        'answer_max_ms': _milliseconds(max(latencies, default=None)),
+        'over_budget': sum(latency > autocomplete.ANSWER_BUDGET + 0.05 for latency in latencies),
+        'final_answers_matching_upstream': round(matched / len(finals), 4) if finals else None,
+    }
+
+
+async def benchmark(args) -> dict:
+    faults = {WIKIPEDIA: Fault(latency=args.latency, jitter=args.latency / 2)} if args.latency else {}
+    upstreams = FakeUpstreams(faults=faults, titles=args.titles, seed=args.seed)
+    await upstreams.start()
+    upstreams.install()
+    await http.open_session()
+    results = {}
+    try:
+        for mode in args.modes:
+            suggester = wikipedia_api.title_suggester
+            suggester.cache.clear()
+            metrics.AUTOCOMPLETE_ANSWERS._values.clear()
+            results[mode] = await simulate(mode, upstreams, args)
+            if mode == 'suggester':
+                results[mode]['sources'] = {key[1]: int(value) for key, value
+                                            in metrics.AUTOCOMPLETE_ANSWERS._values.items()
+                                            if key[0] == suggester.name}
+                results[mode]['cached_prefixes'] = len(suggester.cache)
+    finally:
+        await http.close_session()
+        await upstreams.stop()
+
+    summary = {
+        'benchmark': 'autocomplete',
+        'commit': git_commit(),
+        'timestamp': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        'python': platform.python_version(),
+        'parameters': {key: value for key, value in vars(args).items() if key != 'output'},
+        'modes': results,
+    }
+    if 'suggester' in results and 'direct' in results and results['suggester']['upstream_requests']:
+        summary['upstream_reduction'] = round(results['direct']['upstream_requests']
+                                              / results['suggester']['upstream_requests'], 2)
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test title autocomplete against a fake opensearch.")
+    parser.add_argument('--modes', nargs='+', choices=MODES, default=list(MODES))
+    parser.add_argument('--users', type=int, default=200, help="Users typing at once")
+    parser.add_argument('--rate', type=float, default=300.0, help="Autocomplete events per second, overall")
+    parser.add_argument('--duration', type=float, default=20.0, help="Seconds of typing per mode")
+    parser.add_argument('--titles', type=int, default=30_000, help="Article titles the fake opensearch knows")
+    parser.add_argument('--latency', type=float, default=0.08, help="Seconds the fake opensearch takes to answer")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default=str(DEFAULT_OUTPUT), help="Where to write the JSON results, - for stdout")
+    args = parser.parse_args()
+
+    results = asyncio.run(benchmark(args))
+    text = json.dumps(results, indent=2)
+    if args.output == '-':
+        print(text)
+    else:
+        output = Path(args.output)
+        output.parent.mkdir(parents=True, exist_ok=True)
+        output.write_text(text)
+        print(text)
+        print(f"Wrote {output}")
+
+
+if __name__ == '__main__':
+    main()
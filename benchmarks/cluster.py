@@ -0,0 +1,246 @@
+"""
+Run the bot as a cluster against a local stub of Discord, offline, and check it.
+
+The real launcher (utils.cluster.Cluster) starts real worker processes, each
+running Sharmouta for its range of shards, but connected to the stub gateway
+in benchmarks/fake_gateway.py. The run measures how long the cluster takes to
+become ready, then kills a worker and measures how long the launcher takes to
+bring it back, and checks along the way that:
+
+    - every shard identified exactly once (and once more after the kill, for the killed worker's shards)
+    - identifies across workers were spaced by the identify interval
+    - every guild was delivered to exactly one worker
+    - commands were synced once, by the primary worker only
+    - the launcher's /ready, /status and merged /metrics reflect every worker
+
+Usage:
+    python -m benchmarks.cluster
+    python -m benchmarks.cluster --workers 4 --shards 16 --guilds 5000
+"""
+import argparse
+import asyncio
+import datetime
+import functools
+import json
+import os
+import platform
+import socket
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT_PATH = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT_PATH))
+
+import aiohttp
+
+from benchmarks.fake_gateway import FakeGateway
+from benchmarks.load_test import git_commit
+from utils import cluster
+
+DEFAULT_OUTPUT = ROOT_PATH / 'benchmarks' / 'results' / 'cluster.json'
+
+# Sent instead of real upstream requests, e.g. the country snapshot refresh; nothing listens there
+UNREACHABLE = 'http://127.0.0.1:9'
+
+
+def prepare_worker(api_base: str, gateway_url: str, scratch: str, identify_interval: float):
+    """
+    Point a worker process at the stub gateway and a scratch data directory. Runs in the worker.
+    """
+    import discord.gateway
+    import discord.http
+    import yarl
+
+    from utils import command_sync, countries, database, http, quran, reminders, symbols
+
+    worker = cluster.get_worker()
+    scratch = Path(scratch)
+
+    # The worker's logs go to its own file instead of the benchmark's output
+    log_file = open(scratch / f'worker-{worker.worker_id}.log', 'a', encoding='utf-8')
+    os.dup2(log_file.fileno(), sys.stdout.fileno())
+    os.dup2(log_file.fileno(), sys.stderr.fileno())
+
+    os.environ['BOT_TOKEN'] = 'stub-token'
+    discord.http.Route.BASE = api_base
+    discord.gateway.DiscordWebSocket.DEFAULT_GATEWAY = yarl.URL(gateway_url)
+    cluster.IDENTIFY_INTERVAL = identify_interval
+    cluster.HEARTBEAT_INTERVAL = 1.0
+
+    database.DATABASE_PATH = scratch / 'bot.db'
+    command_sync.FINGERPRINT_PATH = scratch / 'command_tree.hash'
+    countries.SNAPSHOT_PATH = scratch / 'countries.json'
+    symbols.SNAPSHOT_PATH = scratch / 'symbols.json'
+    quran.CORPUS_PATH = scratch / 'quran.bin'
+    reminders.SNAPSHOT_PATH = scratch / 'reminders.json'
+    reminders.LOG_PATH = scratch / 'reminders.log'
+    http.redirect_upstream('restcountries.com', UNREACHABLE)
+    http.redirect_upstream('api.alquran.cloud', UNREACHABLE)
+
+
+def free_port_range(count: int) -> int:
+    """
+    Find a port such that it and the next count - 1 ports are free.
+    """
+    while True:
+        with socket.socket() as probe:
+            probe.bind(('127.0.0.1', 0))
+            base = probe.getsockname()[1]
+        if base + count >= 65535:
+            continue
+        try:
+            sockets = []
+            for port in range(base, base + count):
+                sock = socket.socket()
+                sockets.append(sock)
+                sock.bind(('127.0.0.1', port))
+            return base
+        except OSError:
+            continue
+        finally:
+            for sock in sockets:
+                sock.close()
+
+
+async def wait_until(predicate, timeout: float, interval: float = 0.05) -> float:
+    """
+    Wait for predicate() to be true.
+
+    Returns:
+        float: Seconds waited.
+    """
+    started_at = time.perf_counter()
+    while not predicate():
+        if time.perf_counter() - started_at > timeout:
+            raise TimeoutError(f"Timed out after {timeout}s")
+        await asyncio.sleep(interval)
+    return time.perf_counter() - started_at
+
+
+def identify_gaps(identifies: list, max_concurrency: int) -> list:
+    """
+    Seconds between consecutive identifies in the same bucket.
+    """
+    last = {}
+    gaps = []
+    for at, shard_id, _ in identifies:
+        bucket = shard_id % max_concurrency
+        if bucket in last:
+            gaps.append(at - last[bucket])
+        last[bucket] = at
+    return gaps
+
+
+async def benchmark(args) -> dict:
+    import bot
+
+    checks = {}
+    gateway = FakeGateway(guilds=args.guilds, max_concurrency=args.max_concurrency)
+    await gateway.start()
+    port = free_port_range(args.workers + 1)
+    base = f'http://127.0.0.1:{port}'
+
+    with tempfile.TemporaryDirectory() as scratch:
+        fleet = cluster.Cluster(functools.partial(bot.run_worker), args.workers, args.shards,
+                                max_concurrency=args.max_concurrency, port=port,
+                                initializer=prepare_worker,
+                                initargs=(gateway.api_base, gateway.gateway_url, scratch, args.identify_interval))
+        run_task = asyncio.create_task(fleet.run())
+        failed = True
+        try:
+            ready_s = await wait_until(fleet.is_ready, args.timeout)
+
+            async with aiohttp.ClientSession() as session:
+                async with session.get(f'{base}/ready') as response:
+                    checks['ready_endpoint'] = response.status == 200
+                async with session.get(f'{base}/status') as response:
+                    status = await response.json()
+                async with session.get(f'{base}/metrics') as response:
+                    metrics_text = await response.text()
+
+            identified = gateway.identified_shards()
+            checks['each_shard_identified_once'] = identified == {shard_id: 1 for shard_id in range(args.shards)}
+            gaps = identify_gaps(gateway.identifies, args.max_concurrency)
+            checks['identifies_spaced'] = all(gap >= args.identify_interval * 0.9 for gap in gaps)
+            checks['all_guilds_delivered'] = status['guilds'] == args.guilds
+            checks['commands_synced_once'] = dict(gateway.synced) == {'global': 1}
+            checks['metrics_from_every_worker'] = all(f'worker="{worker_id}"' in metrics_text
+                                                      for worker_id in range(args.workers))
+            checks['metrics_families_unique'] = len([line for line in metrics_text.splitlines()
+                                                     if line.startswith('# TYPE ')]) == \
+                len({line.split()[2] for line in metrics_text.splitlines() if line.startswith('# TYPE ')})
+
+            # Kill a worker and time how long the launcher takes to bring its shards back
+            victim = fleet.workers[args.workers - 1]
+            victim_shards = victim.worker.shard_ids
+            victim.process.kill()
+            await wait_until(lambda: not fleet.is_ready(), 10)
+            recovery_s = await wait_until(fleet.is_ready, args.timeout)
+            identified = gateway.identified_shards()
+            checks['restarted_worker_reidentified'] = all(identified[shard_id] == 2 for shard_id in victim_shards)
+            checks['other_workers_untouched'] = all(identified[shard_id] == 1 for shard_id in range(args.shards)
+                                                    if shard_id not in victim_shards)
+            checks['restart_counted'] = victim.restarts == 1
+            failed = not all(checks.values())
+        finally:
+            fleet.stop()
+            shutdown_started_at = time.perf_counter()
+            await run_task
+            shutdown_s = time.perf_counter() - shutdown_started_at
+            await gateway.stop()
+            if failed and args.show_logs:
+                for log_path in sorted(Path(scratch).glob('worker-*.log')):
+                    print(f"==> {log_path.name}", file=sys.stderr)
+                    # Warnings, errors and anything that isn't a JSON log line, such as a crash's traceback
+                    for line in log_path.read_text().splitlines():
+                        if not line.startswith('{') or '"level": "INFO"' not in line and '"level": "DEBUG"' not in line:
+                            print(line, file=sys.stderr)
+
+    return {
+        'benchmark': 'cluster',
+        'commit': git_commit(),
+        'timestamp': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        'python': platform.python_version(),
+        'parameters': {key: value for key, value in vars(args).items() if key != 'output'},
+        'ready_s': round(ready_s, 3),
+        'recovery_s': round(recovery_s, 3),
+        'shutdown_s': round(shutdown_s, 3),
+        'identifies': len(gateway.identifies),
+        'min_identify_gap_s': round(min(gaps), 3) if gaps else None,
+        'workers': status['workers'],
+        'checks': checks,
+        'passed': all(checks.values()),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a cluster against a stub Discord gateway and check it.")
+    parser.add_argument('--workers', type=int, default=3)
+    parser.add_argument('--shards', type=int, default=6)
+    parser.add_argument('--guilds', type=int, default=1000)
+    parser.add_argument('--max-concurrency', type=int, default=1, help="Identify buckets")
+    parser.add_argument('--identify-interval', type=float, default=0.2,
+                        help="Seconds each identify holds its bucket (5 on the real gateway)")
+    parser.add_argument('--timeout', type=float, default=120.0, help="Seconds to wait for the cluster to be ready")
+    parser.add_argument('--show-logs', action='store_true', help="Print the workers' logs if a check fails")
+    parser.add_argument('--output', default=str(DEFAULT_OUTPUT), help="Where to write the JSON results, - for stdout")
+    args = parser.parse_args()
+
+    results = asyncio.run(benchmark(args))
+    text = json.dumps(results, indent=2)
+    if args.output == '-':
+        print(text)
+    else:
+        output = Path(args.output)
+        output.parent.mkdir(parents=True, exist_ok=True)
+        output.write_text(text)
+        print(text)
+        print(f"Wrote {output}")
+    if not results['passed']:
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
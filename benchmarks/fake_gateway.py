@@ -0,0 +1,209 @@
+"""
+A local stand-in for Discord's REST API and gateway, for running the bot offline.
+
+Enough of both is emulated for discord.py to log in, connect any number of
+shards, receive READY and a GUILD_CREATE for each of its guilds, heartbeat,
+and sync commands. Guilds are spread over shards the way Discord does it,
+(guild_id >> 22) % shard_count, so a sharded bot sees each guild exactly once.
+
+Every IDENTIFY is recorded, so tests can check that each shard connected
+once and that identifies respected the rate limit.
+"""
+import asyncio
+import json
+import socket
+import time
+from collections import Counter
+
+from aiohttp import WSMsgType, web
+
+API_VERSION = 10
+
+APPLICATION_ID = 100_000_000_000_000_001
+BOT_USER_ID = 100_000_000_000_000_002
+
+# Gateway opcodes
+DISPATCH = 0
+HEARTBEAT = 1
+IDENTIFY = 2
+RESUME = 6
+INVALID_SESSION = 9
+HELLO = 10
+HEARTBEAT_ACK = 11
+
+HEARTBEAT_INTERVAL_MS = 41_250
+
+
+def guild_id(index: int) -> int:
+    # A snowflake whose timestamp part is index + 1, so guilds spread over shards round-robin
+    return (index + 1) << 22
+
+
+def shard_of(guild: int, shard_count: int) -> int:
+    return (guild >> 22) % shard_count
+
+
+def _json(data, status: int = 200) -> web.Response:
+    # discord.py only parses bodies whose content type is exactly application/json, without a charset
+    return web.Response(body=json.dumps(data).encode('utf-8'), status=status, content_type='application/json')
+
+
+class FakeGateway:
+    """
+    Serves /api/v10/... and a gateway websocket at /gateway.
+
+    Attributes:
+        identifies (list): (time, shard_id, shard_count) per IDENTIFY received, in order.
+        synced (Counter): Command syncs received, by scope ("global" or the guild ID).
+        messages (list): (channel_id, content) of every message the bot sent.
+    """
+
+    def __init__(self, guilds: int = 100, recommended_shards: int = 1, max_concurrency: int = 1):
+        self.guild_ids = [guild_id(index) for index in range(guilds)]
+        self.recommended_shards = recommended_shards
+        self.max_concurrency = max_concurrency
+        self.identifies = []
+        self.synced = Counter()
+        self.messages = []
+        self.base_url = None
+        self._runner = None
+        self._sockets = set()
+        self._sessions = 0
+
+    @property
+    def api_base(self) -> str:
+        return f"{self.base_url}/api/v{API_VERSION}"
+
+    @property
+    def gateway_url(self) -> str:
+        return f"{self.base_url.replace('http://', 'ws://')}/gateway"
+
+    async def start(self, host: str = '127.0.0.1', port: int = 0) -> str:
+        """
+        Start serving.
+
+        Returns:
+            str: The server's base URL.
+        """
+        app = web.Application()
+        app.router.add_get('/gateway', self._gateway)
+        app.router.add_route('*', f'/api/v{API_VERSION}/{{path:.*}}', self._api)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind((host, port))
+        await web.SockSite(self._runner, sock).start()
+        self.base_url = f"http://{host}:{sock.getsockname()[1]}"
+        return self.base_url
+
+    async def stop(self):
+        for ws in list(self._sockets):
+            await ws.close()
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    # REST
+
+    def _user(self) -> dict:
+        return {'id': str(BOT_USER_ID), 'username': 'Sharmouta', 'discriminator': '0', 'global_name': None,
+                'avatar': None, 'bot': True, 'flags': 0}
+
+    async def _api(self, request):
+        path = request.match_info['path']
+        parts = path.split('/')
+
+        if request.method == 'GET' and path == 'users/@me':
+            return _json(self._user())
+        if request.method == 'GET' and path == 'oauth2/applications/@me':
+            return _json({
+                'id': str(APPLICATION_ID), 'name': 'Sharmouta', 'description': '', 'icon': None,
+                'bot_public': True, 'bot_require_code_grant': False, 'owner': self._user(),
+                'verify_key': '0' * 64, 'flags': 0, 'team': None,
+            })
+        if request.method == 'GET' and path in ('gateway', 'gateway/bot'):
+            return _json({
+                'url': self.gateway_url, 'shards': self.recommended_shards,
+                'session_start_limit': {'total': 1000, 'remaining': 1000, 'reset_after': 0,
+                                        'max_concurrency': self.max_concurrency},
+            })
+        if request.method == 'PUT' and parts[0] == 'applications' and parts[-1] == 'commands':
+            scope = parts[3] if len(parts) == 5 else 'global'
+            self.synced[scope] += 1
+            commands = await request.json()
+            return _json([{**command, 'id': str(index + 1), 'application_id': str(APPLICATION_ID), 'version': '1'}
+                          for index, command in enumerate(commands)])
+        if request.method == 'POST' and parts[0] == 'channels' and parts[-1] == 'messages':
+            payload = await request.json()
+            self.messages.append((int(parts[1]), payload.get('content')))
+            return _json({
+                'id': str(len(self.messages)), 'channel_id': parts[1], 'type': 0, 'content': payload.get('content'),
+                'author': self._user(), 'attachments': [], 'embeds': [], 'mentions': [], 'mention_roles': [],
+                'pinned': False, 'mention_everyone': False, 'tts': False,
+                'timestamp': '2024-01-01T00:00:00+00:00', 'edited_timestamp': None,
+            })
+        return _json({'message': f'Unknown route {request.method} {path}', 'code': 0}, status=404)
+
+    # Gateway
+
+    def _guild(self, guild: int) -> dict:
+        return {
+            'id': str(guild), 'name': f'Guild {guild >> 22}', 'icon': None, 'owner_id': str(BOT_USER_ID),
+            'unavailable': False, 'member_count': 2, 'large': False, 'features': [],
+            'roles': [{'id': str(guild), 'name': '@everyone', 'permissions': '0', 'position': 0, 'color': 0,
+                       'hoist': False, 'managed': False, 'mentionable': False}],
+            'channels': [{'id': str(guild + 1), 'type': 0, 'name': 'general', 'position': 0,
+                          'permission_overwrites': []}],
+            'members': [], 'emojis': [], 'stickers': [], 'threads': [], 'voice_states': [], 'presences': [],
+            'stage_instances': [], 'guild_scheduled_events': [],
+        }
+
+    async def _gateway(self, request):
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        self._sockets.add(ws)
+        sequence = 0
+
+        async def dispatch(event, data):
+            nonlocal sequence
+            sequence += 1
+            await ws.send_str(json.dumps({'op': DISPATCH, 't': event, 's': sequence, 'd': data}))
+
+        try:
+            await ws.send_str(json.dumps({'op': HELLO, 'd': {'heartbeat_interval': HEARTBEAT_INTERVAL_MS}}))
+            async for message in ws:
+                if message.type != WSMsgType.TEXT:
+                    continue
+                payload = json.loads(message.data)
+                op = payload.get('op')
+                if op == HEARTBEAT:
+                    await ws.send_str(json.dumps({'op': HEARTBEAT_ACK}))
+                elif op == IDENTIFY:
+                    shard_id, shard_count = payload['d'].get('shard', [0, 1])
+                    self.identifies.append((time.monotonic(), shard_id, shard_count))
+                    self._sessions += 1
+                    guilds = [guild for guild in self.guild_ids if shard_of(guild, shard_count) == shard_id]
+                    await dispatch('READY', {
+                        'v': API_VERSION, 'user': self._user(), 'session_id': f'session-{self._sessions}',
+                        'resume_gateway_url': self.gateway_url, 'shard': [shard_id, shard_count],
+                        'guilds': [{'id': str(guild), 'unavailable': True} for guild in guilds],
+                        'application': {'id': str(APPLICATION_ID), 'flags': 0},
+                    })
+                    for guild in guilds:
+                        await dispatch('GUILD_CREATE', self._guild(guild))
+                elif op == RESUME:
+                    # Sessions aren't kept, so the shard has to identify again
+                    await ws.send_str(json.dumps({'op': INVALID_SESSION, 'd': False}))
+        except (ConnectionResetError, asyncio.CancelledError):
+            pass
+        finally:
+            self._sockets.discard(ws)
+        return ws
+
+    def identified_shards(self) -> Counter:
+        """
+        Count the IDENTIFYs per shard ID.
+        """
+        return Counter(shard_id for _, shard_id, _ in self.identifies)
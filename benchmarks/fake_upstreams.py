@@ -0,0 +1,436 @@
+"""
+A local stand-in for every upstream API the bot calls, for load tests.
+
+One aiohttp server emulates Wikipedia, restcountries, le-systeme-solaire,
+alquran.cloud, API Ninjas, Finnhub and Polygon. Requests for an upstream are
+served under /<host>/..., and install() redirects the bot's HTTP client and
+the Finnhub SDK there. Responses are generated deterministically from the
+request, so any key works and runs are repeatable.
+
+Each host can be given latency, jitter, an error rate (503s) and a throttle
+rate (429s) to see how the bot behaves when an upstream degrades.
+"""
+import asyncio
+import bisect
+import dataclasses
+import random
+import socket
+import zlib
+from collections import Counter, defaultdict
+
+from aiohttp import web
+
+from utils import http
+
+WIKIPEDIA = 'en.wikipedia.org'
+RESTCOUNTRIES = 'restcountries.com'
+SOLAR_SYSTEM = 'api.le-systeme-solaire.net'
+ALQURAN = 'api.alquran.cloud'
+API_NINJAS = 'api.api-ninjas.com'
+FINNHUB = 'finnhub.io'
+POLYGON = 'api.polygon.io'
+
+HOSTS = (WIKIPEDIA, RESTCOUNTRIES, SOLAR_SYSTEM, ALQURAN, API_NINJAS, FINNHUB, POLYGON)
+
+# Keys starting with this prefix are answered as "not found" by every upstream
+MISSING_PREFIX = 'missing'
+
+# Bodies le-systeme-solaire knows about, with their moons
+BODIES = {
+    'mercury': [], 'venus': [], 'earth': ['La Lune'], 'mars': ['Phobos', 'Deimos'],
+    'jupiter': ['Io', 'Europa', 'Ganymede', 'Callisto'], 'saturn': ['Titan', 'Rhea', 'Iapetus'],
+    'uranus': ['Miranda', 'Ariel'], 'neptune': ['Triton'], 'pluto': ['Charon'], 'ceres': [],
+}
+
+# The snapshot served by restcountries /v3.1/all
+COUNTRY_COUNT = 250
+
+# Surahs and ayahs in a generated alquran.cloud edition
+SURAH_COUNT = 114
+AYAH_COUNT = 6236
+
+
+@dataclasses.dataclass
+class Fault:
+    """
+    How an upstream misbehaves.
+
+    Attributes:
+        latency (float): Seconds added to every response.
+        jitter (float): Up to this many extra seconds, chosen uniformly at random.
+        error_rate (float): Fraction of requests answered with a 503.
+        throttle_rate (float): Fraction of requests answered with a 429.
+    """
+    latency: float = 0.0
+    jitter: float = 0.0
+    error_rate: float = 0.0
+    throttle_rate: float = 0.0
+
+
+def _seed(*parts) -> int:
+    return zlib.crc32('|'.join(str(part) for part in parts).encode('utf-8'))
+
+
+def _missing(key: str) -> bool:
+    return str(key).lower().startswith(MISSING_PREFIX)
+
+
+def _title(term: str, rank: int = 0) -> str:
+    title = term.strip().title() or 'Main Page'
+    return title if rank == 0 else f"{title} ({rank})"
+
+
+def _page(title: str, index: int = 0, thumbnail: bool = True) -> dict:
+    page = {
+        'pageid': _seed(title) % 10_000_000,
+        'ns': 0,
+        'title': title,
+        'index': index,
+        'extract': f"{title} is a synthetic article served by the benchmark's fake Wikipedia.",
+        'fullurl': f"https://en.wikipedia.org/wiki/{title.replace(' ', '_')}"
+    }
+    if thumbnail:
+        page['thumbnail'] = {'source': f"https://upload.wikimedia.org/{page['pageid']}.jpg", 'width': 300}
+    return page
+
+
+def _country(index: int) -> dict:
+    name = f"Country {index}"
+    code = f"{chr(65 + index // 26 % 26)}{chr(65 + index % 26)}"
+    return {
+        'name': {'common': name, 'official': f"Republic of {name}"},
+        'capital': [f"Capital {index}"],
+        'population': 1_000_000 + _seed(name) % 200_000_000,
+        'area': float(10_000 + _seed('area', name) % 5_000_000),
+        'currencies': {f"C{code}": {'name': f"{name} dollar", 'symbol': '$'}},
+        'languages': {code.lower(): f"{name}ish"},
+        'flags': {'png': f"https://flagcdn.com/w320/{code.lower()}.png"},
+        'cca2': code,
+        'cca3': f"{code}X",
+        'altSpellings': [code, f"The {name}"]
+    }
+
+
+def _quote(symbol: str) -> dict:
+    if _missing(symbol):
+        # Finnhub answers unknown symbols with an all-zero quote
+        return {'c': 0, 'd': None, 'dp': None, 'h': 0, 'l': 0, 'o': 0, 'pc': 0, 't': 0}
+    previous_close = 10 + _seed(symbol) % 50_000 / 100
+    current = round(previous_close * (1 + (_seed(symbol, 'move') % 1000 - 500) / 10_000), 2)
+    return {
+        'c': current,
+        'd': round(current - previous_close, 2),
+        'dp': round((current - previous_close) / previous_close * 100, 4),
+        'h': round(max(current, previous_close) * 1.01, 2),
+        'l': round(min(current, previous_close) * 0.99, 2),
+        'o': previous_close,
+        'pc': previous_close,
+        't': 1_700_000_000
+    }
+
+
+def _profile(symbol: str) -> dict:
+    if _missing(symbol):
+        return {}
+    return {
+        'country': 'US',
+        'currency': 'USD',
+        'exchange': 'NASDAQ NMS - GLOBAL MARKET',
+        'finnhubIndustry': 'Technology',
+        'ipo': '1999-01-01',
+        'logo': f"https://static.finnhub.io/logo/{symbol.lower()}.png",
+        'marketCapitalization': _seed(symbol) % 3_000_000,
+        'name': f"{symbol} Inc",
+        'phone': '15555550100',
+        'shareOutstanding': _seed(symbol, 'shares') % 20_000,
+        'ticker': symbol,
+        'weburl': f"https://www.{symbol.lower()}.example/"
+    }
+
+
+def symbol_universe(size: int) -> list:
+    """
+    The ticker symbols served by the fake Finnhub /stock/symbol, a few real ones first.
+    """
+    symbols = ['AAPL', 'MSFT', 'NVDA', 'AMZN', 'GOOGL', 'META', 'TSLA', 'BRK.B', 'JPM', 'V']
+    symbols += [f"S{index:05d}" for index in range(max(0, size - len(symbols)))]
+    return symbols[:size]
+
+
+# Syllables the fake Wikipedia's article titles are built from
+SYLLABLES = ('an', 'ber', 'co', 'dio', 'el', 'fa', 'gre', 'hu', 'is', 'ka', 'lo', 'mi', 'no', 'ra', 'sul', 'ten')
+
+
+def article_titles(size: int) -> list:
+    """
+    The article titles the fake Wikipedia's opensearch completes, sorted case-insensitively.
+
+    Titles are two words of two or three syllables, e.g. "Kalo Bergreno", so
+    prefixes branch like real ones do.
+    """
+    words = [(first + second + third).capitalize()
+             for first in SYLLABLES for second in SYLLABLES for third in ('',) + SYLLABLES]
+    rng = random.Random(size)
+    titles = set()
+    while len(titles) < size:
+        titles.add(f"{rng.choice(words)} {rng.choice(words)}")
+    return sorted(titles, key=str.casefold)
+
+
+def _edition(edition: str) -> dict:
+    base, extra = divmod(AYAH_COUNT, SURAH_COUNT)
+    surahs = []
+    number = 1
+    for surah in range(1, SURAH_COUNT + 1):
+        count = base + (1 if surah <= extra else 0)
+        ayahs = []
+        for ayah in range(1, count + 1):
+            ayahs.append({'number': number, 'numberInSurah': ayah, 'text': f"{edition} {surah}:{ayah}"})
+            number += 1
+        surahs.append({'number': surah, 'englishName': f"Surah {surah}", 'ayahs': ayahs})
+    return {'code': 200, 'status': 'OK', 'data': {'surahs': surahs}}
+
+
+class FakeUpstreams:
+    """
+    The fake upstream server, with per-host faults and request counts.
+
+    Args:
+        faults (dict): Fault per host; hosts without one answer immediately.
+        symbols (int): How many tickers the fake Finnhub lists.
+        titles (int): How many article titles the fake Wikipedia's opensearch completes.
+        seed (int): Seed for the fault injection, so runs are repeatable.
+    """
+
+    def __init__(self, faults: dict = None, symbols: int = 5000, titles: int = 30_000, seed: int = 0):
+        self.faults = dict(faults or {})
+        self.symbols = symbol_universe(symbols)
+        self.titles = article_titles(titles)
+        self._title_keys = [title.casefold() for title in self.titles]
+        self.requests = defaultdict(Counter)  # Host -> status -> count
+        self.base_url = None
+
+        self._random = random.Random(seed)
+        self._runner = None
+        self._countries = [_country(index) for index in range(COUNTRY_COUNT)]
+        self._editions = {}
+        self._routes = {
+            WIKIPEDIA: self._wikipedia,
+            RESTCOUNTRIES: self._restcountries,
+            SOLAR_SYSTEM: self._solar_system,
+            ALQURAN: self._alquran,
+            API_NINJAS: self._api_ninjas,
+            FINNHUB: self._finnhub,
+            POLYGON: self._polygon,
+        }
+
+    async def start(self, host: str = '127.0.0.1', port: int = 0) -> str:
+        """
+        Start serving.
+
+        Returns:
+            str: The server's base URL.
+        """
+        app = web.Application()
+        app.router.add_route('GET', '/{host}/{path:.*}', self._handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind((host, port))
+        await web.SockSite(self._runner, sock).start()
+        self.base_url = f"http://{host}:{sock.getsockname()[1]}"
+        return self.base_url
+
+    async def stop(self):
+        self.uninstall()
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    def install(self):
+        """
+        Send the bot's upstream traffic, including the Finnhub SDK's, to this server.
+        """
+        import finnhub
+
+        for host in HOSTS:
+            http.redirect_upstream(host, f"{self.base_url}/{host}")
+        finnhub.Client.API_URL = f"{self.base_url}/{FINNHUB}/api/v1"
+
+    def uninstall(self):
+        import finnhub
+
+        for host in HOSTS:
+            http.redirect_upstream(host, None)
+        finnhub.Client.API_URL = 'https://api.finnhub.io/api/v1'
+
+    def request_counts(self) -> dict:
+        return {host: dict(statuses) for host, statuses in sorted(self.requests.items())}
+
+    async def _handle(self, request):
+        host = request.match_info['host']
+        # The Finnhub SDK joins its base URL and paths with a double slash
+        path = '/' + '/'.join(part for part in request.match_info['path'].split('/') if part)
+
+        fault = self.faults.get(host)
+        if fault is not None:
+            delay = fault.latency + (self._random.uniform(0, fault.jitter) if fault.jitter else 0.0)
+            if delay > 0:
+                await asyncio.sleep(delay)
+            roll = self._random.random()
+            if roll < fault.throttle_rate:
+                self.requests[host][429] += 1
+                return web.json_response({'error': 'Too Many Requests'}, status=429, headers={'Retry-After': '1'})
+            if roll < fault.throttle_rate + fault.error_rate:
+                self.requests[host][503] += 1
+                return web.json_response({'error': 'Service Unavailable'}, status=503)
+
+        route = self._routes.get(host)
+        response = route(path, request.query) if route is not None else None
+        if response is None:
+            response = web.json_response({'error': 'Not Found'}, status=404)
+        self.requests[host][response.status] += 1
+        return response
+
+    def _wikipedia(self, path, query):
+        if query.get('action') == 'parse':
+            page = query.get('page', '')
+            if _missing(page):
+                return web.json_response({'error': {'code': 'missingtitle', 'info': "The page doesn't exist."}})
+            sections = [{'line': f"Section {index}", 'level': str(1 + index % 3), 'index': str(index)}
+                        for index in range(1, 9 + _seed(page) % 12)]
+            return web.json_response({'parse': {'title': _title(page), 'sections': sections}})
+
+        if query.get('action') == 'opensearch':
+            return web.json_response(self.opensearch(query.get('search', ''), int(query.get('limit', 10))))
+
+        if query.get('list') == 'mostviewed':
+            limit = int(query.get('pvimlimit', 10))
+            return web.json_response({'query': {'mostviewed': [
+                {'ns': 0, 'title': f"Trending {index}", 'count': 100_000 - index} for index in range(limit)
+            ]}})
+
+        generator = query.get('generator')
+        if generator == 'search':
+            term = query.get('gsrsearch', '')
+            if _missing(term):
+                return web.json_response({'batchcomplete': ''})
+            limit = int(query.get('gsrlimit', 10))
+            pages = [_page(_title(term, rank), index=rank + 1) for rank in range(limit)]
+            return web.json_response({'query': {'pages': {str(page['pageid']): page for page in pages}}})
+
+        if generator == 'random':
+            limit = int(query.get('grnlimit', 1))
+            pages = [_page(f"Random {self._random.randrange(10_000_000)}") for _ in range(limit)]
+            return web.json_response({'query': {'pages': {str(page['pageid']): page for page in pages}}})
+
+        if 'extracts' in query.get('prop', '') and query.get('titles'):
+            pages = [_page(title, index=index + 1) for index, title in enumerate(query['titles'].split('|'))]
+            return web.json_response({'query': {'pages': {str(page['pageid']): page for page in pages}}})
+
+        if query.get('prop') == 'categories':
+            title = query.get('titles', '')
+            if _missing(title):
+                return web.json_response({'query': {'pages': {'-1': {'title': title, 'missing': ''}}}})
+            categories = [{'ns': 14, 'title': f"Category:{_title(title)} topic {index}"}
+                          for index in range(3 + _seed(title) % 40)]
+            # Paged like the real API: cllimit per answer, and a clcontinue token for the rest
+            limit = len(categories) if query.get('cllimit', 'max') == 'max' else int(query['cllimit'])
+            offset = int(query.get('clcontinue', '1|0').split('|')[1])
+            answer = {'query': {'pages': {'1': {'title': _title(title), 'categories': categories[offset:offset + limit]}}}}
+            if offset + limit < len(categories):
+                answer['continue'] = {'clcontinue': f"1|{offset + limit}", 'continue': '||'}
+            return web.json_response(answer)
+
+        return None
+
+    def opensearch(self, search: str, limit: int) -> list:
+        """
+        Answer an opensearch query: the titles starting with search, ignoring case.
+        """
+        prefix = search.casefold()
+        start = bisect.bisect_left(self._title_keys, prefix)
+        titles = []
+        for index in range(start, min(start + limit, len(self.titles))):
+            if not self._title_keys[index].startswith(prefix):
+                break
+            titles.append(self.titles[index])
+        return [search, titles, [''] * len(titles), [f"https://en.wikipedia.org/wiki/{title.replace(' ', '_')}"
+                                                      for title in titles]]
+
+    def _restcountries(self, path, query):
+        if path == '/v3.1/all':
+            return web.json_response(self._countries)
+        if path.startswith('/v3.1/name/'):
+            name = path.rsplit('/', 1)[1].lower()
+            matches = [country for country in self._countries if name in country['name']['common'].lower()]
+            return web.json_response(matches) if matches else None
+        return None
+
+    def _solar_system(self, path, query):
+        name = path.rsplit('/', 1)[1].lower()
+        if not path.startswith('/rest/bodies/') or name not in BODIES:
+            return None
+        return web.json_response({
+            'id': name,
+            'name': name.title(),
+            'englishName': name.title(),
+            'mass': {'massValue': 1 + _seed(name) % 900 / 100, 'massExponent': 23 + _seed(name) % 5},
+            'gravity': _seed(name, 'gravity') % 2500 / 100,
+            'meanRadius': 1000 + _seed(name, 'radius') % 70_000,
+            'sideralOrbit': 80 + _seed(name, 'orbit') % 90_000,
+            'moons': [{'moon': moon} for moon in BODIES[name]] or None
+        })
+
+    def _alquran(self, path, query):
+        if path.startswith('/v1/quran/'):
+            edition = path.rsplit('/', 1)[1]
+            if edition not in self._editions:
+                self._editions[edition] = _edition(edition)
+            return web.json_response(self._editions[edition])
+        if path.startswith('/v1/ayah/'):
+            number = path.split('/')[3]
+            return web.json_response({'code': 200, 'status': 'OK', 'data': {
+                'number': number, 'text': f"Ayah {number}", 'surah': {'englishName': 'Surah'}, 'numberInSurah': 1
+            }})
+        return None
+
+    def _api_ninjas(self, path, query):
+        if path != '/v1/facts':
+            return None
+        limit = int(query.get('limit', 1))
+        return web.json_response([{'fact': f"Synthetic fact number {self._random.randrange(1_000_000)}."}
+                                  for _ in range(limit)])
+
+    def _finnhub(self, path, query):
+        if path == '/api/v1/quote':
+            return web.json_response(_quote(query.get('symbol', '')))
+        if path == '/api/v1/stock/profile2':
+            return web.json_response(_profile(query.get('symbol', '')))
+        if path == '/api/v1/search':
+            text = query.get('q', '').upper()
+            result = [{'description': f"{symbol} Inc", 'displaySymbol': symbol, 'symbol': symbol,
+                       'type': 'Common Stock'} for symbol in self.symbols if symbol.startswith(text)][:20]
+            return web.json_response({'count': len(result), 'result': result})
+        if path == '/api/v1/stock/symbol':
+            return web.json_response([{'currency': 'USD', 'description': f"{symbol} Inc", 'displaySymbol': symbol,
+                                       'figi': f"BBG{_seed(symbol):09d}", 'mic': 'XNAS', 'symbol': symbol,
+                                       'type': 'Common Stock'} for symbol in self.symbols])
+        return None
+
+    def _polygon(self, path, query):
+        if path != '/v3/reference/dividends':
+            return None
+        ticker = query.get('ticker', '')
+        # Roughly a third of tickers pay no dividends
+        if _missing(ticker) or _seed(ticker) % 3 == 0:
+            return web.json_response({'results': [], 'status': 'OK'})
+        return web.json_response({'results': [{
+            'cash_amount': _seed(ticker) % 300 / 100,
+            'ex_dividend_date': '2024-05-10',
+            'pay_date': '2024-05-16',
+            'record_date': '2024-05-13',
+            'ticker': ticker
+        }], 'status': 'OK'})
@@ -0,0 +1,532 @@
+"""
+Load test the bot's cogs against local fake upstreams.
+
+The real Wiki, Education, Stocks and Fun cogs are loaded into a bot that
+never connects to Discord, and their commands are driven with synthetic
+interactions at a fixed concurrency. All upstream traffic goes to the fake
+server in benchmarks/fake_upstreams.py, which can add latency, errors and
+429s per host.
+
+Usage:
+    python -m benchmarks.load_test
+    python -m benchmarks.load_test --requests 20000 --concurrency 200 --latency 0.05
+    python -m benchmarks.load_test --fault finnhub.io:latency=1.5,throttle_rate=0.2
+    python -m benchmarks.load_test --compare benchmarks/results/baseline.json --max-regression 10
+
+Results are written as JSON (see --output) so runs can be compared between commits.
+"""
+import argparse
+import asyncio
+import dataclasses
+import datetime
+import json
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from pathlib import Path
+from types import MappingProxyType
+
+ROOT_PATH = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT_PATH))
+
+import discord
+from discord.ext import commands
+
+from benchmarks.fake_upstreams import BODIES, COUNTRY_COUNT, HOSTS, FakeUpstreams, Fault, MISSING_PREFIX
+from utils import cache
+from utils import config
+from utils import countries
+from utils import http
+from utils import logger
+from utils import metrics
+from utils import quran
+from utils import rate_limit
+from utils import refresher
+from utils import symbols
+from utils.resilience import set_interaction_deadline
+
+EXTENSIONS = ('commands.wiki', 'commands.education', 'commands.stocks', 'commands.fun')
+
+# Discord drops interactions that aren't answered within this many seconds
+INTERACTION_DEADLINE = 3.0
+
+DEFAULT_OUTPUT = ROOT_PATH / 'benchmarks' / 'results' / 'load_test.json'
+
+# How often the event loop lag is sampled, in seconds
+LOOP_LAG_INTERVAL = 0.01
+
+
+def _key(rng, keys: int, missing_rate: float, name: str) -> str:
+    # Skewed towards low keys, so popular keys repeat like they do in real traffic
+    if rng.random() < missing_rate:
+        return f"{MISSING_PREFIX} {name} {rng.randrange(keys)}"
+    return f"{name} {int(keys * rng.random() ** 2)}"
+
+
+def _symbol(rng, keys: int, missing_rate: float) -> str:
+    if rng.random() < missing_rate:
+        return f"{MISSING_PREFIX.upper()}{rng.randrange(keys)}"
+    return f"S{int(keys * rng.random() ** 2):05d}"
+
+
+# Command name -> (weight, function building its arguments from (rng, keys, missing rate))
+WORKLOAD = {
+    'wiki': (20, lambda rng, keys, missing: {'topic': _key(rng, keys, missing, 'topic')}),
+    'random_wiki': (4, lambda rng, keys, missing: {}),
+    'trending_wiki': (4, lambda rng, keys, missing: {}),
+    'wiki_categories': (4, lambda rng, keys, missing: {'title': _key(rng, keys, missing, 'article')}),
+    'wiki_sections': (4, lambda rng, keys, missing: {'title': _key(rng, keys, missing, 'article')}),
+    'fact': (4, lambda rng, keys, missing: {}),
+    'word_of_the_day': (1, lambda rng, keys, missing: {}),
+    'celestial': (4, lambda rng, keys, missing: {'name': rng.choice(list(BODIES))}),
+    'country': (8, lambda rng, keys, missing: {'name': f"Country {rng.randrange(COUNTRY_COUNT)}"}),
+    'quran': (4, lambda rng, keys, missing: {}),
+    'quran_verse': (4, lambda rng, keys, missing: {'reference': f"{rng.randint(1, 114)}:{rng.randint(1, 50)}"}),
+    'stock': (12, lambda rng, keys, missing: {'symbol': _symbol(rng, keys, missing)}),
+    'stocks': (4, lambda rng, keys, missing: {
+        'symbols': ','.join(_symbol(rng, keys, missing) for _ in range(5))}),
+    'stock_info': (4, lambda rng, keys, missing: {'symbol': _symbol(rng, keys, missing)}),
+    'symbol_search': (4, lambda rng, keys, missing: {'query': _symbol(rng, keys, missing)[:3]}),
+    'dividends': (4, lambda rng, keys, missing: {'symbol': _symbol(rng, keys, missing)}),
+    'kous': (2, lambda rng, keys, missing: {}),
+    'sharmouta': (2, lambda rng, keys, missing: {}),
+}
+
+
+class BenchmarkBot(commands.Bot):
+    """
+    A bot that loads the cogs but never connects to the gateway.
+    """
+
+    @property
+    def latency(self):
+        return 0.0
+
+
+class FakeResponse:
+    def __init__(self, interaction):
+        self._interaction = interaction
+        self._done = False
+
+    def is_done(self):
+        return self._done
+
+    async def _respond(self, deferred: bool):
+        if self._done:
+            raise discord.InteractionResponded(self._interaction)
+        await self._interaction.discord_call()
+        self._done = True
+        self._interaction.first_response_at = time.perf_counter()
+        self._interaction.deferred = deferred
+
+    async def send_message(self, content=None, **kwargs):
+        await self._respond(deferred=False)
+        if 'view' in kwargs and kwargs['view'] is None:
+            # discord.py posts the message, then fails registering the missing view
+            raise AttributeError("'NoneType' object has no attribute 'is_finished'")
+        self._interaction.completed_at = time.perf_counter()
+
+    async def defer(self, **kwargs):
+        await self._respond(deferred=True)
+
+
+class FakeFollowup:
+    def __init__(self, interaction):
+        self._interaction = interaction
+
+    async def send(self, content=None, **kwargs):
+        if 'view' in kwargs and kwargs['view'] is None:
+            # discord.py rejects it before sending anything
+            raise TypeError(f"expected view parameter to be of type View not {kwargs['view'].__class__.__name__}")
+        await self._interaction.discord_call()
+        if self._interaction.completed_at is None:
+            self._interaction.completed_at = time.perf_counter()
+
+
+class FakeInteraction:
+    """
+    Just enough of discord.Interaction for the cogs, the responder and the metrics.
+    """
+
+    _ids = iter(range(1, 1 << 62))
+
+    def __init__(self, command, discord_latency: float = 0.0):
+        self.id = next(self._ids)
+        self.created_at = datetime.datetime.now(datetime.timezone.utc)
+        self.command = command
+        self.guild_id = 1
+        self.user = discord.Object(id=self.id)
+        self.extras = {}
+        self.response = FakeResponse(self)
+        self.followup = FakeFollowup(self)
+
+        self.discord_latency = discord_latency
+        self.started_at = time.perf_counter()
+        self.first_response_at = None
+        self.completed_at = None
+        self.deferred = False
+
+    async def discord_call(self):
+        # Stands in for the round trip of a call to Discord's API
+        if self.discord_latency:
+            await asyncio.sleep(self.discord_latency)
+
+    async def edit_original_response(self, **kwargs):
+        await self.discord_call()
+
+    async def delete_original_response(self):
+        await self.discord_call()
+
+
+@dataclasses.dataclass
+class Sample:
+    command: str
+    status: str
+    deferred: bool
+    first_response: float = None  # Seconds from the interaction to its first response or defer
+    complete: float = None        # Seconds from the interaction to its full answer
+
+
+async def invoke(command, arguments: dict, discord_latency: float) -> Sample:
+    """
+    Run a command the way the bot's command tree does, and time its responses.
+    """
+    interaction = FakeInteraction(command, discord_latency)
+    set_interaction_deadline(interaction)
+    logger.bind_interaction(interaction)
+    metrics.start_command(interaction)
+    try:
+        await command.callback(command.binding, interaction, **arguments)
+    except Exception as e:
+        status = type(getattr(e, 'original', e)).__name__
+        metrics.record_command(interaction, 'error')
+    else:
+        status = 'ok'
+        metrics.record_command(interaction, 'ok')
+
+    def since_start(timestamp):
+        return None if timestamp is None else timestamp - interaction.started_at
+
+    return Sample(command.name, status, interaction.deferred,
+                  since_start(interaction.first_response_at), since_start(interaction.completed_at))
+
+
+async def sample_loop_lag(samples: list, interval: float = LOOP_LAG_INTERVAL):
+    while True:
+        started_at = time.perf_counter()
+        await asyncio.sleep(interval)
+        samples.append(max(0.0, time.perf_counter() - started_at - interval))
+
+
+async def run_load(bot, plan: list, concurrency: int, discord_latency: float) -> list:
+    """
+    Run the planned (command, arguments) pairs with at most `concurrency` in flight.
+    """
+    samples = []
+    pending = iter(plan)
+
+    async def worker():
+        for command, arguments in pending:
+            # Each interaction runs in its own task, so its context (deadline, trace ID) is its own
+            samples.append(await asyncio.create_task(invoke(command, arguments, discord_latency)))
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return samples
+
+
+def build_plan(bot, names: list, requests: int, keys: int, missing_rate: float, rng) -> list:
+    commands_by_name = {command.name: command for command in bot.tree.get_commands()}
+    weights = [WORKLOAD[name][0] for name in names]
+    plan = []
+    for name in rng.choices(names, weights=weights, k=requests):
+        plan.append((commands_by_name[name], WORKLOAD[name][1](rng, keys, missing_rate)))
+    return plan
+
+
+def percentile(values: list, fraction: float) -> float:
+    """
+    Nearest-rank percentile of a list of numbers, or None if it is empty.
+    """
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, max(0, int(round(fraction * len(values))) - 1))]
+
+
+def _milliseconds(value):
+    return None if value is None else round(value * 1000, 3)
+
+
+def summarize(samples: list, duration: float) -> dict:
+    first_responses = [sample.first_response for sample in samples if sample.first_response is not None]
+    completes = [sample.complete for sample in samples if sample.complete is not None]
+    statuses = defaultdict(int)
+    for sample in samples:
+        statuses[sample.status] += 1
+    return {
+        'requests': len(samples),
+        'throughput': round(len(samples) / duration, 2) if duration else None,
+        'statuses': dict(statuses),
+        'deferred': sum(sample.deferred for sample in samples),
+        'unanswered': len(samples) - len(first_responses),
+        'late': sum(value > INTERACTION_DEADLINE for value in first_responses),
+        'first_response_p50_ms': _milliseconds(percentile(first_responses, 0.50)),
+        'first_response_p99_ms': _milliseconds(percentile(first_responses, 0.99)),
+        'complete_p50_ms': _milliseconds(percentile(completes, 0.50)),
+        'complete_p99_ms': _milliseconds(percentile(completes, 0.99)),
+    }
+
+
+def _diff_counts(after: dict, before: dict) -> dict:
+    diff = {}
+    for host, statuses in after.items():
+        changed = {str(status): count - before.get(host, {}).get(status, 0) for status, count in statuses.items()}
+        changed = {status: count for status, count in changed.items() if count}
+        if changed:
+            diff[host] = changed
+    return diff
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT_PATH, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def install_config(directory: Path, real_rate_limits: bool, log_level: str):
+    """
+    Give the cogs a configuration with dummy credentials that doesn't touch .env or data/.
+    """
+    extra = {'logging': {'level': log_level}, 'metrics': {'enabled': False}}
+    if not real_rate_limits:
+        # Measure the bot, not the upstreams' quotas
+        extra['rate_limits'] = {upstream: {'rate': 1e9, 'burst': 1e9, 'max_queue': 1e9}
+                                for upstream in rate_limit.DEFAULT_LIMITS}
+
+    loaded = config.Config(settings_path=directory / 'settings.json', env_path=directory / '.env')
+    # No Finnhub key, so the Stocks cog doesn't open the real trades websocket
+    loaded.settings = config.Settings(polygon_key='benchmark', api_ninja_key='benchmark',
+                                      extra=MappingProxyType(extra))
+    config._config = loaded
+    logger.setup_logging(extra['logging'])
+
+
+async def prepare_data(directory: Path):
+    """
+    Build the country and symbol snapshots and the Quran corpus from the fake upstreams, into a scratch directory.
+    """
+    countries.SNAPSHOT_PATH = directory / 'countries.json'
+    await countries.refresh_snapshot()
+    symbols.SNAPSHOT_PATH = directory / 'symbols.json'
+    await symbols.refresh_snapshot()
+
+    quran.CORPUS_PATH = directory / 'quran.bin'
+    await quran.build_corpus()
+
+
+async def benchmark(args) -> dict:
+    faults = {}
+    if args.latency or args.jitter or args.error_rate or args.throttle_rate:
+        default = Fault(args.latency, args.jitter, args.error_rate, args.throttle_rate)
+        faults = {host: default for host in HOSTS}
+    for host, fault in args.fault:
+        faults[host] = fault
+
+    names = args.commands or list(WORKLOAD)
+    unknown = set(names) - set(WORKLOAD)
+    if unknown:
+        raise SystemExit(f"Unknown commands: {', '.join(sorted(unknown))}")
+
+    with tempfile.TemporaryDirectory() as scratch:
+        scratch = Path(scratch)
+        install_config(scratch, args.real_rate_limits, args.log_level)
+
+        upstreams = FakeUpstreams(seed=args.seed)
+        await upstreams.start()
+        upstreams.install()
+        await http.open_session()
+        bot = BenchmarkBot(command_prefix='!', intents=discord.Intents.none())
+        refresher_task = None
+        try:
+            # Build the local datasets before the faults are switched on
+            await prepare_data(scratch)
+            for extension in EXTENSIONS:
+                await bot.load_extension(extension)
+            # Fill the background datasets the extensions registered, as the bot does on startup
+            refresher_task = refresher.start_refresher()
+            await asyncio.gather(*(dataset.revalidate(force=True) for dataset in refresher.DATASETS.values()))
+            upstreams.faults.update(faults)
+
+            rng = random.Random(args.seed)
+            if args.warmup:
+                warmup = build_plan(bot, names, args.warmup, args.keys, args.missing_rate, rng)
+                await run_load(bot, warmup, args.concurrency, args.discord_latency)
+
+            plan = build_plan(bot, names, args.requests, args.keys, args.missing_rate, rng)
+            counts_before = upstreams.request_counts()
+            lag_samples = []
+            lag_task = asyncio.create_task(sample_loop_lag(lag_samples))
+            started_at = time.perf_counter()
+            samples = await run_load(bot, plan, args.concurrency, args.discord_latency)
+            duration = time.perf_counter() - started_at
+            lag_task.cancel()
+            counts_after = upstreams.request_counts()
+        finally:
+            if refresher_task is not None:
+                refresher.stop_refresher(refresher_task)
+            await bot.close()
+            await http.close_session()
+            await upstreams.stop()
+            logger.shutdown_logging()
+
+    by_command = defaultdict(list)
+    for sample in samples:
+        by_command[sample.command].append(sample)
+
+    return {
+        'benchmark': 'load_test',
+        'commit': git_commit(),
+        'timestamp': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        'python': platform.python_version(),
+        'parameters': {
+            'requests': args.requests,
+            'concurrency': args.concurrency,
+            'warmup': args.warmup,
+            'keys': args.keys,
+            'missing_rate': args.missing_rate,
+            'discord_latency': args.discord_latency,
+            'real_rate_limits': args.real_rate_limits,
+            'seed': args.seed,
+            'commands': names,
+            'faults': {host: dataclasses.asdict(fault) for host, fault in sorted(faults.items())},
+        },
+        'duration': round(duration, 3),
+        'summary': summarize(samples, duration),
+        'commands': {name: summarize(command_samples, duration)
+                     for name, command_samples in sorted(by_command.items())},
+        'loop_lag_ms': {
+            'p50': _milliseconds(percentile(lag_samples, 0.50)),
+            'p99': _milliseconds(percentile(lag_samples, 0.99)),
+            'max': _milliseconds(max(lag_samples, default=None)),
+        },
+        'upstream_requests': _diff_counts(counts_after, counts_before),
+        'caches': metrics.registry_stats(cache.CACHES),
+    }
+
+
+# Lower is better for these summary fields; higher is better for throughput
+COMPARED_FIELDS = ('first_response_p50_ms', 'first_response_p99_ms', 'complete_p50_ms', 'complete_p99_ms')
+
+
+def compare(current: dict, baseline: dict) -> list:
+    """
+    Compare two results.
+
+    Returns:
+        list: (scope, field, baseline, current, change in percent) rows, where a positive
+            change is always a regression.
+    """
+    rows = []
+    scopes = [('all', current['summary'], baseline['summary'])]
+    scopes += [(name, summary, baseline['commands'][name])
+               for name, summary in current['commands'].items() if name in baseline['commands']]
+    for scope, now, before in scopes:
+        for field in ('throughput',) + COMPARED_FIELDS:
+            old, new = before.get(field), now.get(field)
+            if not old or new is None:
+                continue
+            change = (new - old) / old * 100
+            if field == 'throughput':
+                change = -change
+            rows.append((scope, field, old, new, round(change, 1)))
+    return rows
+
+
+def print_report(results: dict):
+    print(f"{results['summary']['requests']} requests in {results['duration']:.2f}s "
+          f"({results['summary']['throughput']} req/s), loop lag p99 {results['loop_lag_ms']['p99']} ms")
+    print(f"{'command':<18}{'count':>7}{'ok':>7}{'deferred':>10}{'late':>6}"
+          f"{'first p50':>11}{'first p99':>11}{'done p50':>10}{'done p99':>10}")
+    for name, summary in [('all', results['summary'])] + list(results['commands'].items()):
+        print(f"{name:<18}{summary['requests']:>7}{summary['statuses'].get('ok', 0):>7}{summary['deferred']:>10}"
+              f"{summary['late']:>6}{summary['first_response_p50_ms'] or 0:>11.1f}"
+              f"{summary['first_response_p99_ms'] or 0:>11.1f}{summary['complete_p50_ms'] or 0:>10.1f}"
+              f"{summary['complete_p99_ms'] or 0:>10.1f}")
+    print("Upstream requests:")
+    for host, statuses in results['upstream_requests'].items():
+        print(f"  {host:<28}{', '.join(f'{status}: {count}' for status, count in sorted(statuses.items()))}")
+
+
+def parse_fault(value: str):
+    """
+    Parse HOST:field=value,... e.g. finnhub.io:latency=0.5,error_rate=0.1
+    """
+    host, _, spec = value.partition(':')
+    fields = {}
+    for item in filter(None, spec.split(',')):
+        name, _, number = item.partition('=')
+        if name not in {field.name for field in dataclasses.fields(Fault)}:
+            raise argparse.ArgumentTypeError(f"Unknown fault field {name!r}")
+        fields[name] = float(number)
+    return host, Fault(**fields)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the bot's cogs against local fake upstreams.")
+    parser.add_argument('--requests', type=int, default=5000, help="Interactions to run")
+    parser.add_argument('--concurrency', type=int, default=100, help="Interactions in flight at once")
+    parser.add_argument('--warmup', type=int, default=0, help="Interactions to run first, excluded from results")
+    parser.add_argument('--keys', type=int, default=1000, help="Distinct topics/symbols to draw from")
+    parser.add_argument('--missing-rate', type=float, default=0.05, help="Fraction of lookups for missing keys")
+    parser.add_argument('--commands', nargs='+', metavar='COMMAND', help="Only run these commands")
+    parser.add_argument('--latency', type=float, default=0.0, help="Seconds added to every upstream response")
+    parser.add_argument('--jitter', type=float, default=0.0, help="Up to this many extra seconds per response")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="Fraction of upstream responses that are 503s")
+    parser.add_argument('--throttle-rate', type=float, default=0.0,
+                        help="Fraction of upstream responses that are 429s")
+    parser.add_argument('--fault', type=parse_fault, action='append', default=[], metavar='HOST:FIELD=VALUE,...',
+                        help="Per-host fault, overriding the flags above; fields: "
+                             + ', '.join(field.name for field in dataclasses.fields(Fault)))
+    parser.add_argument('--discord-latency', type=float, default=0.0, help="Seconds per call to Discord's API")
+    parser.add_argument('--real-rate-limits', action='store_true', help="Keep the configured upstream rate limits")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--log-level', default='WARNING')
+    parser.add_argument('--output', default=str(DEFAULT_OUTPUT), help="Where to write the JSON results, - for stdout")
+    parser.add_argument('--compare', help="Earlier results to compare against")
+    parser.add_argument('--max-regression', type=float,
+                        help="With --compare, exit with status 1 if any overall metric regresses by more than this "
+                             "many percent")
+    args = parser.parse_args()
+
+    results = asyncio.run(benchmark(args))
+
+    if args.output == '-':
+        json.dump(results, sys.stdout, indent=2)
+        print()
+    else:
+        output = Path(args.output)
+        output.parent.mkdir(parents=True, exist_ok=True)
+        output.write_text(json.dumps(results, indent=2))
+        print_report(results)
+        print(f"Wrote {output}")
+
+    if args.compare:
+        baseline = json.loads(Path(args.compare).read_text())
+        rows = compare(results, baseline)
+        print(f"Compared with {args.compare} (commit {baseline.get('commit')}); positive change is worse:")
+        for scope, field, old, new, change in rows:
+            print(f"  {scope:<18}{field:<24}{old:>12}{new:>12}{change:>+9.1f}%")
+        if args.max_regression is not None:
+            regressions = [row for row in rows if row[0] == 'all' and row[4] > args.max_regression]
+            if regressions:
+                sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
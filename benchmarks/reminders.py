@@ -0,0 +1,179 @@
+"""
+Benchmark scheduling, persisting and firing a large number of reminders.
+
+The real ReminderScheduler and ReminderStore are used with a delivery
+callback that only records when each reminder fired, so the numbers show the
+scheduler's own cost: memory per pending reminder, CPU time to schedule and
+fire, how late reminders fire, and how long snapshots and recovery take.
+
+Usage:
+    python -m benchmarks.reminders
+    python -m benchmarks.reminders --count 100000 --spread 10 --channels 5000
+"""
+import argparse
+import asyncio
+import datetime
+import json
+import platform
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+ROOT_PATH = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT_PATH))
+
+from benchmarks.load_test import git_commit, percentile
+from utils.reminders import ReminderScheduler, ReminderStore
+
+DEFAULT_OUTPUT = ROOT_PATH / 'benchmarks' / 'results' / 'reminders.json'
+
+
+class Phase:
+    """
+    Measures the wall and CPU time of a block.
+    """
+
+    def __enter__(self):
+        self._wall = time.perf_counter()
+        self._cpu = time.process_time()
+        return self
+
+    def __exit__(self, *exc):
+        self.wall = time.perf_counter() - self._wall
+        self.cpu = time.process_time() - self._cpu
+
+    def result(self, count: int) -> dict:
+        return {
+            'wall_s': round(self.wall, 4),
+            'cpu_s': round(self.cpu, 4),
+            'cpu_us_per_reminder': round(self.cpu / count * 1e6, 3) if count else None
+        }
+
+
+async def benchmark(args) -> dict:
+    rng = random.Random(args.seed)
+    lateness = []
+    batches = []
+
+    async def deliver(batch):
+        now = time.time()
+        batches.append(len(batch))
+        lateness.extend(now - reminder.due_at for reminder in batch)
+        if args.delivery_latency:
+            await asyncio.sleep(args.delivery_latency)
+        return []
+
+    with tempfile.TemporaryDirectory() as scratch:
+        scratch = Path(scratch)
+
+        async def schedule_all(scheduler, start):
+            for index in range(args.count):
+                await scheduler.add(start + rng.random() * args.spread, user_id=rng.randrange(args.users),
+                                    channel_id=rng.randrange(args.channels), guild_id=1, message=f"Reminder {index}")
+
+        # Trace the memory held by a scheduler full of reminders, once its log is flushed
+        tracemalloc.start()
+        traced = ReminderScheduler(ReminderStore(scratch / 'traced.json', scratch / 'traced.log'), deliver)
+        await schedule_all(traced, time.time() + 3600)
+        await traced.store.flush()
+        memory, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        del traced
+
+        store = ReminderStore(scratch / 'reminders.json', scratch / 'reminders.log')
+        scheduler = ReminderScheduler(store, deliver)
+        with Phase() as schedule:
+            await schedule_all(scheduler, time.time() + args.delay)
+
+        with Phase() as flush:
+            await store.flush()
+        log_bytes = store.log_path.stat().st_size
+
+        with Phase() as snapshot:
+            await scheduler.save(snapshot=True)
+        snapshot_bytes = store.snapshot_path.stat().st_size
+
+        with Phase() as recovery:
+            recovered = ReminderScheduler(ReminderStore(store.snapshot_path, store.log_path), deliver)
+            await recovered.load()
+        if len(recovered) != args.count:
+            raise SystemExit(f"Recovered {len(recovered)} reminders, expected {args.count}")
+
+        # Fire everything, sampling the event loop lag meanwhile
+        lag = []
+
+        async def sample_lag(interval=0.01):
+            while True:
+                started_at = time.perf_counter()
+                await asyncio.sleep(interval)
+                lag.append(max(0.0, time.perf_counter() - started_at - interval))
+
+        lag_task = asyncio.create_task(sample_lag())
+        run_task = asyncio.create_task(scheduler.run())
+        with Phase() as firing:
+            while len(lateness) < args.count:
+                await asyncio.sleep(0.05)
+        run_task.cancel()
+        lag_task.cancel()
+        # Wall time includes waiting for reminders to come due, so only CPU time is meaningful here
+        await store.flush()
+
+    return {
+        'benchmark': 'reminders',
+        'commit': git_commit(),
+        'timestamp': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        'python': platform.python_version(),
+        'parameters': {key: value for key, value in vars(args).items() if key != 'output'},
+        'schedule': schedule.result(args.count),
+        'memory_bytes': memory,
+        'memory_bytes_per_reminder': round(memory / args.count, 1),
+        'log_flush': flush.result(args.count),
+        'log_bytes': log_bytes,
+        'snapshot': snapshot.result(args.count),
+        'snapshot_bytes': snapshot_bytes,
+        'recovery': recovery.result(args.count),
+        'firing': firing.result(args.count),
+        'batches': len(batches),
+        'largest_batch': max(batches, default=0),
+        'lateness_ms': {
+            'p50': round(percentile(lateness, 0.50) * 1000, 3),
+            'p99': round(percentile(lateness, 0.99) * 1000, 3),
+            'max': round(max(lateness) * 1000, 3),
+        },
+        'loop_lag_ms': {
+            'p50': round((percentile(lag, 0.50) or 0) * 1000, 3),
+            'p99': round((percentile(lag, 0.99) or 0) * 1000, 3),
+            'max': round(max(lag, default=0) * 1000, 3),
+        },
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the reminder scheduler.")
+    parser.add_argument('--count', type=int, default=100_000, help="Reminders to schedule")
+    parser.add_argument('--delay', type=float, default=5.0, help="Seconds until the first reminder is due")
+    parser.add_argument('--spread', type=float, default=5.0, help="Seconds over which the reminders come due")
+    parser.add_argument('--users', type=int, default=20_000)
+    parser.add_argument('--channels', type=int, default=2_000)
+    parser.add_argument('--delivery-latency', type=float, default=0.0, help="Seconds each delivered batch takes")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default=str(DEFAULT_OUTPUT), help="Where to write the JSON results, - for stdout")
+    args = parser.parse_args()
+
+    results = asyncio.run(benchmark(args))
+    text = json.dumps(results, indent=2)
+    if args.output == '-':
+        print(text)
+    else:
+        output = Path(args.output)
+        output.parent.mkdir(parents=True, exist_ok=True)
+        output.write_text(text)
+        print(text)
+        print(f"Wrote {output}")
+
+
+if __name__ == '__main__':
+    main()
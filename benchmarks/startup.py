@@ -0,0 +1,217 @@
+"""
+Benchmark cold starts: from launching Python to every extension being loaded.
+
+Each run is a fresh interpreter, started from a scratch working directory,
+that goes through the same steps as Sharmouta.setup_hook (HTTP session,
+database, extensions) without connecting to Discord. Two loading modes are
+compared, interleaved so they see the same machine conditions:
+
+    sequential  load the extensions one by one, importing each on the event loop (the old path)
+    concurrent  import the extensions in a worker thread while the database opens, then load them all at once
+
+With --baseline-ref, another commit is checked out into a temporary git
+worktree and started with the sequential loader too, to compare against the
+code as it was (e.g. before an import was made lazy).
+
+Usage:
+    python -m benchmarks.startup
+    python -m benchmarks.startup --runs 20 --modes concurrent
+    python -m benchmarks.startup --baseline-ref HEAD~1
+"""
+import argparse
+import asyncio
+import datetime
+import json
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT_PATH = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT_PATH))
+
+DEFAULT_OUTPUT = ROOT_PATH / 'benchmarks' / 'results' / 'startup.json'
+MODES = ('sequential', 'concurrent')
+
+# Sent instead of real upstream requests, e.g. the country snapshot refresh; nothing listens there
+UNREACHABLE = 'http://127.0.0.1:9'
+
+
+async def start_bot(mode: str, root: Path, scratch: Path, imports_started_at: float) -> dict:
+    import discord
+    from discord.ext import commands
+    from types import MappingProxyType
+
+    from utils import config, countries, database, http, logger, quran, reminders
+    if mode == 'concurrent':
+        from utils import extensions
+
+    imported_at = time.perf_counter()
+
+    # A configuration and data directory that don't touch .env or data/
+    loaded = config.Config(settings_path=scratch / 'settings.json', env_path=scratch / '.env')
+    loaded.settings = config.Settings(extra=MappingProxyType({'metrics': {'enabled': False},
+                                                              'logging': {'level': 'WARNING'}}))
+    config._config = loaded
+    logger.setup_logging(loaded.settings.extra['logging'])
+    countries.SNAPSHOT_PATH = scratch / 'countries.json'
+    quran.CORPUS_PATH = scratch / 'quran.bin'
+    reminders.SNAPSHOT_PATH = scratch / 'reminders.json'
+    reminders.LOG_PATH = scratch / 'reminders.log'
+    for host in ('restcountries.com', 'api.alquran.cloud'):
+        http.redirect_upstream(host, UNREACHABLE)
+
+    bot = commands.Bot(command_prefix='!', intents=discord.Intents.none())
+    started_at = time.perf_counter()
+    if mode == 'concurrent':
+        names = extensions.discover_extensions()
+        imports = asyncio.create_task(extensions.preimport(names))
+        await http.open_session()
+        await database.open_database(scratch / 'bot.db', warm=False)
+        import_timings = await imports
+        await database.warm_caches()
+        timings = await extensions.load_extensions(bot, names, import_timings)
+    else:
+        # Only what every version of the bot has, so this also runs against a baseline checkout
+        names = [f'{package}.{path.stem}' for package in ('commands', 'events')
+                 for path in sorted((root / package).glob('*.py')) if path.name != '__init__.py']
+        await http.open_session()
+        await database.open_database(scratch / 'bot.db')
+        timings = {}
+        for name in names:
+            loading_at = time.perf_counter()
+            await bot.load_extension(name)
+            timings[name] = time.perf_counter() - loading_at
+    ready_at = time.perf_counter()
+
+    await bot.close()
+    await http.close_session()
+    await database.close_database()
+    logger.shutdown_logging()
+
+    if len(timings) != len(names):
+        raise SystemExit(f"Only {len(timings)} of {len(names)} extensions loaded")
+    return {
+        'imports_s': imported_at - imports_started_at,
+        'setup_s': ready_at - started_at,
+        'extensions': timings,
+    }
+
+
+def run_child(args):
+    """
+    One cold start, reporting its timings as JSON on stdout.
+    """
+    # The bot's modules come from the tree being measured, which may be a baseline checkout
+    root = Path(args.root)
+    sys.path.insert(0, str(root))
+    imports_started_at = time.perf_counter()
+    with tempfile.TemporaryDirectory() as scratch:
+        result = asyncio.run(start_bot(args.child, root, Path(scratch), imports_started_at))
+    # From the parent's launch, so the interpreter's own startup counts too
+    result['ready_s'] = time.time() - args.launched_at
+    print(json.dumps(result))
+
+
+def launch(mode: str, root: Path, directory: str) -> dict:
+    launched_at = time.time()
+    completed = subprocess.run([sys.executable, str(Path(__file__).resolve()), '--child', mode,
+                                '--root', str(root), '--launched-at', repr(launched_at)],
+                               cwd=directory, capture_output=True, text=True)
+    if completed.returncode:
+        raise SystemExit(f"{mode} start failed:\n{completed.stderr}")
+    result = json.loads(completed.stdout.strip().splitlines()[-1])
+    # Includes shutting the interpreter down, unlike ready_s
+    result['process_s'] = time.time() - launched_at
+    return result
+
+
+def summarize(runs: list) -> dict:
+    def milliseconds(values):
+        return {
+            'median': round(statistics.median(values) * 1000, 2),
+            'min': round(min(values) * 1000, 2),
+            'p90': round((statistics.quantiles(values, n=10)[-1] if len(values) > 1 else values[0]) * 1000, 2),
+        }
+
+    names = sorted(runs[0]['extensions'])
+    return {
+        'ready_ms': milliseconds([run['ready_s'] for run in runs]),
+        'imports_ms': milliseconds([run['imports_s'] for run in runs]),
+        'setup_ms': milliseconds([run['setup_s'] for run in runs]),
+        'process_ms': milliseconds([run['process_s'] for run in runs]),
+        'extension_setup_median_ms': {name: round(statistics.median(run['extensions'][name] for run in runs) * 1000, 2)
+                                      for name in names},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the bot's cold start.")
+    parser.add_argument('--runs', type=int, default=10, help="Cold starts per mode")
+    parser.add_argument('--modes', nargs='+', choices=MODES, default=list(MODES))
+    parser.add_argument('--baseline-ref', help="Also start this commit, with the sequential loader")
+    parser.add_argument('--output', default=str(DEFAULT_OUTPUT), help="Where to write the JSON results, - for stdout")
+    parser.add_argument('--child', choices=MODES, help=argparse.SUPPRESS)
+    parser.add_argument('--root', default=str(ROOT_PATH), help=argparse.SUPPRESS)
+    parser.add_argument('--launched-at', type=float, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(args)
+        return
+
+    # Imported here so the cold starts don't import the load test's modules
+    from benchmarks.load_test import git_commit
+
+    # (name, mode, tree) for each kind of start
+    starts = [(mode, mode, ROOT_PATH) for mode in args.modes]
+    runs = {name: [] for name, _, _ in starts}
+    # Start from a directory other than the bot's, which extension discovery must not depend on
+    with tempfile.TemporaryDirectory() as directory:
+        if args.baseline_ref:
+            baseline = Path(directory) / 'baseline'
+            subprocess.run(['git', 'worktree', 'add', '--detach', str(baseline), args.baseline_ref],
+                           cwd=ROOT_PATH, capture_output=True, check=True)
+            starts.append(('baseline', 'sequential', baseline))
+            runs['baseline'] = []
+        try:
+            for _ in range(args.runs):
+                for name, mode, root in starts:
+                    runs[name].append(launch(mode, root, directory))
+        finally:
+            if args.baseline_ref:
+                shutil.rmtree(baseline, ignore_errors=True)
+                subprocess.run(['git', 'worktree', 'prune'], cwd=ROOT_PATH, capture_output=True)
+
+    results = {
+        'benchmark': 'startup',
+        'commit': git_commit(),
+        'timestamp': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        'python': platform.python_version(),
+        'parameters': {'runs': args.runs, 'modes': args.modes, 'baseline_ref': args.baseline_ref},
+        'modes': {name: summarize(name_runs) for name, name_runs in runs.items()},
+    }
+    # How many times faster than the baseline (or the sequential loader) each start is, by median
+    reference = 'baseline' if 'baseline' in runs else 'sequential'
+    if reference in runs:
+        reference_ms = results['modes'][reference]['ready_ms']['median']
+        results['ready_speedup'] = {name: round(reference_ms / summary['ready_ms']['median'], 3)
+                                    for name, summary in results['modes'].items() if name != reference}
+
+    text = json.dumps(results, indent=2)
+    if args.output == '-':
+        print(text)
+    else:
+        output = Path(args.output)
+        output.parent.mkdir(parents=True, exist_ok=True)
+        output.write_text(text)
+        print(text)
+        print(f"Wrote {output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,179 @@
+"""
+Benchmark the local symbol index: memory, build time and lookup latency.
+
+By default the index is built from a synthetic listing the size of Finnhub's
+full US listing (about 30k symbols), with descriptions built from words that
+are common in real company names, so word prefixes are shared like real ones.
+--snapshot uses a real data/symbols.json instead.
+
+Measured:
+    - the snapshot's size on disk, and the index's memory (tracemalloc), next to
+      the memory the same listing takes as Finnhub's list of dicts
+    - how long the index takes to build
+    - lookup latency for symbol prefixes, exact symbols, company name words and
+      the full autocomplete path (search plus building the choices)
+
+Usage:
+    python -m benchmarks.symbols
+    python -m benchmarks.symbols --symbols 60000 --lookups 50000
+    python -m benchmarks.symbols --snapshot data/symbols.json
+"""
+import argparse
+import datetime
+import gc
+import json
+import platform
+import random
+import string
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+ROOT_PATH = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT_PATH))
+
+from benchmarks.load_test import _milliseconds, git_commit, percentile
+from utils import symbols
+
+DEFAULT_OUTPUT = ROOT_PATH / 'benchmarks' / 'results' / 'symbols.json'
+
+# Words common in listed company names, most frequent first
+NAME_WORDS = ('INC', 'CORP', 'HOLDINGS', 'GROUP', 'TRUST', 'ETF', 'FUND', 'CAPITAL', 'TECHNOLOGIES', 'ACQUISITION',
+              'THERAPEUTICS', 'BANCORP', 'ENERGY', 'FINANCIAL', 'PHARMACEUTICALS', 'INTERNATIONAL', 'GLOBAL',
+              'SYSTEMS', 'RESOURCES', 'INDUSTRIES', 'MEDICAL', 'BIOSCIENCES', 'PARTNERS', 'REALTY', 'MINING',
+              'SOLUTIONS', 'NETWORKS', 'SEMICONDUCTOR', 'SOFTWARE', 'DIGITAL', 'AMERICAN', 'FIRST', 'NATIONAL',
+              'PACIFIC', 'ATLANTIC', 'GOLD', 'SILVER', 'OIL', 'GAS', 'POWER', 'WATER', 'FOODS', 'MOTORS', 'AIRLINES')
+TYPES = (('Common Stock', 60), ('ETP', 15), ('ADR', 6), ('REIT', 4), ('Equity WRT', 5), ('Unit', 4),
+         ('Preference', 3), ('Closed-End Fund', 3))
+
+
+def synthetic_listing(size: int, seed: int) -> list:
+    """
+    A listing shaped like Finnhub's /stock/symbol answer for exchange=US.
+    """
+    rng = random.Random(seed)
+    names = [''.join(rng.choice(string.ascii_uppercase) for _ in range(rng.randint(4, 9))) for _ in range(size // 3)]
+    types, weights = zip(*TYPES)
+    listing = {}
+    while len(listing) < size:
+        symbol = ''.join(rng.choice(string.ascii_uppercase) for _ in range(rng.choice((1, 2, 3, 3, 4, 4, 4, 5))))
+        if rng.random() < 0.05:
+            symbol += rng.choice(('.A', '.B', '.WS', '.U'))
+        if symbol in listing:
+            continue
+        words = [rng.choice(names)] + [NAME_WORDS[int(len(NAME_WORDS) * rng.random() ** 2)]
+                                       for _ in range(rng.randint(1, 3))]
+        listing[symbol] = {'currency': 'USD', 'description': ' '.join(words), 'displaySymbol': symbol,
+                           'figi': f"BBG{rng.randrange(10 ** 9):09d}", 'mic': 'XNAS', 'symbol': symbol,
+                           'type': rng.choices(types, weights)[0]}
+    return list(listing.values())
+
+
+def measure_memory(build) -> tuple:
+    """
+    Bytes allocated by build() that are still alive afterwards, and its result.
+    """
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    result = build()
+    gc.collect()
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return after - before, result
+
+
+def time_lookups(function, queries: list) -> dict:
+    latencies = []
+    for query in queries:
+        started_at = time.perf_counter()
+        function(query)
+        latencies.append(time.perf_counter() - started_at)
+    return {
+        'lookups': len(latencies),
+        'p50_us': round(_milliseconds(percentile(latencies, 0.50)) * 1000, 1),
+        'p99_us': round(_milliseconds(percentile(latencies, 0.99)) * 1000, 1),
+        'max_us': round(_milliseconds(max(latencies)) * 1000, 1),
+    }
+
+
+def benchmark(args) -> dict:
+    from commands.stocks import symbol_choices
+
+    if args.snapshot:
+        text = Path(args.snapshot).read_text(encoding='utf-8')
+        snapshot = json.loads(text)
+        listing = [{'symbol': row[0], 'description': row[1], 'type': row[2]}
+                   for rows in snapshot['exchanges'].values() for row in rows]
+    else:
+        listing = synthetic_listing(args.symbols, args.seed)
+        snapshot = {'exchanges': {'US': [[item['symbol'], item['description'], item['type']] for item in listing]}}
+        text = json.dumps(snapshot, separators=(',', ':'))
+
+    def rows():
+        # Freshly parsed, so the index holds its own strings as it does when loaded from the file
+        return [row for exchange_rows in json.loads(text)['exchanges'].values() for row in exchange_rows]
+
+    raw_bytes, _ = measure_memory(lambda: json.loads(json.dumps(listing)))
+    index_bytes, index = measure_memory(lambda: symbols.SymbolIndex(rows()))
+    parsed = rows()
+    started_at = time.perf_counter()
+    symbols.SymbolIndex(parsed)
+    build_s = time.perf_counter() - started_at
+    symbols._index = index
+
+    rng = random.Random(args.seed)
+    picks = [rng.choice(listing) for _ in range(args.lookups)]
+    queries = {
+        'symbol_prefix': [item['symbol'][:rng.randint(1, len(item['symbol']))] for item in picks],
+        'exact_symbol': [item['symbol'] for item in picks],
+        'name_word': [item['description'].split()[0][:rng.randint(2, 6)].lower() for item in picks],
+        'name_words': [' '.join(word[:4] for word in item['description'].split()[:2]).lower() for item in picks],
+    }
+    lookups = {kind: time_lookups(lambda query: index.search(query, 25), kind_queries)
+               for kind, kind_queries in queries.items()}
+    lookups['autocomplete'] = time_lookups(symbol_choices, queries['symbol_prefix'] + queries['name_word'])
+
+    found = sum(any(result['symbol'] == item['symbol'] for result in index.search(item['symbol'], 1))
+                for item in picks)
+    return {
+        'benchmark': 'symbols',
+        'commit': git_commit(),
+        'timestamp': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        'python': platform.python_version(),
+        'parameters': {key: value for key, value in vars(args).items() if key != 'output'},
+        'symbols': len(index),
+        'index_words': len(index._words),
+        'snapshot_bytes': len(text.encode('utf-8')),
+        'index_bytes': index_bytes,
+        'finnhub_rows_bytes': raw_bytes,
+        'build_ms': _milliseconds(build_s),
+        'lookups': lookups,
+        'exact_symbol_ranked_first': round(found / len(picks), 4),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the local symbol index.")
+    parser.add_argument('--symbols', type=int, default=30_000, help="Size of the synthetic listing")
+    parser.add_argument('--snapshot', help="Use a symbols.json snapshot instead of a synthetic listing")
+    parser.add_argument('--lookups', type=int, default=20_000, help="Lookups per kind of query")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default=str(DEFAULT_OUTPUT), help="Where to write the JSON results, - for stdout")
+    args = parser.parse_args()
+
+    results = benchmark(args)
+    text = json.dumps(results, indent=2)
+    if args.output == '-':
+        print(text)
+    else:
+        output = Path(args.output)
+        output.parent.mkdir(parents=True, exist_ok=True)
+        output.write_text(text)
+        print(text)
+        print(f"Wrote {output}")
+
+
+if __name__ == '__main__':
+    main()
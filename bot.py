@@ -1,54 +1,197 @@
-from fileinput import filename
+import argparse
+import asyncio
+import contextlib
+import functools
+import logging
+import time
 
 import discord
 from discord.ext import commands
 from discord import app_commands
-import os
-from dotenv import load_dotenv
 
-# Load the environment variables
-load_dotenv()
-TOKEN = os.getenv('BOT_TOKEN')
-GUILD_ID = os.getenv('GUILD_ID')
+from utils import cluster
+from utils import database
+from utils.command_sync import sync_commands
+from utils import extensions
+from utils import http
+from utils import logger
+from utils import metrics
+from utils import refresher
+from utils.config import load_config
+from utils.rate_limit import RateLimitBusy
+from utils.resilience import CircuitOpenError, set_interaction_deadline
 
-# Create a bot instance
-class Sharmouta(commands.Bot):
-    def __init__(self):
+log = logging.getLogger(__name__)
+
+@contextlib.contextmanager
+def startup_phase(name):
+    # Log how long each part of startup takes, to see what slows down a deploy
+    started_at = time.perf_counter()
+    yield
+    elapsed = time.perf_counter() - started_at
+    log.info("Startup phase %s took %.3fs", name, elapsed, extra={'phase': name, 'seconds': round(elapsed, 4)})
+
+class SharmoutaTree(app_commands.CommandTree):
+    async def interaction_check(self, interaction):
+        # Give every upstream call made by the command the interaction's remaining time budget
+        set_interaction_deadline(interaction)
+        logger.bind_interaction(interaction)
+        # Autocomplete goes through this check too, but is never recorded as a finished command
+        if interaction.type is discord.InteractionType.application_command:
+            metrics.start_command(interaction)
+        return True
+
+# Create a bot instance; sharded, so a cluster worker can run just its range of shards
+class Sharmouta(commands.AutoShardedBot):
+    def __init__(self, force_sync=False, **options):
         intents = discord.Intents.default()
         intents.message_content = True
-        super().__init__(command_prefix='!', intents=intents)
+        super().__init__(command_prefix='!', intents=intents, tree_cls=SharmoutaTree, **options)
+
+        # Load the configuration (env + data/settings.json) once for the whole process
+        self.config = load_config()
+
+        # Route all logging, including discord.py's, through the JSON-lines queue logger
+        self.worker = cluster.get_worker()
+        logger.setup_logging(self.config.settings.extra.get('logging'),
+                             fields={'worker': self.worker.worker_id} if self.worker else None)
+
+        # Answer commands that fail on a busy upstream instead of letting them time out
+        self.tree.error(self.on_app_command_error)
+
+        # Sync the command tree even if its fingerprint is unchanged
+        self.force_sync = force_sync
 
     async def setup_hook(self):
-        # Load cogs dynamically
-        for filename in os.listdir('./commands'):
-            if filename.endswith('.py') and filename != '__init__.py':
+        started_at = time.perf_counter()
+
+        # Import the extensions in the background while the rest of startup waits on I/O
+        names = extensions.discover_extensions()
+        imports = asyncio.create_task(extensions.preimport(names))
+
+        # Open the shared HTTP client session used by every upstream lookup
+        with startup_phase('http'):
+            self.http_session = await http.open_session()
+
+        # Keep persisting the caches; they are warmed from the last run once the extensions defining them are imported
+        database_enabled = self.config.settings.extra.get('database', {}).get('enabled', True)
+        if database_enabled:
+            with startup_phase('database'):
+                # Cluster workers share the database, and with it their persistent caches
+                await database.open_database(warm=False, shared=self.worker is not None)
+
+        # Hot-reload the configuration when its files change
+        self.config_watch_task = asyncio.create_task(self.config.watch())
+
+        # Serve Prometheus metrics from this event loop and watch its lag
+        metrics_settings = self.config.settings.extra.get('metrics', {})
+        self.metrics_runner = None
+        if metrics_settings.get('enabled', True):
+            with startup_phase('metrics'):
                 try:
-                    await self.load_extension(f'commands.{filename[:-3]}')
-                    print (f"Loaded command cog: {filename}")
-                except Exception as e:
-                    print(f"Failed to load cog {filename}: {e}")
-
-        # Load event handlers
-        for filename in os.listdir('./events'):
-            if filename.endswith('.py') and filename != '__init__.py':
+                    # In a cluster, the launcher serves the configured port and collects each worker's
+                    self.metrics_runner = await metrics.start_server(
+                        metrics_settings.get('host', metrics.DEFAULT_HOST),
+                        self.worker.metrics_port if self.worker else metrics_settings.get('port', metrics.DEFAULT_PORT))
+                except OSError as e:
+                    log.error("Failed to start metrics server: %s", e)
+        self.loop_lag_task = asyncio.create_task(metrics.monitor_loop_lag())
+
+        # Load the cogs and event handlers together, once their imports have finished
+        with startup_phase('imports'):
+            import_timings = await imports
+        if database_enabled:
+            with startup_phase('preload'):
+                await database.warm_caches()
+        with startup_phase('extensions'):
+            await extensions.load_extensions(self, names, import_timings)
+
+        # Keep the slow-changing datasets the extensions registered (e.g. trending articles) fresh
+        self.refresher_task = refresher.start_refresher()
+
+        # Sync slash commands, only when they changed since the last sync (or in the dev guild, if set),
+        # and only once per cluster
+        if cluster.is_primary():
+            with startup_phase('sync'):
                 try:
-                    await self.load_extension(f'events.{filename[:-3]}')
-                    print(f"Loaded event handler: {filename}")
-                except Exception as e:
-                    print(f"Failed to load event handler {filename}: {e}")
+                    await sync_commands(self.tree, self.config.settings.guild_id, force=self.force_sync)
+                except Exception:
+                    log.exception("Failed to sync commands")
+
+        log.info("Setup took %.3fs", time.perf_counter() - started_at)
+
+    async def before_identify_hook(self, shard_id, *, initial=False):
+        # Cluster workers take turns, since Discord's identify limit covers all of them together
+        if self.worker is not None:
+            await cluster.wait_for_identify(shard_id)
+        else:
+            await super().before_identify_hook(shard_id, initial=initial)
+
+    async def on_app_command_error(self, interaction, error):
+        metrics.record_command(interaction, 'error')
+        original = getattr(error, 'original', error)
+        if isinstance(original, RateLimitBusy):
+            message = str(original)
+        elif isinstance(original, (CircuitOpenError, asyncio.TimeoutError)):
+            message = "That service is not responding right now, please try again later."
+        else:
+            log.error("Error in command %s", interaction.command.name if interaction.command else '?',
+                      exc_info=original)
+            message = "Something went wrong, please try again later."
+
+        if interaction.response.is_done():
+            await interaction.followup.send(message, ephemeral=True)
+        else:
+            await interaction.response.send_message(message, ephemeral=True)
 
+    async def close(self):
+        # Shut down the gateway first, then the shared HTTP client session
+        await super().close()
+        if hasattr(self, 'config_watch_task'):
+            self.config_watch_task.cancel()
+            self.loop_lag_task.cancel()
+        if hasattr(self, 'refresher_task'):
+            refresher.stop_refresher(self.refresher_task)
+        if getattr(self, 'metrics_runner', None) is not None:
+            await self.metrics_runner.cleanup()
+        await http.close_session()
+        await database.close_database()
+        logger.shutdown_logging()
 
-        # Sync slash commands
+def run_worker(worker, force_sync=False):
+    """
+    Run the bot for one cluster worker's shards, in that worker's process.
+    """
+    bot = Sharmouta(force_sync=force_sync, shard_ids=list(worker.shard_ids), shard_count=worker.shard_count)
+    bot.run(bot.config.settings.bot_token, log_handler=None)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the Sharmouta bot.")
+    parser.add_argument('--sync', action='store_true', help="Sync the command tree even if it hasn't changed")
+    parser.add_argument('--workers', type=int, default=0,
+                        help="Run a cluster of this many worker processes, each with a range of shards")
+    parser.add_argument('--shards', type=int, help="Total shards in cluster mode (default: Discord's recommendation)")
+    args = parser.parse_args()
+
+    if args.workers:
+        config = load_config()
+        logger.setup_logging(config.settings.extra.get('logging'), fields={'worker': 'launcher'})
+        metrics_settings = config.settings.extra.get('metrics', {})
         try:
-            await self.tree.sync()
-            print('Commands synced globally')
-            # Debug: Print all registered commands
-            print("Registered commands:")
-            for cmd in self.tree.get_commands():
-                print(f"- {cmd.name}: {cmd.description}")
-        except Exception as e:
-            print(f"Failed to sync commands: {e}")
-
-bot = Sharmouta()
-bot.run(TOKEN)
+            cluster.run_cluster(functools.partial(run_worker, force_sync=args.sync), args.workers, args.shards,
+                                token=config.settings.bot_token,
+                                host=metrics_settings.get('host', metrics.DEFAULT_HOST),
+                                port=metrics_settings.get('port', metrics.DEFAULT_PORT))
+        finally:
+            logger.shutdown_logging()
+        return
+
+    bot = Sharmouta(force_sync=args.sync)
+    # log_handler=None keeps discord.py from installing its own handler over ours
+    bot.run(bot.config.settings.bot_token, log_handler=None)
+
+
+if __name__ == '__main__':
+    main()
 
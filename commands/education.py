@@ -1,16 +1,60 @@
-import random
-
 from discord import app_commands, Embed
-from discord.ext import commands
+from discord.ext import commands, tasks
 from utils.education_apis import fetch_random_fact
+from utils.education_apis import random_facts
 from utils.education_apis import fetch_celestial_body
 from utils.education_apis import fetch_country
-import requests
+from utils import cluster
+from utils import countries
+from utils.quran import build_corpus, get_corpus, load_corpus
+from utils.responder import respond
+
+# Discord's message length limit, and the most verses /quran_verse returns at once
+MAX_MESSAGE_LENGTH = 2000
+MAX_QURAN_RANGE = 10
+
+def format_verse(verse):
+    return f"{verse['arabic']}\n\n{verse['english']} - {verse['surah_name']}, {verse['number_in_surah']}"
 
 class Education(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
 
+    async def cog_load(self):
+        # Serve /country from the local snapshot and keep it fresh in the background
+        await countries.load_snapshot()
+        self.refresh_countries.start()
+
+        # /quran answers from the local corpus, built in the background on first start if it is missing
+        if not load_corpus():
+            self.build_quran_corpus.start()
+
+        # Fill the fact pool before the first /fact
+        random_facts.refill()
+
+    async def cog_unload(self):
+        self.refresh_countries.cancel()
+        self.build_quran_corpus.cancel()
+
+    @tasks.loop(hours=24)
+    async def refresh_countries(self):
+        if countries.snapshot_is_stale():
+            # In a cluster the primary worker downloads it, and the others pick up its file
+            if cluster.is_primary():
+                await countries.refresh_snapshot()
+            else:
+                await countries.load_snapshot()
+
+    @tasks.loop(minutes=5)
+    async def build_quran_corpus(self):
+        # In a cluster the primary worker builds it, and the others pick up its file
+        if cluster.is_primary():
+            await build_corpus()
+        else:
+            load_corpus()
+        if get_corpus() is not None:
+            self.build_quran_corpus.cancel()
+
     @app_commands.command(name='fact', description='Get a random fact')
     async def fact(self, interaction):
         """
@@ -19,16 +63,16 @@ class Education(commands.Cog):
         :param interaction:
         :return:
         """
-        # Use the fetch_random_fact function to get a random fact
-        fact = fetch_random_fact()
+        def render(fact):
+            # If no fact is found, send an error message
+            if not fact:
+                return {'content': "Failed to get a random fact"}
 
-        # If no fact is found, send an error message
-        if not fact:
-            await interaction.response.send_message("Failed to get a random fact")
-            return
+            # Send the fact as a response
+            return {'content': fact}
 
-        # Send the fact as a response
-        await interaction.response.send_message(fact)
+        # Take a prefetched random fact, avoiding ones recently shown in this guild (or DM)
+        await respond(interaction, fetch_random_fact(interaction.guild_id or interaction.user.id), render)
 
     @app_commands.command(name='word_of_the_day', description="Get the word of the day")
     async def word_of_the_day(self, interaction):
@@ -37,76 +81,96 @@ class Education(commands.Cog):
 
     @app_commands.command(name="celestial", description="Fetch details about a celestial body.")
     async def celestial(self, interaction, name: str):
+        def render(data):
+            # Handle errors
+            if "error" in data:
+                return {'content': f"Error: {data['error']}", 'ephemeral': True}
+
+            # Create an embed
+            embed = Embed(
+                title=f"Details about {data['name']}",
+                description="Here is what I found:",
+                color=0x1E90FF
+            )
+            embed.add_field(name="Mass", value=data["mass"], inline=False)
+            embed.add_field(name="Gravity", value=data["gravity"], inline=False)
+            embed.add_field(name="Mean Radius", value=data["radius"], inline=False)
+            embed.add_field(name="Orbital Period", value=data["orbit"], inline=False)
+            embed.add_field(name="Moons", value=", ".join(data["moons"]), inline=False)
+            embed.set_footer(text="Data provided by Solar System OpenData API")
+            return {'embed': embed}
+
         # Fetch data from the API logic
-        data = fetch_celestial_body(name)
+        await respond(interaction, fetch_celestial_body(name), render)
 
-        # Handle errors
-        if "error" in data:
-            await interaction.response.send_message(f"Error: {data['error']}", ephemeral=True)
+    @app_commands.command(name="country", description="Fetch details about a country.")
+    async def country(self, interaction, name: str):
+        def render(data):
+            # Handle errors
+            if "error" in data:
+                return {'content': f"Error: {data['error']}", 'ephemeral': True}
+
+            # Create an embed
+            embed = Embed(
+                title=f"Details about {data['name']['common']}",
+                description="Here is what I found:",
+                color=0x1E90FF
+            )
+            embed.add_field(name="Official Name", value=data["name"]["official"], inline=False)
+            embed.add_field(name="Capital", value=data["capital"], inline=False)
+            embed.add_field(name="Population", value=f"{data['population']:,}", inline=False)
+            embed.add_field(name="Area", value=f"{data['area']:,} km²", inline=False)
+            embed.add_field(name="Currency", value=data["currency"], inline=False)
+            embed.add_field(name="Language", value=data["language"], inline=False)
+            embed.set_thumbnail(url=data["flag"])
+            embed.set_footer(text="Data provided by Rest Countries API")
+            return {'embed': embed}
+
+        # Answered from the local snapshot index, so this normally responds immediately
+        await respond(interaction, fetch_country(name), render)
+
+    @app_commands.command(name='quran', description='Get a random quran verse')
+    async def quran(self, interaction):
+        # command which sends a random quran verse when /quran is used
+        corpus = get_corpus()
+        if corpus is None:
+            await interaction.response.send_message("The Quran corpus is not available right now.", ephemeral=True)
             return
 
-        # Create an embed
-        embed = Embed(
-            title=f"Details about {data['name']}",
-            description="Here is what I found:",
-            color=0x1E90FF
-        )
-        embed.add_field(name="Mass", value=data["mass"], inline=False)
-        embed.add_field(name="Gravity", value=data["gravity"], inline=False)
-        embed.add_field(name="Mean Radius", value=data["radius"], inline=False)
-        embed.add_field(name="Orbital Period", value=data["orbit"], inline=False)
-        embed.add_field(name="Moons", value=", ".join(data["moons"]), inline=False)
-        embed.set_footer(text="Data provided by Solar System OpenData API")
-
-        # Send the embed
-        await interaction.response.send_message(embed=embed)
+        await interaction.response.send_message(format_verse(corpus.random_verse()))
 
-    @app_commands.command(name="country", description="Fetch details about a country.")
-    async def country(self, interaction, name: str):
-        # Fetch data from the API logic
-        data = fetch_country(name)
+    @app_commands.command(name='quran_verse', description='Get a quran verse or range, e.g. 2:255 or 2:255-257')
+    async def quran_verse(self, interaction, reference: str):
+        corpus = get_corpus()
+        if corpus is None:
+            await interaction.response.send_message("The Quran corpus is not available right now.", ephemeral=True)
+            return
 
-        # Handle errors
-        if "error" in data:
-            await interaction.response.send_message(f"Error: {data['error']}", ephemeral=True)
+        try:
+            surah, ayahs = reference.strip().split(':')
+            start, _, end = ayahs.partition('-')
+            start = int(start)
+            end = int(end) if end else start
+        except ValueError:
+            await interaction.response.send_message(
+                "Use a reference like 2:255 or a range like 2:255-257.", ephemeral=True)
             return
 
-        # Create an embed
-        embed = Embed(
-            title=f"Details about {data['name']['common']}",
-            description="Here is what I found:",
-            color=0x1E90FF
-        )
-        embed.add_field(name="Official Name", value=data["name"]["official"], inline=False)
-        embed.add_field(name="Capital", value=data["capital"], inline=False)
-        embed.add_field(name="Population", value=f"{data['population']:,}", inline=False)
-        embed.add_field(name="Area", value=f"{data['area']:,} km²", inline=False)
-        embed.add_field(name="Currency", value=data["currency"], inline=False)
-        embed.add_field(name="Language", value=data["language"], inline=False)
-        embed.set_thumbnail(url=data["flag"])
-        embed.set_footer(text="Data provided by Rest Countries API")
-
-        # Send the embed
-        await interaction.response.send_message(embed=embed)
+        if end - start + 1 > MAX_QURAN_RANGE:
+            await interaction.response.send_message(
+                f"Please ask for at most {MAX_QURAN_RANGE} verses at a time.", ephemeral=True)
+            return
 
-    @app_commands.command(name='quran', description='Get a random quran verse')
-    async def quran(self, interaction):
-        # command which sends a random quran verse when /quran is used
-        verse_num = random.randint(1, 6236)
         try:
-            # trys to request quran api for a random quran verse
-            response = requests.get(
-                "http://api.alquran.cloud/ayah/" + str(verse_num) + "/editions/quran-uthmani,en.pickthall")
-            data = response.json()
-            ar_verse = data["data"][0]["text"]
-            en_verse = data["data"][1]["text"]
-            surah = data["data"][0]["surah"]["englishName"]
-            aya = data["data"][0]["numberInSurah"]
-
-            await interaction.response.send_message(f"{ar_verse}\n\n{en_verse} - {surah}, {aya}")
-
-        except Exception as e:
-            print(f"Error: {e}")
+            verses = corpus.verse_range(int(surah), start, end)
+        except IndexError as e:
+            await interaction.response.send_message(f"Error: {e}", ephemeral=True)
+            return
+
+        message = "\n\n".join(format_verse(verse) for verse in verses)
+        if len(message) > MAX_MESSAGE_LENGTH:
+            message = message[:MAX_MESSAGE_LENGTH - 1] + "…"
+        await interaction.response.send_message(message)
 
 async def setup(bot):
     await bot.add_cog(Education(bot))
\ No newline at end of file
@@ -0,0 +1,187 @@
+import asyncio
+import logging
+import time
+from collections import defaultdict
+
+import discord
+from discord import app_commands
+from discord.ext import commands
+
+from utils import cluster
+from utils import database
+from utils import rate_limit
+from utils.reminders import adopt_store, adopt_table, get_scheduler, orphaned_workers, parse_duration, start_scheduler
+from utils.reminders import stop_scheduler, worker_store
+
+log = logging.getLogger(__name__)
+
+# Limits per user, and on the reminder text
+MAX_REMINDERS_PER_USER = 25
+MAX_REMINDER_LENGTH = 500
+
+# Discord's message length limit, and how many channels are sent to at once
+MAX_MESSAGE_LENGTH = 2000
+DELIVERY_CONCURRENCY = 20
+
+# Sending to these channels will never work, so the reminders aren't retried
+PERMANENT_ERRORS = (discord.Forbidden, discord.NotFound)
+
+# Longest reminder text shown by /reminders, so a full list stays under Discord's 6000 characters per embed
+MAX_LISTED_LENGTH = 200
+
+
+def format_reminder(reminder):
+    return f"⏰ <@{reminder.user_id}>: {reminder.message}"
+
+
+def chunk_reminders(reminders, limit=MAX_MESSAGE_LENGTH):
+    """
+    Group reminders into as few messages as possible, each at most limit characters.
+
+    Returns:
+        list: (message text, reminders in it) pairs.
+    """
+    chunks = []
+    current, members = '', []
+    for reminder in reminders:
+        line = format_reminder(reminder)
+        if current and len(current) + 1 + len(line) > limit:
+            chunks.append((current, members))
+            current, members = '', []
+        current = f"{current}\n{line}" if current else line
+        members.append(reminder)
+    if current:
+        chunks.append((current, members))
+    return chunks
+
+
+def shorten(text: str, limit: int = MAX_LISTED_LENGTH) -> str:
+    return text if len(text) <= limit else text[:limit - 1].rstrip() + "…"
+
+
+class Reminders(commands.Cog):
+    def __init__(self, bot):
+        self.bot = bot
+        self.scheduler_tasks = []
+        self._delivery_semaphore = asyncio.Semaphore(DELIVERY_CONCURRENCY)
+
+    async def cog_load(self):
+        worker = cluster.get_worker()
+        store = database.get_database()
+        if worker is None:
+            self.scheduler_tasks = await start_scheduler(self.deliver)
+            if store is not None:
+                # Left behind by a cluster this bot ran as before
+                adopted = await adopt_table(get_scheduler(), store)
+                if adopted:
+                    log.info("Adopted %d reminders from the cluster's database", adopted)
+            return
+
+        if store is not None:
+            # Cluster workers share their reminders through the database, so any worker can list and cancel
+            # them; each fires the ones it added, sending through the REST API whichever guild they are in
+            self.scheduler_tasks = await start_scheduler(self.deliver, database=store, worker_id=worker.worker_id)
+            if cluster.is_primary():
+                # Take over the reminders of workers that are gone since the cluster shrank
+                adopted = await get_scheduler().adopt_orphans(worker.workers)
+                if adopted:
+                    log.info("Adopted %d reminders from former workers", adopted)
+            # Move over the files this worker kept before reminders were shared
+            worker_ids = [worker.worker_id] + (orphaned_workers(worker.workers) if cluster.is_primary() else [])
+        else:
+            log.warning("The database is disabled, so each cluster worker only sees the reminders it keeps itself")
+            self.scheduler_tasks = await start_scheduler(self.deliver, worker_store(worker.worker_id))
+            worker_ids = orphaned_workers(worker.workers) if cluster.is_primary() else []
+
+        for worker_id in worker_ids:
+            adopted = await adopt_store(get_scheduler(), worker_store(worker_id))
+            if adopted:
+                log.info("Adopted %d reminders from worker %d's files", adopted, worker_id)
+
+    async def cog_unload(self):
+        await stop_scheduler(self.scheduler_tasks)
+
+    async def deliver(self, batch):
+        """
+        Send a batch of due reminders, one message per channel where possible.
+
+        Returns:
+            list: The reminders that couldn't be sent and should be retried.
+        """
+        by_channel = defaultdict(list)
+        for reminder in batch:
+            by_channel[reminder.channel_id].append(reminder)
+
+        results = await asyncio.gather(*(self._deliver_to_channel(channel_id, reminders)
+                                         for channel_id, reminders in by_channel.items()))
+        return [reminder for failed in results for reminder in failed]
+
+    async def _deliver_to_channel(self, channel_id, reminders):
+        async with self._delivery_semaphore:
+            try:
+                channel = self.bot.get_channel(channel_id)
+                if channel is None:
+                    await rate_limit.acquire('discord', rate_limit.BACKGROUND)
+                    channel = await self.bot.fetch_channel(channel_id)
+
+                for message, members in chunk_reminders(reminders):
+                    # Only ping the reminded users, never @everyone or roles written into a reminder
+                    mentions = discord.AllowedMentions(
+                        everyone=False, roles=False,
+                        users=[discord.Object(user_id) for user_id in {reminder.user_id for reminder in members}])
+                    # Stay under Discord's global rate limit when many reminders fire at once
+                    await rate_limit.acquire('discord', rate_limit.BACKGROUND)
+                    await channel.send(message, allowed_mentions=mentions)
+            except PERMANENT_ERRORS as e:
+                log.warning("Dropping %d reminders for channel %s: %s", len(reminders), channel_id, e)
+                return []
+            except (discord.HTTPException, rate_limit.RateLimitBusy) as e:
+                log.warning("Failed to deliver %d reminders to channel %s: %s", len(reminders), channel_id, e)
+                return reminders
+        return []
+
+    @app_commands.command(name='remind', description='Set a reminder, e.g. in 10m, 1h30m or 2d')
+    async def remind(self, interaction, when: str, message: str):
+        scheduler = get_scheduler()
+        delay = parse_duration(when)
+        if delay is None:
+            await interaction.response.send_message(
+                "Use a delay like 90s, 10m, 1h30m or 2d (at most a year).", ephemeral=True)
+            return
+        if len(message) > MAX_REMINDER_LENGTH:
+            await interaction.response.send_message(
+                f"Please keep reminders under {MAX_REMINDER_LENGTH} characters.", ephemeral=True)
+            return
+        if await scheduler.count_for_user(interaction.user.id) >= MAX_REMINDERS_PER_USER:
+            await interaction.response.send_message(
+                f"You already have {MAX_REMINDERS_PER_USER} reminders, please cancel one first.", ephemeral=True)
+            return
+
+        reminder = await scheduler.add(time.time() + delay, interaction.user.id, interaction.channel_id,
+                                       interaction.guild_id, message)
+        await interaction.response.send_message(
+            f"Okay, I'll remind you <t:{int(reminder.due_at)}:R> (reminder #{reminder.id}).", ephemeral=True)
+
+    @app_commands.command(name='reminders', description='List your reminders')
+    async def reminders(self, interaction):
+        reminders = await get_scheduler().for_user(interaction.user.id)
+        if not reminders:
+            await interaction.response.send_message("You have no reminders.", ephemeral=True)
+            return
+
+        embed = discord.Embed(title="Your reminders", color=0x1E90FF)
+        for reminder in reminders:
+            embed.add_field(name=f"#{reminder.id}", value=f"<t:{int(reminder.due_at)}:R>: {shorten(reminder.message)}",
+                            inline=False)
+        await interaction.response.send_message(embed=embed, ephemeral=True)
+
+    @app_commands.command(name='remind_cancel', description='Cancel one of your reminders')
+    async def remind_cancel(self, interaction, reminder_id: int):
+        if await get_scheduler().cancel(reminder_id, interaction.user.id):
+            await interaction.response.send_message(f"Cancelled reminder #{reminder_id}.", ephemeral=True)
+        else:
+            await interaction.response.send_message(f"You have no reminder #{reminder_id}.", ephemeral=True)
+
+
+async def setup(bot):
+    await bot.add_cog(Reminders(bot))
@@ -1,41 +1,166 @@
 from discord import app_commands, Embed
-from discord.ext import commands
-import finnhub
+from discord.ext import commands, tasks
 from utils.stocks_api import dividends
-from dotenv import load_dotenv
-import os
+from utils.stocks_api import get_quote
+from utils.stocks_api import get_quotes
+from utils.stocks_api import QUOTE_NOT_FOUND
+from utils.stocks_api import MAX_WATCHLIST_SYMBOLS
+from utils import cluster
+from utils import symbols as symbol_index
+from utils.autocomplete import MAX_CHOICES, MAX_CHOICE_LENGTH
+from utils.config import get_config
+from utils.quote_book import start_quote_book, stop_quote_book
+from utils.responder import respond
+from utils.stocks_api import fetch_company_profile
+
+# Results listed by /symbol_search, and Discord's limit on an embed description
+MAX_SEARCH_RESULTS = 15
+MAX_DESCRIPTION_LENGTH = 4096
+
+
+def quote_embed(symbol, res):
+    embed = Embed(
+        title=f"Stock price for {symbol}",
+        description=f"Current price: {res['c']}",
+        color=0x1E90FF
+    )
+    embed.add_field(name="Open", value=res['o'], inline=False)
+    embed.add_field(name="High", value=res['h'], inline=False)
+    embed.add_field(name="Low", value=res['l'], inline=False)
+    embed.add_field(name="Previous Close", value=res['pc'], inline=False)
+    embed.set_footer(text="Data provided by Finnhub")
+    return embed
+
+
+def symbol_choices(current, head=''):
+    # Answered from the local symbol index; empty until its snapshot is loaded
+    index = symbol_index.get_index()
+    if index is None or not current.strip():
+        return []
+    return [app_commands.Choice(name=f"{head}{item['symbol']} - {item['description']}"[:MAX_CHOICE_LENGTH],
+                                value=f"{head}{item['symbol']}")
+            for item in index.search(current, MAX_CHOICES)
+            if len(head) + len(item['symbol']) <= MAX_CHOICE_LENGTH]
 
 
 class Stocks(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
+        self.quote_book_task = None
+
+    async def cog_load(self):
+        # Stream hot tickers from Finnhub's websocket so /stock can answer without a REST call;
+        # Finnhub allows one websocket per key, so in a cluster only the primary worker streams
+        token = get_config().settings.finnhub_key
+        if token and cluster.is_primary():
+            self.quote_book_task = start_quote_book(token)
+
+        # Symbol search and autocomplete answer from a local index of the exchange listings
+        await symbol_index.load_snapshot()
+        if token:
+            self.refresh_symbols.start()
+
+    async def cog_unload(self):
+        if self.quote_book_task is not None:
+            stop_quote_book(self.quote_book_task)
+        self.refresh_symbols.cancel()
+
+    @tasks.loop(hours=1)
+    async def refresh_symbols(self):
+        if symbol_index.snapshot_is_stale():
+            # In a cluster the primary worker downloads it, and the others pick up its file
+            if cluster.is_primary():
+                await symbol_index.refresh_snapshot()
+            else:
+                await symbol_index.load_snapshot()
 
     @app_commands.command(name='stock', description='Get stock price')
     async def stock(self, interaction, symbol: str):
-        load_dotenv()
-        finnhub_client = finnhub.Client(api_key=os.getenv('FINHUB_KEY'))
-        res = finnhub_client.quote(symbol)
-        if res:
+        def render(res):
+            if not res:
+                return {'content': f"Failed to get stock price for {symbol}"}
+
+            return {'embed': quote_embed(symbol, res)}
+
+        async def enrich(res):
+            # Edit in the company name and logo once the (long-cached) profile arrives
+            if not res:
+                return None
+            try:
+                profile = await fetch_company_profile(symbol)
+            except Exception:
+                return None
+            if not profile or not profile.get('logo'):
+                return None
+            embed = quote_embed(symbol, res)
+            embed.title = f"Stock price for {profile.get('name', symbol)} ({symbol.upper()})"
+            embed.set_thumbnail(url=profile['logo'])
+            return {'embed': embed}
+
+        await respond(interaction, get_quote(symbol), render, enrich)
+
+    @stock.autocomplete('symbol')
+    async def stock_symbol_autocomplete(self, interaction, current: str):
+        return symbol_choices(current)
+
+    @app_commands.command(name='stocks', description='Get prices for a list of stocks, e.g. AAPL,MSFT,NVDA')
+    async def stocks(self, interaction, symbols: str):
+        # Split on commas or spaces and drop duplicates, keeping the order
+        requested = list(dict.fromkeys(
+            symbol.upper() for symbol in symbols.replace(',', ' ').split()
+        ))
+        if not requested:
+            await interaction.response.send_message("Please provide at least one symbol.", ephemeral=True)
+            return
+        if len(requested) > MAX_WATCHLIST_SYMBOLS:
+            await interaction.response.send_message(
+                f"Please provide at most {MAX_WATCHLIST_SYMBOLS} symbols.", ephemeral=True)
+            return
+
+        def render(quotes):
+            rows = [f"{'Symbol':<8}{'Price':>12}{'Change':>10}"]
+            not_found = []
+            unavailable = []
+            for symbol, res in quotes.items():
+                if not isinstance(res, dict):
+                    (not_found if res == QUOTE_NOT_FOUND else unavailable).append(symbol)
+                    continue
+                change = (res['c'] - res['pc']) / res['pc'] * 100
+                rows.append(f"{symbol:<8}{res['c']:>12.2f}{change:>+9.2f}%")
+
+            if len(rows) == 1:
+                if not unavailable:
+                    return {'content': f"No stock prices found for {', '.join(not_found)}"}
+                return {'content': f"Stock prices are unavailable right now for {', '.join(unavailable)}, "
+                                   "try again shortly"}
+
             embed = Embed(
-                title=f"Stock price for {symbol}",
-                description=f"Current price: {res['c']}",
+                title="Stock prices",
+                description="```\n" + "\n".join(rows) + "\n```",
                 color=0x1E90FF
             )
-            embed.add_field(name="Open", value=res['o'], inline=False)
-            embed.add_field(name="High", value=res['h'], inline=False)
-            embed.add_field(name="Low", value=res['l'], inline=False)
-            embed.add_field(name="Previous Close", value=res['pc'], inline=False)
+            if not_found:
+                embed.add_field(name="Not found", value=", ".join(not_found), inline=False)
+            if unavailable:
+                embed.add_field(name="Unavailable", value=", ".join(unavailable) + " (try again shortly)",
+                                inline=False)
             embed.set_footer(text="Data provided by Finnhub")
-            await interaction.response.send_message(embed=embed)
-        else:
-            await interaction.response.send_message(f"Failed to get stock price for {symbol}")
+            return {'embed': embed}
+
+        await respond(interaction, get_quotes(requested), render)
+
+    @stocks.autocomplete('symbols')
+    async def stocks_symbols_autocomplete(self, interaction, current: str):
+        # Complete the last symbol of the list, keeping the ones before it
+        cut = max(current.rfind(','), current.rfind(' ')) + 1
+        return symbol_choices(current[cut:], current[:cut])
 
     @app_commands.command(name='stock_info', description='Get stock information')
     async def stock_info(self, interaction, symbol: str):
-        load_dotenv()
-        finnhub_client = finnhub.Client(api_key=os.getenv('FINHUB_KEY'))
-        res = finnhub_client.company_profile2(symbol=symbol)
-        if res:
+        def render(res):
+            if not res:
+                return {'content': f"Failed to get stock information for {symbol}"}
+
             embed = Embed(
                 title=f"Stock information for {symbol}",
                 description=res['name'],
@@ -52,48 +177,48 @@ class Stocks(commands.Cog):
             embed.add_field(name="Outstanding Shares", value=res['shareOutstanding'], inline=False)
             embed.set_thumbnail(url=res['logo'])
             embed.set_footer(text="Data provided by Finnhub")
-            await interaction.response.send_message(embed=embed)
-        else:
-            await interaction.response.send_message(f"Failed to get stock information for {symbol}")
+            return {'embed': embed}
+
+        await respond(interaction, fetch_company_profile(symbol), render)
+
+    @stock_info.autocomplete('symbol')
+    async def stock_info_symbol_autocomplete(self, interaction, current: str):
+        return symbol_choices(current)
 
     @app_commands.command(name='symbol_search', description='Search for stock symbols')
     async def symbol_search(self, interaction, query: str):
-        # Load API key
-        load_dotenv()
-        api_key = os.getenv('FINHUB_KEY')
-        finnhub_client = finnhub.Client(api_key=api_key)
+        def render(results):
+            if not results:
+                return {'content': f"No results found for '{query}'", 'ephemeral': True}
 
-        # Call Finnhub's symbol lookup API
-        res = finnhub_client.symbol_lookup(query)
+            # One line per listing, best match first, within the description limit
+            lines = []
+            length = 0
+            for item in results:
+                line = f"**{item['symbol']}** {item['description']}" + (f" · {item['type']}" if item['type'] else "")
+                if length + len(line) + 1 > MAX_DESCRIPTION_LENGTH:
+                    break
+                lines.append(line)
+                length += len(line) + 1
 
-        # Check if results exist
-        if res and 'result' in res and len(res['result']) > 0:
             embed = Embed(
                 title=f"Stock symbols for '{query}'",
-                description="Here are the results:",
+                description="\n".join(lines),
                 color=0x1E90FF
             )
-
-            # Iterate over the results
-            for item in res['result']:
-                embed.add_field(
-                    name=item['description'],
-                    value=f"Symbol: {item['symbol']}\nType: {item['type']}",
-                    inline=False
-                )
-
             embed.set_footer(text="Data provided by Finnhub")
-            await interaction.response.send_message(embed=embed)
-        else:
-            await interaction.response.send_message(f"No results found for '{query}'", ephemeral=True)
+            return {'embed': embed}
+
+        # Answered from the local symbol index, falling back to Finnhub's search until it is loaded
+        await respond(interaction, symbol_index.search_symbols(query, MAX_SEARCH_RESULTS), render)
 
     @app_commands.command(name='dividends', description='Get dividends for a stock')
     async def dividends(self, interaction, symbol: str):
-        # Fetch dividends using the dividends function
-        data = dividends(symbol)
+        def render(data):
+            # Check if dividends were found
+            if not data:
+                return {'content': f"No dividend information found for {symbol}", 'ephemeral': True}
 
-        # Check if dividends were found
-        if data:
             embed = Embed(
                 title=f"Dividends for {symbol}",
                 description="Here are the details:",
@@ -104,9 +229,14 @@ class Stocks(commands.Cog):
             embed.add_field(name="Payment Date", value=data['pay_date'], inline=False)
             embed.add_field(name="Record Date", value=data['record_date'], inline=False)
             embed.set_footer(text="Data provided by Polygon.io")
-            await interaction.response.send_message(embed=embed)
-        else:
-            await interaction.response.send_message(f"No dividend information found for {symbol}", ephemeral=True)
+            return {'embed': embed}
+
+        # Fetch dividends using the dividends function
+        await respond(interaction, dividends(symbol), render)
+
+    @dividends.autocomplete('symbol')
+    async def dividends_symbol_autocomplete(self, interaction, current: str):
+        return symbol_choices(current)
 
 
 async def setup(bot):
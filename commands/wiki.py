@@ -2,15 +2,31 @@ from discord import app_commands
 from discord.ext import commands
 from utils.wikipedia_api import search_wikipedia
 from utils.wikipedia_api import get_random_article
+from utils.wikipedia_api import random_articles
 from utils.wikipedia_api import get_trending_articles
+from utils.wikipedia_api import trending_articles
 from utils.wikipedia_api import get_article_categories
 from utils.wikipedia_api import get_article_sections
+from utils.wikipedia_api import title_suggester
+from utils.pagination import PaginatedView
+from utils.responder import respond
+import datetime
 import discord
 
+# Characters of each article's extract shown by /trending_wiki, keeping the embed within Discord's limits
+MAX_EXTRACT_LENGTH = 200
+
+# Sections listed per page of /wiki_sections
+SECTIONS_PER_PAGE = 25
+
 class Wiki(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
 
+    async def cog_load(self):
+        # Fill the random article pool before the first /random_wiki
+        random_articles.refill()
+
     @app_commands.command(name='wiki', description='Search Wikipedia for an article')
     async def wiki(self, interaction, topic: str):
         """
@@ -20,27 +36,29 @@ class Wiki(commands.Cog):
         :param topic:
         :return:
         """
+        def render(result):
+            # If no results are found, send an error message
+            if not result:
+                return {'content': f"No results found for '{topic}'"}
+
+            # Create an embed for the result
+            embed = discord.Embed(
+                title=result['title'],
+                description=result['snippet'],
+                url=result['url'],
+                color=discord.Color.blue()
+            )
+            if result['image_url']:
+                embed.set_thumbnail(url=result['image_url'])
+            embed.set_footer(text="Powered by Wikipedia")
+            return {'embed': embed}
+
         # Use the search_wikipedia function to find the article
-        result = search_wikipedia(topic)
-
-        # If no results are found, send an error message
-        if not result:
-            await interaction.response.send_message(f"No results found for '{topic}'")
-            return
-
-        # Create an embed for the result
-        embed = discord.Embed(
-            title=result['title'],
-            description=result['snippet'],
-            url=result['url'],
-            color=discord.Color.blue()
-        )
-        if result['image_url']:
-            embed.set_thumbnail(url=result['image_url'])
-        embed.set_footer(text="Powered by Wikipedia")
-
-        # Send the embed as a response
-        await interaction.response.send_message(embed=embed)
+        await respond(interaction, search_wikipedia(topic), render)
+
+    @wiki.autocomplete('topic')
+    async def topic_autocomplete(self, interaction, current: str):
+        return await title_suggester.choices(interaction, current)
 
     @app_commands.command(name='random_wiki', description='Get a random Wikipedia article')
     async def random_wiki(self, interaction):
@@ -50,77 +68,117 @@ class Wiki(commands.Cog):
         :param interaction:
         :return:
         """
-        # Use the get_random_article function to find a random article
-        result = get_random_article()
-
-        # If no results are found, send an error message
-        if not result:
-            await interaction.response.send_message("Failed to get a random article")
-            return
-
-        # Create an embed for the result
-        embed = discord.Embed(
-            title=result['title'],
-            url=result['url'],
-            color=discord.Color.blue()
-        )
-        if result['image']:
-            embed.set_thumbnail(url=result['image'])
-        embed.set_footer(text="Powered by Wikipedia")
-
-        # Send the embed as a response
-        await interaction.response.send_message(embed=embed)
+        def render(result):
+            # If no results are found, send an error message
+            if not result:
+                return {'content': "Failed to get a random article"}
+
+            # Create an embed for the result
+            embed = discord.Embed(
+                title=result['title'],
+                url=result['url'],
+                color=discord.Color.blue()
+            )
+            if result['image']:
+                embed.set_thumbnail(url=result['image'])
+            embed.set_footer(text="Powered by Wikipedia")
+            return {'embed': embed}
+
+        # Take a prefetched random article, avoiding ones recently shown in this guild (or DM)
+        await respond(interaction, get_random_article(interaction.guild_id or interaction.user.id), render)
 
     @app_commands.command(name="trending_wiki", description="Fetch trending articles on Wikipedia")
     async def trending_wiki(self, interaction):
-        results = get_trending_articles()
-        if not results:
-            await interaction.response.send_message("Failed to fetch trending articles. Please try again later.")
-            return
-
-        embed = discord.Embed(
-            title="Trending Wikipedia Articles",
-            description="Here are the top trending articles on Wikipedia:",
-            color=discord.Color.purple()
-        )
-        for result in results:
-            embed.add_field(name=result['title'], value=result['url'], inline=False)
-
-        await interaction.response.send_message(embed=embed)
+        def render(results):
+            if not results:
+                return {'content': "Trending articles aren't available yet. Please try again in a minute."}
+
+            embed = discord.Embed(
+                title="Trending Wikipedia Articles",
+                description="Here are the top trending articles on Wikipedia:",
+                color=discord.Color.purple()
+            )
+            for result in results:
+                extract = result['extract']
+                if len(extract) > MAX_EXTRACT_LENGTH:
+                    extract = extract[:MAX_EXTRACT_LENGTH - 1].rstrip() + "…"
+                embed.add_field(name=result['title'], value=f"{extract}\n{result['url']}".strip(), inline=False)
+            if results[0]['image_url']:
+                embed.set_thumbnail(url=results[0]['image_url'])
+            if trending_articles.updated_at is not None:
+                embed.timestamp = datetime.datetime.fromtimestamp(trending_articles.updated_at, datetime.timezone.utc)
+            embed.set_footer(text="Powered by Wikipedia")
+            return {'embed': embed}
+
+        # Served from the background refresher's snapshot, without touching the network
+        await respond(interaction, get_trending_articles(), render)
 
     @app_commands.command(name="wiki_categories", description="Fetch categories of a Wikipedia article")
     async def wiki_categories(self, interaction, title: str):
-        categories = get_article_categories(title)
-        if not categories:
-            await interaction.response.send_message(f"No categories found for the article '{title}'.")
-            return
-
-        embed = discord.Embed(
-            title=f"Categories for '{title}'",
-            description="\n".join(categories),
-            color=discord.Color.orange()
-        )
-        embed.set_footer(text="Powered by Wikipedia")
-
-        await interaction.response.send_message(embed=embed)
+        async def fetch_page(token):
+            page = await get_article_categories(title, token)
+            return None if page is None else (page['categories'], page['continue'])
+
+        def render_page(categories, number):
+            embed = discord.Embed(
+                title=f"Categories for '{title}'",
+                description="\n".join(categories),
+                color=discord.Color.orange()
+            )
+            embed.set_footer(text=f"Page {number + 1} · Powered by Wikipedia")
+            return embed
+
+        view = PaginatedView(fetch_page, render_page, interaction.user.id)
+        view.interaction = interaction
+
+        def render(categories):
+            if not categories:
+                view.stop()
+                return {'content': f"No categories found for the article '{title}'."}
+            return view.message()
+
+        await respond(interaction, view.first_page(), render)
+
+    @wiki_categories.autocomplete('title')
+    async def categories_title_autocomplete(self, interaction, current: str):
+        return await title_suggester.choices(interaction, current)
 
     @app_commands.command(name="wiki_sections", description="Fetch sections of a Wikipedia article")
     async def wiki_sections(self, interaction, title: str):
-        sections = get_article_sections(title)
-        if not sections:
-            await interaction.response.send_message(f"No sections found for the article '{title}'.")
-            return
+        async def fetch_page(offset):
+            # Wikipedia returns an article's whole section list at once; it is cached and paged here
+            sections = await get_article_sections(title)
+            if sections is None:
+                return None
+            offset = offset or 0
+            end = offset + SECTIONS_PER_PAGE
+            return sections[offset:end], end if end < len(sections) else None
+
+        def render_page(sections, number):
+            embed = discord.Embed(
+                title=f"Sections for '{title}'",
+                description="\n".join([f"{section['level']}: {section['title']}" for section in sections]),
+                color=discord.Color.teal()
+            )
+            embed.set_footer(text=f"Page {number + 1} · Powered by Wikipedia")
+            return embed
+
+        view = PaginatedView(fetch_page, render_page, interaction.user.id)
+        view.interaction = interaction
+
+        def render(sections):
+            if not sections:
+                view.stop()
+                return {'content': f"No sections found for the article '{title}'."}
+            return view.message()
 
-        embed = discord.Embed(
-            title=f"Sections for '{title}'",
-            description="\n".join([f"{section['level']}: {section['title']}" for section in sections]),
-            color=discord.Color.teal()
-        )
-        embed.set_footer(text="Powered by Wikipedia")
+        await respond(interaction, view.first_page(), render)
 
-        await interaction.response.send_message(embed=embed)
+    @wiki_sections.autocomplete('title')
+    async def sections_title_autocomplete(self, interaction, current: str):
+        return await title_suggester.choices(interaction, current)
 
 
 
 async def setup(bot):
-    await bot.add_cog(Wiki(bot))
\ No newline at end of file
+    await bot.add_cog(Wiki(bot))
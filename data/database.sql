@@ -0,0 +1,36 @@
+-- Schema for data/bot.db, applied by utils/database.py.
+--
+-- Each migration starts with a "-- migration: N" line and runs once, in order,
+-- inside a transaction; the database's PRAGMA user_version records the last one
+-- applied. Add new migrations at the end and never edit one that has shipped.
+
+-- migration: 1
+-- Upstream responses kept by persistent caches (see utils/cache.py)
+CREATE TABLE cache_entries (
+    cache      TEXT    NOT NULL,            -- Cache name, e.g. "country"
+    key        TEXT    NOT NULL,            -- JSON-encoded normalized key
+    value      TEXT    NOT NULL,            -- JSON-encoded cached value
+    expires_at REAL    NOT NULL,            -- Unix time
+    hits       INTEGER NOT NULL DEFAULT 0,  -- Decayed hit count, used to pick what to preload
+    updated_at REAL    NOT NULL,            -- Unix time
+    PRIMARY KEY (cache, key)
+) WITHOUT ROWID;
+
+CREATE INDEX cache_entries_expires_at ON cache_entries (expires_at);
+CREATE INDEX cache_entries_hits ON cache_entries (cache, hits DESC);
+
+-- migration: 2
+-- Reminders of a cluster, shared by its workers (see utils/reminders.py); a single process keeps its own files
+CREATE TABLE reminders (
+    id         INTEGER PRIMARY KEY AUTOINCREMENT,  -- Never reused, so cancelled IDs stay unique
+    due_at     REAL    NOT NULL,                   -- Unix time
+    user_id    INTEGER NOT NULL,
+    channel_id INTEGER NOT NULL,
+    guild_id   INTEGER,                            -- NULL in DMs
+    message    TEXT    NOT NULL,
+    attempts   INTEGER NOT NULL DEFAULT 0,         -- Failed deliveries so far
+    owner      INTEGER NOT NULL                    -- The worker that fires it
+);
+
+CREATE INDEX reminders_user_id ON reminders (user_id, due_at);
+CREATE INDEX reminders_owner ON reminders (owner);
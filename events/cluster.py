@@ -0,0 +1,46 @@
+import math
+
+from discord.ext import commands, tasks
+
+from utils import cluster
+
+class Cluster(commands.Cog):
+    """
+    Keeps the cluster launcher informed about this worker's shards, and that it is alive.
+    """
+
+    def __init__(self, bot):
+        self.bot = bot
+
+    async def cog_load(self):
+        self.heartbeat.start()
+
+    async def cog_unload(self):
+        self.heartbeat.cancel()
+
+    @tasks.loop(seconds=cluster.HEARTBEAT_INTERVAL)
+    async def heartbeat(self):
+        # NaN until a shard has connected
+        latency = self.bot.latency
+        cluster.report('heartbeat', guilds=len(self.bot.guilds), latency=None if math.isnan(latency) else latency)
+
+    @commands.Cog.listener()
+    async def on_shard_ready(self, shard_id):
+        cluster.report('shard_ready', shard_id=shard_id)
+
+    @commands.Cog.listener()
+    async def on_shard_resumed(self, shard_id):
+        cluster.report('shard_ready', shard_id=shard_id)
+
+    @commands.Cog.listener()
+    async def on_shard_disconnect(self, shard_id):
+        cluster.report('shard_disconnect', shard_id=shard_id)
+
+    @commands.Cog.listener()
+    async def on_ready(self):
+        cluster.report('ready', guilds=len(self.bot.guilds))
+
+async def setup(bot):
+    # Only cluster workers have a launcher to report to
+    if cluster.get_worker() is not None:
+        await bot.add_cog(Cluster(bot))
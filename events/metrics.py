@@ -0,0 +1,26 @@
+from discord.ext import commands
+
+from utils import metrics
+
+class Metrics(commands.Cog):
+    def __init__(self, bot):
+        self.bot = bot
+
+    @commands.Cog.listener()
+    async def on_app_command_completion(self, interaction, command):
+        metrics.record_command(interaction, 'ok')
+
+    @commands.Cog.listener()
+    async def on_connect(self):
+        metrics.GATEWAY_EVENTS.inc(event='connect')
+
+    @commands.Cog.listener()
+    async def on_disconnect(self):
+        metrics.GATEWAY_EVENTS.inc(event='disconnect')
+
+    @commands.Cog.listener()
+    async def on_resumed(self):
+        metrics.GATEWAY_EVENTS.inc(event='resume')
+
+async def setup(bot):
+    await bot.add_cog(Metrics(bot))
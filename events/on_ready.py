@@ -1,6 +1,10 @@
+import logging
+
 from discord.ext import commands
 import discord
 
+log = logging.getLogger(__name__)
+
 class OnReady(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
@@ -11,17 +15,17 @@ class OnReady(commands.Cog):
             self.bot.ready_called = True
 
             # Log bot's status
-            print(f'{self.bot.user} has connected to Discord!')
-            print ("Connected to the following guilds:")
+            log.info("%s has connected to Discord!", self.bot.user)
+            log.info("Connected to the following guilds:")
             for guild in self.bot.guilds:
-                print(f'{guild.name} (id: {guild.id})')
+                log.info("%s (id: %s)", guild.name, guild.id)
 
             # Set the bot's activity
             activity = discord.Game(name = "/help to view commands")
             await self.bot.change_presence(status=discord.Status.online, activity=activity)
 
             # Log command tree readiness
-            print("Bot is operational")
+            log.info("Bot is operational")
 
 async def setup(bot):
     await bot.add_cog(OnReady(bot))
\ No newline at end of file
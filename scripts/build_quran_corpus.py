@@ -0,0 +1,54 @@
+"""
+Build data/quran.bin from the alquran.cloud quran-uthmani and en.pickthall editions.
+
+Usage:
+    python scripts/build_quran_corpus.py
+    python scripts/build_quran_corpus.py --arabic quran-uthmani.json --english en.pickthall.json
+
+Without arguments both editions are downloaded. Previously downloaded
+/v1/quran/<edition> responses can be passed instead to build offline.
+The bot also builds the corpus itself on first start if it is missing.
+"""
+import argparse
+import json
+import sys
+import urllib.request
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from utils.quran import ARABIC_EDITION, CORPUS_PATH, EDITION_URL, ENGLISH_EDITION, combine_editions, write_corpus
+
+
+def load_edition(edition: str, path: str = None) -> list:
+    if path:
+        with open(path, encoding='utf-8') as file:
+            data = json.load(file)
+    else:
+        print(f"Downloading {edition}...")
+        with urllib.request.urlopen(EDITION_URL.format(edition=edition), timeout=60) as response:
+            data = json.load(response)
+    return data['data']['surahs']
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the local Quran corpus used by /quran.")
+    parser.add_argument('--arabic', help="A saved quran-uthmani edition response")
+    parser.add_argument('--english', help="A saved en.pickthall edition response")
+    parser.add_argument('--output', default=str(CORPUS_PATH), help="Where to write the corpus")
+    args = parser.parse_args()
+
+    arabic = load_edition(ARABIC_EDITION, args.arabic)
+    english = load_edition(ENGLISH_EDITION, args.english)
+
+    try:
+        surahs = combine_editions(arabic, english)
+    except ValueError as e:
+        sys.exit(str(e))
+
+    write_corpus(args.output, surahs)
+    print(f"Wrote {sum(len(surah['ayahs']) for surah in surahs)} ayahs to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,28 @@
+from utils.files import read_json, write_atomically, write_json
+
+
+def test_write_json_replaces_the_file_and_leaves_no_temporary_file(tmp_path):
+    path = tmp_path / 'snapshot.json'
+    write_json(path, {'old': True})
+    write_json(path, {'name': 'Åland'})
+
+    data, modified_at = read_json(path)
+    assert data == {'name': 'Åland'}
+    assert modified_at > 0
+    assert [child.name for child in tmp_path.iterdir()] == ['snapshot.json']
+
+
+def test_a_failed_write_keeps_the_old_file(tmp_path):
+    path = tmp_path / 'corpus.bin'
+    write_atomically(path, lambda file: file.write(b'old'), binary=True)
+
+    def fail(file):
+        file.write(b'partial')
+        raise RuntimeError("crashed mid-write")
+
+    try:
+        write_atomically(path, fail, binary=True)
+    except RuntimeError:
+        pass
+    assert path.read_bytes() == b'old'
+    assert [child.name for child in tmp_path.iterdir()] == ['corpus.bin']
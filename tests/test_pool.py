@@ -0,0 +1,68 @@
+import asyncio
+
+from utils import resilience
+from utils.pool import Pool
+
+
+def make_pool(fetch, capacity: int = 4, low_water: int = 2) -> Pool:
+    return Pool('test', fetch, key=lambda item: item, capacity=capacity, low_water=low_water)
+
+
+def test_take_pops_without_waiting_and_refills_below_low_water():
+    async def main():
+        batches = iter([[1, 2, 3, 4], [5, 6, 7, 8]])
+        calls = []
+
+        async def fetch():
+            calls.append(None)
+            return next(batches)
+
+        pool = make_pool(fetch)
+        await pool.refill()
+        assert [await pool.take(), await pool.take()] == [1, 2]
+        assert len(calls) == 1
+
+        # Below the low-water mark now, so a refill runs in the background
+        assert await pool.take() == 3
+        assert pool.is_refilling()
+        await pool.refill()
+        assert len(calls) == 2
+        assert len(pool) == 5
+
+    asyncio.run(main())
+
+
+def test_recently_served_items_are_not_repeated_to_the_same_audience():
+    async def main():
+        batches = iter([['a', 'b'], ['a', 'c']])
+
+        async def fetch():
+            return next(batches, [])
+
+        pool = make_pool(fetch, capacity=2, low_water=0)
+        await pool.refill()
+        assert await pool.take('guild') == 'a'
+        assert await pool.take('guild') == 'b'
+        await pool.refill()
+        # 'a' again from the upstream: another guild gets it first
+        assert await pool.take('guild') == 'c'
+        assert await pool.take('other guild') == 'a'
+        assert pool.repeats == 0
+
+    asyncio.run(main())
+
+
+def test_refill_does_not_inherit_the_command_deadline():
+    async def main():
+        seen = []
+
+        async def fetch():
+            seen.append(resilience.remaining())
+            return [1, 2, 3, 4]
+
+        pool = make_pool(fetch)
+        resilience.set_deadline(2.0)
+        assert await pool.take() == 1
+        assert seen == [None]
+
+    asyncio.run(main())
@@ -0,0 +1,171 @@
+import asyncio
+import json
+import time
+
+from aiohttp import web
+
+from utils import http
+from utils import quote_book
+from utils.quote_book import QuoteBook
+
+SEED = {'c': 100.0, 'o': 99.0, 'h': 101.0, 'l': 98.0, 'pc': 97.0}
+
+
+class StandInServer:
+    """
+    A local stand-in for Finnhub's trade websocket: records what clients send and pushes trades to them.
+    """
+
+    def __init__(self):
+        self.messages = []
+        self.connections = 0
+        self.sockets = []
+        self._runner = None
+        self.url = None
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_get('/', self._handle)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, '127.0.0.1', 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.url = f'http://127.0.0.1:{port}/'
+
+    async def stop(self):
+        await self._runner.cleanup()
+
+    async def _handle(self, request):
+        websocket = web.WebSocketResponse()
+        await websocket.prepare(request)
+        self.connections += 1
+        self.sockets.append(websocket)
+        async for message in websocket:
+            self.messages.append(json.loads(message.data))
+        return websocket
+
+    async def trade(self, *trades):
+        payload = json.dumps({'type': 'trade', 'data': list(trades)})
+        for websocket in self.sockets:
+            if not websocket.closed:
+                await websocket.send_str(payload)
+
+    async def disconnect(self):
+        for websocket in self.sockets:
+            await websocket.close()
+        self.sockets.clear()
+
+
+async def wait_for(condition, timeout: float = 5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        await asyncio.sleep(0.01)
+
+
+def run_with_server(test):
+    async def main():
+        server = StandInServer()
+        await server.start()
+        await http.open_session()
+        try:
+            await test(server)
+        finally:
+            await http.close_session()
+            await server.stop()
+
+    asyncio.run(main())
+
+
+def make_hot(book: QuoteBook, symbol: str):
+    for _ in range(book.hot_threshold):
+        book.record_demand(symbol, SEED)
+
+
+def test_hot_symbols_are_subscribed_and_follow_trades():
+    async def test(server):
+        task = quote_book.start_quote_book('token', url=server.url)
+        book = quote_book.get_quote_book()
+        try:
+            await wait_for(lambda: server.connections == 1)
+            make_hot(book, 'AAPL')
+            await wait_for(lambda: {'type': 'subscribe', 'symbol': 'AAPL'} in server.messages)
+
+            await server.trade({'s': 'AAPL', 'p': 105.0}, {'s': 'MSFT', 'p': 1.0})
+            await wait_for(lambda: book.get('AAPL')['c'] == 105.0)
+            assert book.get('AAPL')['h'] == 105.0
+            assert book.get('MSFT') is None
+        finally:
+            quote_book.stop_quote_book(task)
+
+    run_with_server(test)
+
+
+def test_malformed_trades_do_not_stop_the_feed():
+    async def test(server):
+        task = quote_book.start_quote_book('token', url=server.url)
+        book = quote_book.get_quote_book()
+        try:
+            await wait_for(lambda: server.connections == 1)
+            make_hot(book, 'AAPL')
+            await server.trade({'s': 'AAPL'}, {'s': 'AAPL', 'p': None})
+            await server.trade({'s': 'AAPL', 'p': 102.5})
+            await wait_for(lambda: book.get('AAPL')['c'] == 102.5)
+            assert not task.done()
+        finally:
+            quote_book.stop_quote_book(task)
+
+    run_with_server(test)
+
+
+def test_reconnects_and_resubscribes(monkeypatch):
+    monkeypatch.setattr(quote_book, 'RECONNECT_MIN_DELAY', 0.01)
+
+    async def test(server):
+        task = quote_book.start_quote_book('token', url=server.url)
+        book = quote_book.get_quote_book()
+        try:
+            await wait_for(lambda: server.connections == 1)
+            make_hot(book, 'AAPL')
+            make_hot(book, 'MSFT')
+            await wait_for(lambda: len(server.messages) == 2)
+
+            await server.disconnect()
+            await wait_for(lambda: server.connections == 2 and len(server.messages) == 4)
+            assert server.messages[2:] == [{'type': 'subscribe', 'symbol': 'AAPL'},
+                                           {'type': 'subscribe', 'symbol': 'MSFT'}]
+        finally:
+            quote_book.stop_quote_book(task)
+
+    run_with_server(test)
+
+
+def test_book_is_cleared_when_its_task_stops(monkeypatch):
+    async def crash(self):
+        raise RuntimeError("boom")
+
+    monkeypatch.setattr(QuoteBook, 'run', crash)
+
+    async def test(server):
+        task = quote_book.start_quote_book('token', url=server.url)
+        assert quote_book.get_quote_book() is not None
+        await asyncio.gather(task, return_exceptions=True)
+        await asyncio.sleep(0)
+        assert quote_book.get_quote_book() is None
+
+    run_with_server(test)
+
+
+def test_only_subscribed_symbols_keep_a_quote():
+    book = QuoteBook('token', limit=2, hot_threshold=2)
+    for index in range(100):
+        book.record_demand(f'COLD{index}', SEED)
+    assert book.stats()['quotes'] == 0
+
+    for symbol in ('A', 'B', 'C'):
+        make_hot(book, symbol)
+    # A was evicted to make room for C, and its quote went with it
+    assert book.stats()['quotes'] == 2
+    assert book.get('A') is None
+    assert book.get('C')['c'] == SEED['c']
@@ -0,0 +1,45 @@
+import asyncio
+
+from utils import resilience
+from utils.refresher import Dataset
+
+
+def test_get_serves_the_last_good_value_while_revalidating():
+    async def main():
+        values = iter(['first', None, 'second'])
+
+        async def fetch():
+            return next(values)
+
+        dataset = Dataset('test', fetch, interval=0)
+        assert dataset.get() is None
+        await dataset.revalidate()
+        assert dataset.value == 'first'
+
+        # A failed refresh keeps the last good value
+        assert await dataset.refresh() is False
+        assert dataset.get() == 'first'
+        assert dataset.consecutive_failures == 1
+
+        assert await dataset.refresh() is True
+        assert dataset.get() == 'second'
+        assert dataset.consecutive_failures == 0
+
+    asyncio.run(main())
+
+
+def test_refresh_does_not_inherit_the_command_deadline():
+    async def main():
+        seen = []
+
+        async def fetch():
+            seen.append(resilience.remaining())
+            return 'value'
+
+        dataset = Dataset('test', fetch, interval=60)
+        resilience.set_deadline(2.0)
+        dataset.get()
+        await dataset.revalidate()
+        assert seen == [None]
+
+    asyncio.run(main())
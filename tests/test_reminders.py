@@ -0,0 +1,154 @@
+import asyncio
+import time
+
+import pytest
+
+from commands.reminders import MAX_LISTED_LENGTH, MAX_MESSAGE_LENGTH, MAX_REMINDER_LENGTH, MAX_REMINDERS_PER_USER
+from commands.reminders import chunk_reminders, shorten
+from utils.database import Database
+from utils.reminders import MAX_DELAY, Reminder, SharedReminderScheduler, parse_duration
+
+
+@pytest.mark.parametrize('text, seconds', [
+    ('90s', 90),
+    ('10m', 600),
+    ('1h30m', 5400),
+    ('2 days', 2 * 24 * 3600),
+    ('1 week, 2 hrs', 7 * 24 * 3600 + 2 * 3600),
+    ('5 mins 3 secs', 303),
+    ('1 Hour', 3600),
+])
+def test_parse_duration(text, seconds):
+    assert parse_duration(text) == seconds
+
+
+@pytest.mark.parametrize('text', ['2 months', '1 month', '3 dogs', '10 mississippi', '5 minutesago', 'soon', '0s', ''])
+def test_parse_duration_rejects_unknown_units(text):
+    assert parse_duration(text) is None
+
+
+def test_parse_duration_rejects_delays_over_the_maximum():
+    assert parse_duration(f'{MAX_DELAY + 1}s') is None
+
+
+class Recorder:
+    """
+    A deliver callback that records what it was handed, failing every delivery while `failing` is set.
+    """
+
+    def __init__(self):
+        self.delivered = []
+        self.failing = False
+
+    async def __call__(self, batch):
+        if self.failing:
+            return batch
+        self.delivered.extend(batch)
+        return []
+
+
+def run_with_workers(test, tmp_path, workers: int = 2):
+    """
+    Run test with one SharedReminderScheduler per worker, each with its own connection to one database file.
+    """
+    async def main():
+        databases = [Database(tmp_path / 'bot.db') for _ in range(workers)]
+        for database in databases:
+            await database.open()
+        recorders = [Recorder() for _ in range(workers)]
+        schedulers = [SharedReminderScheduler(database, worker_id, recorder)
+                      for worker_id, (database, recorder) in enumerate(zip(databases, recorders))]
+        try:
+            await test(schedulers, recorders)
+        finally:
+            for database in databases:
+                await database.close()
+
+    asyncio.run(main())
+
+
+async def fire_due(scheduler):
+    """
+    Fire whatever is due right now on a scheduler, without running its loop.
+    """
+    batch = scheduler._pop_due(time.time())
+    scheduler._in_flight.update((reminder.id, reminder) for reminder in batch)
+    await scheduler._fire(batch)
+
+
+def test_workers_share_ids_limits_and_listings(tmp_path):
+    async def test(schedulers, recorders):
+        first = await schedulers[0].add(time.time() + 60, 1, 10, 100, "first")
+        second = await schedulers[1].add(time.time() + 30, 1, 20, 200, "second")
+
+        assert first.id != second.id
+        for scheduler in schedulers:
+            assert await scheduler.count_for_user(1) == 2
+            assert [reminder.message for reminder in await scheduler.for_user(1)] == ['second', 'first']
+        # Each worker only fires its own
+        assert len(schedulers[0]) == len(schedulers[1]) == 1
+
+    run_with_workers(test, tmp_path)
+
+
+def test_reminder_cancelled_on_another_worker_does_not_fire(tmp_path):
+    async def test(schedulers, recorders):
+        reminder = await schedulers[0].add(time.time() - 1, 1, 10, 100, "cancelled")
+        assert not await schedulers[1].cancel(reminder.id, user_id=2)
+        assert await schedulers[1].cancel(reminder.id, user_id=1)
+
+        await fire_due(schedulers[0])
+        assert recorders[0].delivered == []
+        assert await schedulers[0].count_for_user(1) == 0
+
+    run_with_workers(test, tmp_path)
+
+
+def test_fired_reminders_leave_the_database_and_failures_are_retried(tmp_path):
+    async def test(schedulers, recorders):
+        scheduler = schedulers[0]
+        delivered = await scheduler.add(time.time() - 1, 1, 10, 100, "delivered")
+        await fire_due(scheduler)
+        assert recorders[0].delivered == [delivered]
+        assert await scheduler.count_for_user(1) == 0
+
+        retried = await scheduler.add(time.time() - 1, 2, 10, 100, "retried")
+        recorders[0].failing = True
+        await fire_due(scheduler)
+        [pending] = await schedulers[1].for_user(2)
+        assert pending.attempts == 1 and pending.due_at > time.time()
+        assert scheduler.retried == 1 and len(scheduler) == 1
+
+        # Restarted, the worker picks up where it left off
+        restarted = SharedReminderScheduler(scheduler.database, 0, recorders[0])
+        await restarted.load()
+        assert [reminder.id for reminder in restarted.reminders()] == [retried.id]
+
+    run_with_workers(test, tmp_path)
+
+
+def test_primary_adopts_the_reminders_of_removed_workers(tmp_path):
+    async def test(schedulers, recorders):
+        orphan = await schedulers[2].add(time.time() - 1, 1, 10, 100, "orphan")
+
+        assert await schedulers[0].adopt_orphans(workers=2) == 1
+        await fire_due(schedulers[0])
+        assert recorders[0].delivered == [orphan]
+
+    run_with_workers(test, tmp_path, workers=3)
+
+
+def test_chunks_stay_under_the_message_limit_and_know_their_users():
+    reminders = [Reminder(index, 0, index % 3, 10, 100, 'x' * MAX_REMINDER_LENGTH, 0) for index in range(10)]
+    chunks = chunk_reminders(reminders)
+
+    assert all(len(message) <= MAX_MESSAGE_LENGTH for message, _ in chunks)
+    assert [reminder for _, members in chunks for reminder in members] == reminders
+    for message, members in chunks:
+        assert all(f"<@{reminder.user_id}>" in message for reminder in members)
+
+
+def test_a_full_reminder_list_fits_in_one_embed():
+    value = f"<t:{int(time.time())}:R>: {shorten('x' * MAX_REMINDER_LENGTH)}"
+    assert len(value) <= MAX_LISTED_LENGTH + 20
+    assert len("Your reminders") + MAX_REMINDERS_PER_USER * (len(value) + len("#1000000")) <= 6000
@@ -0,0 +1,51 @@
+import asyncio
+
+from utils.resilience import hedged
+
+
+class Attempts:
+    """
+    A factory of attempts that sleep for the given durations in turn, recording which were cancelled.
+    """
+
+    def __init__(self, *durations):
+        self.durations = list(durations)
+        self.started = 0
+        self.cancelled = 0
+
+    async def attempt(self):
+        index = self.started
+        self.started += 1
+        try:
+            await asyncio.sleep(self.durations[index])
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+        return index
+
+    def __call__(self):
+        return self.attempt()
+
+
+def test_hedge_wins_and_the_slow_attempt_is_cancelled():
+    async def main():
+        attempts = Attempts(10, 0)
+        assert await hedged(attempts, hedge_after=0.01) == 1
+        await asyncio.sleep(0)
+        assert attempts.cancelled == 1
+
+    asyncio.run(main())
+
+
+def test_caller_timing_out_before_the_hedge_cancels_the_first_attempt():
+    async def main():
+        attempts = Attempts(10)
+        try:
+            await asyncio.wait_for(hedged(attempts, hedge_after=5), 0.01)
+        except asyncio.TimeoutError:
+            pass
+        await asyncio.sleep(0)
+        assert attempts.started == 1
+        assert attempts.cancelled == 1
+
+    asyncio.run(main())
@@ -0,0 +1,63 @@
+import asyncio
+import datetime
+from types import SimpleNamespace
+
+from utils import responder
+
+
+class FakeInteraction:
+    """
+    Records what is sent in answer to an interaction, like discord.Interaction.
+    """
+
+    def __init__(self, age: float = 0.0):
+        self.created_at = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(seconds=age)
+        self.command = SimpleNamespace(qualified_name='test')
+        self.calls = []
+        self.response = SimpleNamespace(send_message=self._recorder('send_message'),
+                                        defer=self._recorder('defer'))
+        self.followup = SimpleNamespace(send=self._recorder('followup'))
+        self.delete_original_response = self._recorder('delete_original')
+        self.edit_original_response = self._recorder('edit_original')
+
+    def _recorder(self, name):
+        async def record(*args, **kwargs):
+            self.calls.append((name, kwargs))
+        return record
+
+
+async def slowly(value, delay: float = 0.05):
+    await asyncio.sleep(delay)
+    return value
+
+
+def render(data):
+    if data is None:
+        return {'content': "Not found.", 'ephemeral': True}
+    return {'content': data}
+
+
+async def enrich(data):
+    return {'content': f"{data}!"}
+
+
+def test_quick_answers_are_sent_directly():
+    interaction = FakeInteraction()
+    asyncio.run(responder.respond(interaction, slowly('found', 0), render, enrich))
+    assert interaction.calls == [('send_message', {'content': 'found'}), ('edit_original', {'content': 'found!'})]
+
+
+def test_slow_answers_follow_a_defer(monkeypatch):
+    monkeypatch.setattr(responder, 'DEFER_AFTER', 0.01)
+    interaction = FakeInteraction()
+    asyncio.run(responder.respond(interaction, slowly('found'), render, enrich))
+    assert interaction.calls == [('defer', {'thinking': True}), ('followup', {'content': 'found'}),
+                                 ('edit_original', {'content': 'found!'})]
+
+
+def test_slow_ephemeral_answers_stay_private(monkeypatch):
+    monkeypatch.setattr(responder, 'DEFER_AFTER', 0.01)
+    interaction = FakeInteraction()
+    asyncio.run(responder.respond(interaction, slowly(None), render, enrich))
+    assert interaction.calls == [('defer', {'thinking': True}), ('delete_original', {}),
+                                 ('followup', {'content': 'Not found.', 'ephemeral': True})]
@@ -0,0 +1,164 @@
+import asyncio
+
+from utils.cache import cached
+from utils.singleflight import SingleFlight, coalesced
+
+CALLERS = 50
+
+
+class Upstream:
+    """
+    A stand-in upstream that counts its hits and holds every call until released.
+    """
+
+    def __init__(self, error: Exception = None):
+        self.hits = 0
+        self.error = error
+        self.release = asyncio.Event()
+
+    async def fetch(self, key):
+        self.hits += 1
+        await self.release.wait()
+        if self.error is not None:
+            raise self.error
+        return f"value for {key}"
+
+
+async def start_callers(call, count: int = CALLERS) -> list:
+    tasks = [asyncio.create_task(call()) for _ in range(count)]
+    # Let every caller reach the call in flight before it finishes
+    await asyncio.sleep(0)
+    return tasks
+
+
+def test_concurrent_callers_share_one_call():
+    async def main():
+        upstream = Upstream()
+        group = SingleFlight('test_shared')
+        tasks = await start_callers(lambda: group.do('key', upstream.fetch, 'key'))
+        upstream.release.set()
+        results = await asyncio.gather(*tasks)
+
+        assert upstream.hits == 1
+        assert results == ['value for key'] * CALLERS
+        assert group.stats() == {'executed': 1, 'shared': CALLERS - 1, 'in_flight': 0}
+
+    asyncio.run(main())
+
+
+def test_concurrent_callers_share_one_exception():
+    async def main():
+        error = RuntimeError("upstream down")
+        upstream = Upstream(error)
+        group = SingleFlight('test_shared_error')
+        tasks = await start_callers(lambda: group.do('key', upstream.fetch, 'key'))
+        upstream.release.set()
+        results = await asyncio.gather(*tasks, return_exceptions=True)
+
+        assert upstream.hits == 1
+        assert all(result is error for result in results)
+
+        # The failure isn't remembered: the next call goes upstream again
+        upstream.error = None
+        assert await group.do('key', upstream.fetch, 'key') == 'value for key'
+        assert upstream.hits == 2
+
+    asyncio.run(main())
+
+
+def test_different_keys_are_not_coalesced():
+    async def main():
+        upstream = Upstream()
+        group = SingleFlight('test_keys')
+        tasks = [asyncio.create_task(group.do(key, upstream.fetch, key)) for key in ('a', 'b')]
+        await asyncio.sleep(0)
+        upstream.release.set()
+        assert await asyncio.gather(*tasks) == ['value for a', 'value for b']
+        assert upstream.hits == 2
+
+    asyncio.run(main())
+
+
+def test_cancelled_caller_does_not_cancel_the_others():
+    async def main():
+        upstream = Upstream()
+        group = SingleFlight('test_cancel')
+        tasks = await start_callers(lambda: group.do('key', upstream.fetch, 'key'), count=2)
+        tasks[0].cancel()
+        await asyncio.sleep(0)
+        upstream.release.set()
+
+        assert await tasks[1] == 'value for key'
+        assert tasks[0].cancelled()
+        assert upstream.hits == 1
+
+    asyncio.run(main())
+
+
+def test_cached_and_coalesced_stack_makes_one_upstream_hit():
+    async def main():
+        upstream = Upstream()
+
+        @cached('test_stack', ttl=60)
+        @coalesced('test_stack')
+        async def lookup(symbol):
+            return await upstream.fetch(symbol)
+
+        # Differently written, but normalized to the same key
+        spellings = ['tsla', 'TSLA', ' Tsla ']
+        tasks = [asyncio.create_task(lookup(spellings[index % len(spellings)])) for index in range(CALLERS)]
+        await asyncio.sleep(0)
+        upstream.release.set()
+        results = await asyncio.gather(*tasks)
+
+        assert upstream.hits == 1
+        assert len(set(results)) == 1
+        # Later callers are answered from the cache
+        assert await lookup('TSLA') == results[0]
+        assert upstream.hits == 1
+
+    asyncio.run(main())
+
+
+def test_cached_and_coalesced_stack_shares_exceptions_without_caching_them():
+    async def main():
+        upstream = Upstream(RuntimeError("upstream down"))
+
+        @cached('test_stack_error', ttl=60)
+        @coalesced('test_stack_error')
+        async def lookup(symbol):
+            return await upstream.fetch(symbol)
+
+        tasks = await start_callers(lambda: lookup('TSLA'))
+        upstream.release.set()
+        results = await asyncio.gather(*tasks, return_exceptions=True)
+
+        assert upstream.hits == 1
+        assert all(isinstance(result, RuntimeError) for result in results)
+
+        upstream.error = None
+        assert await lookup('TSLA') == 'value for TSLA'
+        assert upstream.hits == 2
+
+    asyncio.run(main())
+
+
+def test_positional_and_keyword_arguments_share_a_key():
+    async def main():
+        hits = []
+
+        @cached('test_keywords', ttl=60)
+        @coalesced('test_keywords')
+        async def lookup(symbol, limit=1):
+            hits.append((symbol, limit))
+            return f"value for {symbol}"
+
+        assert await lookup('aapl') == 'value for aapl'
+        assert await lookup(symbol='AAPL') == 'value for aapl'
+        assert await lookup(' Aapl ', limit=1) == 'value for aapl'
+        assert hits == [('aapl', 1)]
+
+        await lookup('AAPL', limit=2)
+        assert len(hits) == 2
+
+    asyncio.run(main())
@@ -0,0 +1,86 @@
+import asyncio
+import threading
+from types import SimpleNamespace
+
+import aiohttp
+import pytest
+
+from utils import stocks_api
+from utils.rate_limit import RateLimitBusy
+from utils.resilience import CircuitOpenError
+
+QUOTE = {'c': 105.0, 'o': 100.0, 'h': 106.0, 'l': 99.0, 'pc': 100.0}
+UNKNOWN = {'c': 0, 'd': None, 'dp': None, 'h': 0, 'l': 0, 'o': 0, 'pc': 0, 't': 0}
+
+
+def test_get_quotes_tells_unknown_symbols_from_unavailable_ones(monkeypatch):
+    answers = {
+        'AAPL': QUOTE,
+        'ZZZZ': UNKNOWN,
+        'BUSY': RateLimitBusy("finnhub"),
+        'OPEN': CircuitOpenError('finnhub.io'),
+        'SLOW': aiohttp.ServerTimeoutError("timed out"),
+    }
+
+    async def get_quote(symbol):
+        answer = answers[symbol]
+        if isinstance(answer, Exception):
+            raise answer
+        return answer
+
+    monkeypatch.setattr(stocks_api, 'get_quote', get_quote)
+    quotes = asyncio.run(stocks_api.get_quotes(list(answers)))
+
+    assert quotes == {
+        'AAPL': QUOTE,
+        'ZZZZ': stocks_api.QUOTE_NOT_FOUND,
+        'BUSY': stocks_api.QUOTE_UNAVAILABLE,
+        'OPEN': stocks_api.QUOTE_UNAVAILABLE,
+        'SLOW': stocks_api.QUOTE_UNAVAILABLE,
+    }
+
+
+def test_dividends_ask_for_the_symbol_in_upper_case(monkeypatch):
+    urls = []
+
+    class Response:
+        status = 200
+
+        def json(self):
+            return {'results': [{'cash_amount': 0.25}]} if 'ticker=AAPL&' in urls[-1] else {'results': []}
+
+    async def get(url, **kwargs):
+        urls.append(url)
+        return Response()
+
+    monkeypatch.setattr(stocks_api.http, 'get', get)
+    monkeypatch.setattr(stocks_api, 'get_config', lambda: SimpleNamespace(settings=SimpleNamespace(polygon_key='key')))
+
+    async def main():
+        # However the first caller wrote it, the cached answer is the one for AAPL
+        assert await stocks_api.dividends(' aapl ') == {'cash_amount': 0.25}
+        assert await stocks_api.dividends('AAPL') == {'cash_amount': 0.25}
+
+    asyncio.run(main())
+    assert len(urls) == 1
+
+
+def test_hung_finnhub_calls_stay_off_the_default_executor(monkeypatch):
+    release = threading.Event()
+    threads = []
+
+    def quote(symbol):
+        threads.append(threading.current_thread().name)
+        release.wait()
+
+    monkeypatch.setattr(stocks_api, 'finnhub_client', lambda: SimpleNamespace(quote=quote))
+
+    async def main():
+        try:
+            with pytest.raises(aiohttp.ServerTimeoutError):
+                await stocks_api.finnhub_call('quote', 'HUNG', timeout=0.05)
+        finally:
+            release.set()
+
+    asyncio.run(main())
+    assert threads and all(name.startswith('finnhub') for name in threads)
@@ -0,0 +1,59 @@
+import asyncio
+import json
+from pathlib import Path
+
+from utils import http
+from utils import wikipedia_api
+
+DATA_PATH = Path(__file__).resolve().parent / 'data'
+
+
+def test_search_fetches_result_and_thumbnail_in_one_request(monkeypatch):
+    """
+    The search, thumbnail, extract and URL come from one generator=search request, not a search then a lookup.
+    """
+    recorded = (DATA_PATH / 'wikipedia_search.json').read_text(encoding='utf-8')
+    calls = []
+
+    async def get(url, params=None, **kwargs):
+        calls.append(params)
+        return http.Response(200, recorded, url)
+
+    monkeypatch.setattr(http, 'get', get)
+    result = asyncio.run(wikipedia_api.search_wikipedia('python'))
+
+    assert len(calls) == 1
+    assert calls[0]['generator'] == 'search'
+    assert calls[0]['gsrsearch'] == 'python'
+    assert result == {
+        'title': 'Python (programming language)',
+        'snippet': json.loads(recorded)['query']['pages']['23862']['extract'],
+        'url': 'https://en.wikipedia.org/wiki/Python_(programming_language)',
+        'image_url': 'https://upload.wikimedia.org/wikipedia/commons/thumb/c/c3/'
+                     'Python-logo-notext.svg/300px-Python-logo-notext.svg.png',
+    }
+
+
+def test_title_key_keeps_case_after_the_first_letter():
+    assert wikipedia_api.title_key('MIT') != wikipedia_api.title_key('Mit')
+    assert wikipedia_api.title_key('  mit_license ') == wikipedia_api.title_key('Mit license') == ('Mit license',)
+    assert wikipedia_api.title_key('MIT', '1|Foo') == ('MIT', '1|Foo')
+
+
+def test_sections_of_titles_differing_in_case_are_cached_apart(monkeypatch):
+    requested = []
+
+    async def get(url, params=None, **kwargs):
+        requested.append(params['page'])
+        sections = [{'line': f"About {params['page']}", 'level': '2'}]
+        return http.Response(200, json.dumps({'parse': {'sections': sections}}), url)
+
+    async def main():
+        return [await wikipedia_api.get_article_sections(title) for title in ('MIT', 'Mit', 'mit', 'MIT')]
+
+    monkeypatch.setattr(http, 'get', get)
+    wikipedia_api.get_article_sections.cache.clear()
+    results = asyncio.run(main())
+
+    assert requested == ['MIT', 'Mit']
+    assert [result[0]['title'] for result in results] == ['About MIT', 'About Mit', 'About Mit', 'About MIT']
@@ -0,0 +1,191 @@
+import asyncio
+import datetime
+import itertools
+import logging
+
+from discord import app_commands
+
+from utils import metrics
+from utils.cache import MISSING, TTLCache
+from utils.singleflight import SingleFlight
+
+log = logging.getLogger(__name__)
+
+# Discord shows at most 25 choices, each at most 100 characters long
+MAX_CHOICES = 25
+MAX_CHOICE_LENGTH = 100
+
+# Shorter prefixes match too much to be worth a lookup
+MIN_PREFIX = 2
+
+# A miss waits this long before going upstream, so a burst of keystrokes
+# from one user only sends the last of them
+DEBOUNCE = 0.15
+
+# Suggestions are sent by this many seconds after the interaction was created,
+# from whatever is known locally if the upstream hasn't answered by then;
+# Discord drops autocomplete answers after 3 seconds, and users stop waiting well before
+ANSWER_BUDGET = 1.5
+
+# Upstream lookups in flight at once; misses beyond that are answered locally.
+# Below the HTTP pool's per-host limit, so commands always get a connection
+MAX_IN_FLIGHT = 8
+
+
+def normalize_prefix(text: str) -> str:
+    """
+    Normalize typed text for prefix matching: casefolded, with runs of whitespace
+    collapsed, keeping one trailing space so "new " doesn't match "Newton".
+    """
+    normalized = ' '.join(text.split()).casefold()
+    if normalized and text[-1:].isspace():
+        normalized += ' '
+    return normalized
+
+
+def to_choices(values: list) -> list:
+    """
+    Turn suggestions into app command choices, within Discord's limits.
+    """
+    return [app_commands.Choice(name=value[:MAX_CHOICE_LENGTH], value=value[:MAX_CHOICE_LENGTH])
+            for value in values[:MAX_CHOICES]]
+
+
+def _elapsed(interaction) -> float:
+    return (datetime.datetime.now(datetime.timezone.utc) - interaction.created_at).total_seconds()
+
+
+class PrefixSuggester:
+    """
+    Autocomplete backed by an upstream prefix search, answered locally wherever possible.
+
+    Every upstream answer is cached under its prefix. When an answer had fewer
+    than `limit` results, all of which start with the prefix, it is complete:
+    every extension of that prefix can then be answered by filtering it, without
+    another request. Longer prefixes are looked up from the longest cached one
+    down, so typing "albert einst" after "albert" costs no upstream traffic.
+
+    Misses are debounced per user, coalesced per prefix, capped at
+    MAX_IN_FLIGHT, and never allowed to hold the answer past ANSWER_BUDGET;
+    an upstream answer that arrives late is still cached for the next keystroke.
+
+    Args:
+        name (str): Used for the cache and the metrics.
+        fetch: Async callable taking (prefix, limit) and returning a list of
+            strings, or None on errors.
+        limit (int): Results asked of the upstream per prefix.
+        ttl (float): Seconds to keep each prefix's results.
+        maxsize (int): Prefixes to keep before LRU eviction.
+    """
+
+    def __init__(self, name: str, fetch, limit: int = MAX_CHOICES, ttl: float = 24 * 3600, maxsize: int = 50_000):
+        self.name = name
+        self.fetch = fetch
+        self.limit = limit
+        self.cache = TTLCache(name, maxsize=maxsize, ttl=ttl)
+        self._group = SingleFlight(name)
+        self._latest = {}  # User ID -> ticket of their latest keystroke
+        self._tickets = itertools.count()
+
+    def lookup(self, prefix: str) -> tuple:
+        """
+        Answer a normalized prefix from the cache.
+
+        Returns:
+            tuple: (suggestions, exact). exact is False when the suggestions were
+                filtered from a shorter prefix's incomplete results, so there may be more.
+        """
+        entry = self.cache.get(prefix)
+        if entry is not MISSING:
+            return entry[0], True
+
+        for end in range(len(prefix) - 1, MIN_PREFIX - 1, -1):
+            entry = self.cache.peek(prefix[:end])
+            if entry is MISSING:
+                continue
+            values, complete = entry
+            matches = [value for value in values if normalize_prefix(value).startswith(prefix)]
+            if complete:
+                # Kept under its own key too, so the next lookup is a single get
+                self.cache.load(prefix, (matches, True), self.cache.ttl)
+            return matches, complete
+        return [], False
+
+    async def _fetch(self, prefix: str) -> list:
+        values = await self.fetch(prefix, self.limit)
+        if values is None:
+            return None
+        complete = len(values) < self.limit and all(normalize_prefix(value).startswith(prefix) for value in values)
+        self.cache.set(prefix, (values, complete))
+        return values
+
+    async def suggest(self, text: str, user_id: int = None, budget: float = ANSWER_BUDGET) -> list:
+        """
+        Get suggestions for what a user has typed so far.
+
+        Args:
+            text (str): The text typed so far.
+            user_id (int): Who is typing, for debouncing their keystrokes.
+            budget (float): Seconds left to answer in.
+
+        Returns:
+            list: Up to `limit` suggestions.
+        """
+        prefix = normalize_prefix(text)
+        if len(prefix.strip()) < MIN_PREFIX:
+            self._record('short')
+            return []
+
+        values, exact = self.lookup(prefix)
+        if exact:
+            self._record('cache')
+            return values
+
+        ticket = next(self._tickets)
+        self._latest[user_id] = ticket
+        try:
+            await asyncio.sleep(min(DEBOUNCE, max(0.0, budget)))
+            budget -= DEBOUNCE
+            if self._latest.get(user_id) != ticket:
+                # They've typed more since; this answer won't be shown for long
+                self._record('superseded')
+                return values
+
+            # Another user's keystroke may have fetched it meanwhile
+            values, exact = self.lookup(prefix)
+            if exact:
+                self._record('cache')
+                return values
+            if self._group.in_flight() >= MAX_IN_FLIGHT or budget <= 0:
+                self._record('shed')
+                return values
+
+            try:
+                # The fetch runs in its own task (see SingleFlight), so it finishes and is cached after a timeout
+                fetched = await asyncio.wait_for(self._group.do(prefix, self._fetch, prefix), budget)
+            except asyncio.TimeoutError:
+                self._record('late')
+                return values
+            except Exception as e:
+                log.warning("Autocomplete lookup for %r failed: %s", prefix, e)
+                self._record('error')
+                return values
+            if fetched is None:
+                self._record('error')
+                return values
+            self._record('upstream')
+            return fetched
+        finally:
+            if self._latest.get(user_id) == ticket:
+                del self._latest[user_id]
+
+    async def choices(self, interaction, current: str) -> list:
+        """
+        An app command autocomplete callback's answer for `current`.
+        """
+        values = await self.suggest(current, interaction.user.id, ANSWER_BUDGET - _elapsed(interaction))
+        metrics.AUTOCOMPLETE_LATENCY.observe(_elapsed(interaction), suggester=self.name)
+        return to_choices(values)
+
+    def _record(self, source: str):
+        metrics.AUTOCOMPLETE_ANSWERS.inc(suggester=self.name, source=source)
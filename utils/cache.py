@@ -0,0 +1,277 @@
+import functools
+import inspect
+import time
+from collections import OrderedDict
+
+# Every cache created through TTLCache, by name, so their counters can be reported
+CACHES = {}
+
+# Result classifications returned by a cached function's classify callback
+POSITIVE = 'positive'  # A real answer, cached for the full TTL
+NEGATIVE = 'negative'  # A "not found" answer, cached for the negative TTL
+
+# Sentinel for cache misses, since None is a valid cached value
+MISSING = object()
+
+# Where persistent caches write their entries, set by utils.database.open_database
+_store = None
+
+# Whether other processes write to the same store (cluster mode), so misses are looked up there
+_shared = False
+
+
+def set_store(store, shared: bool = False):
+    """
+    Write entries of persistent caches through to a store, or stop when store is None.
+
+    The store needs put(cache, key, value, ttl) and touch(cache, key) methods;
+    both are called on the event loop, so they must not block. With shared
+    set, it also needs an async get(cache, key) returning (value, ttl) or None,
+    used on a miss to pick up what other processes already fetched.
+    """
+    global _store, _shared
+    _store = store
+    _shared = shared and store is not None
+
+
+def normalize_key(*parts) -> tuple:
+    """
+    Build a cache key that ignores case and surrounding or repeated whitespace.
+
+    Args:
+        *parts: The values identifying the lookup, usually the function arguments.
+
+    Returns:
+        tuple: The normalized key.
+    """
+    return tuple(' '.join(part.split()).casefold() if isinstance(part, str) else part for part in parts)
+
+
+def call_key(signature: inspect.Signature, make_key, args: tuple, kwargs: dict) -> tuple:
+    """
+    Build the key of a call from its arguments in parameter order, defaults included,
+    so f('aapl') and f(symbol='AAPL') share a key however each was passed.
+
+    Args:
+        signature (inspect.Signature): The called function's signature.
+        make_key: The key function, e.g. normalize_key, given every argument value.
+        args (tuple): The positional arguments.
+        kwargs (dict): The keyword arguments.
+    """
+    bound = signature.bind(*args, **kwargs)
+    bound.apply_defaults()
+    values = []
+    for parameter in signature.parameters.values():
+        value = bound.arguments[parameter.name]
+        if parameter.kind is inspect.Parameter.VAR_POSITIONAL:
+            values.extend(value)
+        elif parameter.kind is inspect.Parameter.VAR_KEYWORD:
+            for name in sorted(value):
+                values.extend((name, value[name]))
+        else:
+            values.append(value)
+    return make_key(*values)
+
+
+def classify_truthy(value) -> str:
+    """
+    Default classifier: falsy results are treated as "not found".
+    """
+    return POSITIVE if value else NEGATIVE
+
+
+def classify_optional(value) -> str:
+    """
+    Classifier for functions returning None on errors: None is not cached,
+    other falsy results (such as an empty list) are treated as "not found".
+    """
+    if value is None:
+        return None
+    return POSITIVE if value else NEGATIVE
+
+
+class TTLCache:
+    """
+    An in-memory cache with per-entry expiry and LRU eviction.
+
+    Entries are kept in least- to most-recently-used order, so once the cache
+    holds maxsize entries the least recently used one is evicted. A persistent
+    cache also writes its entries and hits through to the store (see set_store),
+    so it can be warmed up again after a restart.
+    """
+
+    def __init__(self, name: str, maxsize: int = 1024, ttl: float = 300, negative_ttl: float = 60,
+                 persist: bool = False):
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.persist = persist
+        self._entries = OrderedDict()
+
+        # Counters for tuning under real traffic
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.shared_hits = 0
+
+        CACHES[name] = self
+
+    def get(self, key):
+        """
+        Look up a key.
+
+        Args:
+            key: The normalized key.
+
+        Returns:
+            The cached value, or MISSING if the key is absent or expired.
+        """
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return MISSING
+
+        value, expires_at = entry
+        if expires_at <= time.monotonic():
+            del self._entries[key]
+            self.expirations += 1
+            self.misses += 1
+            return MISSING
+
+        self._entries.move_to_end(key)
+        self.hits += 1
+        if self.persist and _store is not None:
+            _store.touch(self.name, key)
+        return value
+
+    def peek(self, key):
+        """
+        Look up a key without counting a hit or miss or refreshing its recency.
+
+        Returns:
+            The cached value, or MISSING if the key is absent or expired.
+        """
+        entry = self._entries.get(key)
+        if entry is None or entry[1] <= time.monotonic():
+            return MISSING
+        return entry[0]
+
+    def set(self, key, value, ttl: float = None):
+        """
+        Store a value, evicting the least recently used entries if the cache is full.
+
+        Args:
+            key: The normalized key.
+            value: The value to store.
+            ttl (float): Seconds until the entry expires. Defaults to the cache TTL.
+        """
+        ttl = self.ttl if ttl is None else ttl
+        self.load(key, value, ttl)
+        if self.persist and _store is not None:
+            _store.put(self.name, key, value, ttl)
+
+    def load(self, key, value, ttl: float):
+        """
+        Store a value without writing it through to the store, e.g. when warming up from it.
+        """
+        self._entries[key] = (value, time.monotonic() + ttl)
+        self._entries.move_to_end(key)
+
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, key):
+        """
+        Remove a key if present.
+        """
+        self._entries.pop(key, None)
+
+    def clear(self):
+        """
+        Remove every entry. Counters are kept.
+        """
+        self._entries.clear()
+
+    def stats(self) -> dict:
+        """
+        Get the cache counters.
+
+        Returns:
+            dict: Hits, misses, evictions, expirations, misses found in the
+                shared store, current size and hit ratio.
+        """
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'expirations': self.expirations,
+            'shared_hits': self.shared_hits,
+            'size': len(self._entries),
+            'maxsize': self.maxsize,
+            'hit_ratio': self.hits / lookups if lookups else 0.0
+        }
+
+    def __len__(self):
+        return len(self._entries)
+
+
+def cached(name: str, ttl: float, negative_ttl: float = 60, maxsize: int = 1024, classify=classify_truthy,
+           persist: bool = False, key=normalize_key):
+    """
+    Cache the results of an async function in a named TTLCache.
+
+    The key is built from the arguments with normalize_key (or the given key
+    function), so "  Paris" and "paris" share an entry, whether they are passed
+    by position or by keyword. The classify callback
+    decides what to store: POSITIVE results are kept for ttl, NEGATIVE
+    ("not found") results for negative_ttl, and anything else (such as a
+    transient error) is not cached.
+    Exceptions are never cached.
+
+    Args:
+        name (str): The cache name, used when reporting counters.
+        ttl (float): Seconds to keep positive results.
+        negative_ttl (float): Seconds to keep "not found" results.
+        maxsize (int): Maximum number of entries before LRU eviction.
+        classify: Callback mapping a result to POSITIVE, NEGATIVE or None.
+        persist (bool): Keep the entries across restarts; the results must be JSON serializable.
+        key: Callable building the key from the arguments, for lookups where case matters.
+    """
+    make_key = key
+    cache = TTLCache(name, maxsize=maxsize, ttl=ttl, negative_ttl=negative_ttl, persist=persist)
+
+    def decorator(func):
+        signature = inspect.signature(func)
+
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            key = call_key(signature, make_key, args, kwargs)
+            value = cache.get(key)
+            if value is not MISSING:
+                return value
+
+            if cache.persist and _shared:
+                # Another process may have fetched it already
+                entry = await _store.get(name, key)
+                if entry is not None:
+                    value, ttl_left = entry
+                    cache.load(key, value, ttl_left)
+                    cache.shared_hits += 1
+                    return value
+
+            value = await func(*args, **kwargs)
+            kind = classify(value)
+            if kind == POSITIVE:
+                cache.set(key, value, ttl)
+            elif kind == NEGATIVE:
+                cache.set(key, value, negative_ttl)
+            return value
+
+        wrapper.cache = cache
+        return wrapper
+
+    return decorator
@@ -0,0 +1,471 @@
+import asyncio
+import dataclasses
+import json
+import logging
+import multiprocessing
+import os
+import queue
+import re
+import signal
+import time
+
+import aiohttp
+
+log = logging.getLogger(__name__)
+
+# Workers report to the launcher this often; one that stays silent for HEARTBEAT_TIMEOUT is restarted
+HEARTBEAT_INTERVAL = 10.0
+HEARTBEAT_TIMEOUT = 90.0
+
+# How often the launcher checks its workers, and how long a restart waits: doubling from
+# RESTART_BACKOFF up to MAX_RESTART_BACKOFF, back to the start once a worker stays up STABLE_AFTER
+SUPERVISE_INTERVAL = 1.0
+RESTART_BACKOFF = 1.0
+MAX_RESTART_BACKOFF = 60.0
+STABLE_AFTER = 300.0
+
+# Workers get this long to shut down cleanly before they are killed
+SHUTDOWN_TIMEOUT = 30.0
+
+# Discord allows max_concurrency IDENTIFYs per this many seconds, across every process of the bot
+IDENTIFY_INTERVAL = 5.0
+
+# How long the launcher waits for each worker's metrics when aggregating them
+SCRAPE_TIMEOUT = 2.0
+
+# The worker this process runs, set in cluster workers only
+_worker = None
+
+
+@dataclasses.dataclass(frozen=True)
+class Worker:
+    """
+    What a worker process needs to know about its place in the cluster.
+    """
+    worker_id: int
+    workers: int
+    shard_ids: tuple
+    shard_count: int
+    metrics_port: int
+    # Sends (worker_id, event, data) to the launcher
+    events: object = dataclasses.field(repr=False, compare=False)
+    # One lock per identify bucket, shared by every worker
+    identify_locks: tuple = dataclasses.field(repr=False, compare=False)
+
+
+def get_worker() -> Worker:
+    """
+    Get this process's worker, or None outside of a cluster.
+    """
+    return _worker
+
+
+def is_primary() -> bool:
+    """
+    Check whether this process should run the once-per-bot jobs, such as
+    syncing commands or streaming quotes: a single process, or worker 0.
+    """
+    return _worker is None or _worker.worker_id == 0
+
+
+def report(event: str, **data):
+    """
+    Tell the launcher about an event, such as a shard becoming ready. Does nothing outside of a cluster.
+    """
+    if _worker is None:
+        return
+    try:
+        _worker.events.put_nowait((_worker.worker_id, event, data))
+    except (queue.Full, ValueError, OSError):
+        # The launcher is gone or shutting down
+        pass
+
+
+async def wait_for_identify(shard_id: int):
+    """
+    Wait for this shard's identify bucket, so workers don't IDENTIFY faster than Discord allows.
+
+    The bucket is held for IDENTIFY_INTERVAL after the wait returns. If a worker
+    dies while holding it, the wait gives up after a few intervals and goes ahead.
+    """
+    lock = _worker.identify_locks[shard_id % len(_worker.identify_locks)]
+    acquired = await asyncio.to_thread(lock.acquire, timeout=IDENTIFY_INTERVAL * 4)
+    if not acquired:
+        log.warning("Identify bucket for shard %d is stuck, identifying anyway", shard_id)
+        return
+    asyncio.get_running_loop().call_later(IDENTIFY_INTERVAL, lock.release)
+
+
+def shard_ranges(shard_count: int, workers: int) -> list:
+    """
+    Split the shards into contiguous ranges, as even as possible, one per worker.
+
+    Returns:
+        list: A tuple of shard IDs per worker.
+    """
+    if workers > shard_count:
+        raise ValueError(f"Can't spread {shard_count} shards over {workers} workers")
+    size, extra = divmod(shard_count, workers)
+    ranges = []
+    start = 0
+    for worker_id in range(workers):
+        end = start + size + (1 if worker_id < extra else 0)
+        ranges.append(tuple(range(start, end)))
+        start = end
+    return ranges
+
+
+async def fetch_gateway_info(token: str) -> tuple:
+    """
+    Ask Discord how many shards the bot should use.
+
+    Returns:
+        tuple: The recommended shard count and the identify max_concurrency.
+    """
+    from discord.http import Route
+
+    async with aiohttp.ClientSession() as session:
+        async with session.get(f'{Route.BASE}/gateway/bot', headers={'Authorization': f'Bot {token}'}) as response:
+            response.raise_for_status()
+            data = await response.json()
+    return data['shards'], data.get('session_start_limit', {}).get('max_concurrency', 1)
+
+
+# A sample line of the Prometheus text format: name, optional {labels}, and the rest
+_SAMPLE = re.compile(r'^([a-zA-Z_:][a-zA-Z0-9_:]*)(?:\{(.*)\})?(\s.*)$')
+
+
+def merge_metrics(texts: dict) -> list:
+    """
+    Merge the metrics of several workers into one exposition, with a worker label on every sample.
+
+    Each metric's HELP and TYPE lines are kept once, followed by every
+    worker's samples of it, since Prometheus rejects repeated metric families.
+
+    Args:
+        texts (dict): Metrics text by worker ID.
+
+    Returns:
+        list: The merged lines.
+    """
+    families = {}
+    for worker_id, text in sorted(texts.items()):
+        family = None
+        for line in text.splitlines():
+            if line.startswith('# HELP ') or line.startswith('# TYPE '):
+                family = line.split()[2]
+                headers = families.setdefault(family, {'HELP': None, 'TYPE': None, 'samples': []})
+                headers[line.split()[1]] = line
+                continue
+            match = _SAMPLE.match(line)
+            if not match:
+                continue
+            name, labels, rest = match.groups()
+            worker_label = f'worker="{worker_id}"'
+            labels = f'{worker_label},{labels}' if labels else worker_label
+            samples = families.setdefault(family or name, {'HELP': None, 'TYPE': None, 'samples': []})['samples']
+            samples.append(f'{name}{{{labels}}}{rest}')
+
+    lines = []
+    for family in families.values():
+        lines.extend(header for header in (family['HELP'], family['TYPE']) if header)
+        lines.extend(family['samples'])
+    return lines
+
+
+@dataclasses.dataclass
+class WorkerState:
+    """
+    What the launcher knows about one of its workers.
+    """
+    worker: Worker
+    process: multiprocessing.Process = None
+    status: str = 'stopped'  # stopped, starting, ready or waiting (to be restarted)
+    started_at: float = 0.0
+    last_heartbeat: float = 0.0
+    ready_shards: set = dataclasses.field(default_factory=set)
+    guilds: int = 0
+    latency: float = None
+    restarts: int = 0
+    backoff: float = RESTART_BACKOFF
+    restart_at: float = 0.0
+
+    def to_dict(self) -> dict:
+        return {
+            'pid': self.process.pid if self.process else None,
+            'status': self.status,
+            'shards': list(self.worker.shard_ids),
+            'ready_shards': sorted(self.ready_shards),
+            'guilds': self.guilds,
+            'latency': self.latency,
+            'restarts': self.restarts,
+            'metrics_port': self.worker.metrics_port,
+        }
+
+
+def _worker_main(target, worker: Worker, initializer, initargs):
+    global _worker
+    _worker = worker
+    # The launcher stops workers with SIGTERM; shut down like on Ctrl+C, closing the bot cleanly
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    if initializer is not None:
+        initializer(*initargs)
+    report('started', pid=os.getpid())
+    target(worker)
+
+
+class Cluster:
+    """
+    Runs the bot's shards across several worker processes and keeps them running.
+
+    Each worker is a separate process with its own event loop and an
+    AutoShardedBot for a contiguous range of shards. The launcher restarts
+    workers that exit or stop sending heartbeats, with exponential backoff,
+    and serves the whole cluster's metrics and readiness:
+
+        /metrics  every worker's metrics, labelled by worker, plus the cluster's own
+        /ready    200 once every shard is ready, 503 until then
+        /status   the state of each worker, as JSON
+    """
+
+    def __init__(self, target, workers: int, shard_count: int, max_concurrency: int = 1,
+                 host: str = '127.0.0.1', port: int = 9100, initializer=None, initargs: tuple = ()):
+        """
+        Args:
+            target: Called with the Worker in each worker process to run its bot; must be picklable.
+            workers (int): Number of worker processes.
+            shard_count (int): Total number of shards.
+            max_concurrency (int): Shards that may IDENTIFY at once, from Discord's gateway info.
+            host (str): Where to serve the cluster's metrics and readiness.
+            port (int): Its port; worker N serves its own metrics on port + 1 + N.
+            initializer: Called with initargs in each worker before target, e.g. to point it at a stub gateway.
+        """
+        self.target = target
+        self.shard_count = shard_count
+        self.host = host
+        self.port = port
+        self.initializer = initializer
+        self.initargs = initargs
+
+        # Spawned, so workers don't inherit the launcher's event loop or open sockets
+        self._context = multiprocessing.get_context('spawn')
+        self.events = self._context.Queue()
+        identify_locks = tuple(self._context.Lock() for _ in range(max(1, max_concurrency)))
+        self.workers = [WorkerState(Worker(worker_id, workers, shard_ids, shard_count, port + 1 + worker_id,
+                                           self.events, identify_locks))
+                        for worker_id, shard_ids in enumerate(shard_ranges(shard_count, workers))]
+
+        self._stopping = asyncio.Event()
+        self._runner = None
+        self._scrape_session = None
+
+    def start_worker(self, state: WorkerState):
+        state.process = self._context.Process(
+            target=_worker_main, args=(self.target, state.worker, self.initializer, self.initargs),
+            name=f'sharmouta-worker-{state.worker.worker_id}', daemon=False)
+        state.process.start()
+        state.status = 'starting'
+        state.started_at = state.last_heartbeat = time.monotonic()
+        state.ready_shards.clear()
+        log.info("Started worker %d (pid %d) for shards %s", state.worker.worker_id, state.process.pid,
+                 _describe_shards(state.worker.shard_ids),
+                 extra={'worker': state.worker.worker_id, 'pid': state.process.pid})
+
+    def _handle_event(self, worker_id: int, event: str, data: dict):
+        state = self.workers[worker_id]
+        state.last_heartbeat = time.monotonic()
+        if event == 'shard_ready':
+            state.ready_shards.add(data['shard_id'])
+        elif event == 'shard_disconnect':
+            state.ready_shards.discard(data['shard_id'])
+        elif event == 'ready':
+            state.status = 'ready'
+            state.guilds = data.get('guilds', state.guilds)
+            log.info("Worker %d is ready with %d guilds", worker_id, state.guilds, extra={'worker': worker_id})
+        elif event == 'heartbeat':
+            state.guilds = data.get('guilds', state.guilds)
+            state.latency = data.get('latency')
+
+    async def _read_events(self):
+        while True:
+            try:
+                # Blocks a thread rather than the loop; wakes up regularly so cancellation isn't held up
+                worker_id, event, data = await asyncio.to_thread(self.events.get, True, 0.5)
+            except queue.Empty:
+                continue
+            self._handle_event(worker_id, event, data)
+
+    def _supervise_once(self):
+        now = time.monotonic()
+        for state in self.workers:
+            worker_id = state.worker.worker_id
+            if state.status == 'waiting':
+                if now >= state.restart_at:
+                    state.restarts += 1
+                    self.start_worker(state)
+                continue
+
+            if not state.process.is_alive():
+                # A worker that stayed up for a while starts over from the shortest backoff
+                if now - state.started_at >= STABLE_AFTER:
+                    state.backoff = RESTART_BACKOFF
+                log.error("Worker %d exited with code %s, restarting in %.0fs", worker_id, state.process.exitcode,
+                          state.backoff, extra={'worker': worker_id})
+                state.status = 'waiting'
+                state.ready_shards.clear()
+                state.restart_at = now + state.backoff
+                state.backoff = min(state.backoff * 2, MAX_RESTART_BACKOFF)
+            elif now - state.last_heartbeat > HEARTBEAT_TIMEOUT:
+                # Its event loop is stuck; the next check restarts it
+                log.error("Worker %d sent no heartbeat for %.0fs, killing it", worker_id, now - state.last_heartbeat,
+                          extra={'worker': worker_id})
+                state.process.kill()
+                state.last_heartbeat = now
+
+    async def _supervise(self):
+        while True:
+            await asyncio.sleep(SUPERVISE_INTERVAL)
+            self._supervise_once()
+
+    def is_ready(self) -> bool:
+        return all(state.status == 'ready' and len(state.ready_shards) == len(state.worker.shard_ids)
+                   for state in self.workers)
+
+    def status(self) -> dict:
+        return {
+            'ready': self.is_ready(),
+            'shard_count': self.shard_count,
+            'guilds': sum(state.guilds for state in self.workers),
+            'workers': {state.worker.worker_id: state.to_dict() for state in self.workers},
+        }
+
+    async def _scrape(self, state: WorkerState):
+        try:
+            async with self._scrape_session.get(f'http://127.0.0.1:{state.worker.metrics_port}/metrics') as response:
+                return await response.text()
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            return ''
+
+    def _cluster_lines(self) -> list:
+        lines = ['# HELP cluster_workers_ready Workers whose shards are all ready',
+                 '# TYPE cluster_workers_ready gauge',
+                 f'cluster_workers_ready {sum(state.status == "ready" for state in self.workers)}',
+                 '# HELP cluster_shards_ready Shards that are ready',
+                 '# TYPE cluster_shards_ready gauge',
+                 f'cluster_shards_ready {sum(len(state.ready_shards) for state in self.workers)}',
+                 '# HELP cluster_guilds Guilds across all workers',
+                 '# TYPE cluster_guilds gauge',
+                 f'cluster_guilds {sum(state.guilds for state in self.workers)}',
+                 '# HELP cluster_worker_restarts_total Worker restarts',
+                 '# TYPE cluster_worker_restarts_total counter']
+        lines.extend(f'cluster_worker_restarts_total{{worker="{state.worker.worker_id}"}} {state.restarts}'
+                     for state in self.workers)
+        return lines
+
+    async def _handle_metrics(self, request):
+        from aiohttp import web
+        texts = await asyncio.gather(*(self._scrape(state) for state in self.workers))
+        lines = self._cluster_lines() + merge_metrics({state.worker.worker_id: text
+                                                       for state, text in zip(self.workers, texts)})
+        return web.Response(text='\n'.join(lines) + '\n', content_type='text/plain', charset='utf-8',
+                            headers={'X-Content-Type-Options': 'nosniff'})
+
+    async def _handle_ready(self, request):
+        from aiohttp import web
+        status = self.status()
+        return web.json_response({'ready': status['ready']}, status=200 if status['ready'] else 503)
+
+    async def _handle_status(self, request):
+        from aiohttp import web
+        return web.json_response(self.status(), dumps=lambda data: json.dumps(data, default=str))
+
+    async def start_server(self):
+        from aiohttp import web
+        app = web.Application()
+        app.router.add_get('/metrics', self._handle_metrics)
+        app.router.add_get('/ready', self._handle_ready)
+        app.router.add_get('/status', self._handle_status)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+
+    def stop(self):
+        """
+        Ask run() to stop the workers and return.
+        """
+        self._stopping.set()
+
+    async def run(self):
+        """
+        Start the workers and supervise them until stop() is called, then shut them down.
+        """
+        self._scrape_session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=SCRAPE_TIMEOUT))
+        try:
+            await self.start_server()
+        except OSError as e:
+            log.error("Failed to start cluster server: %s", e)
+        for state in self.workers:
+            self.start_worker(state)
+
+        tasks = [asyncio.create_task(self._read_events()), asyncio.create_task(self._supervise())]
+        try:
+            await self._stopping.wait()
+        finally:
+            for task in tasks:
+                task.cancel()
+            await self.shutdown()
+            await self._scrape_session.close()
+            if self._runner is not None:
+                await self._runner.cleanup()
+
+    async def shutdown(self):
+        """
+        Stop every worker: politely first, then by force after SHUTDOWN_TIMEOUT.
+        """
+        running = [state.process for state in self.workers if state.process is not None and state.process.is_alive()]
+        for process in running:
+            process.terminate()
+        deadline = time.monotonic() + SHUTDOWN_TIMEOUT
+        for process in running:
+            await asyncio.to_thread(process.join, max(0.0, deadline - time.monotonic()))
+            if process.is_alive():
+                log.warning("Worker pid %d didn't stop in time, killing it", process.pid)
+                process.kill()
+                await asyncio.to_thread(process.join)
+        for state in self.workers:
+            state.status = 'stopped'
+        log.info("Stopped %d workers", len(running))
+
+
+def _describe_shards(shard_ids) -> str:
+    return f'{shard_ids[0]}-{shard_ids[-1]}' if len(shard_ids) > 1 else str(shard_ids[0])
+
+
+def run_cluster(target, workers: int, shard_count: int = None, token: str = None, **options):
+    """
+    Run a cluster in this process until interrupted.
+
+    Args:
+        target: Runs a worker's bot; see Cluster.
+        workers (int): Number of worker processes.
+        shard_count (int): Total number of shards, or None to use Discord's recommendation.
+        token (str): The bot token, to ask Discord for its recommendation.
+        options: Passed on to Cluster.
+    """
+    async def main():
+        nonlocal shard_count
+        if shard_count is None:
+            shard_count, max_concurrency = await fetch_gateway_info(token)
+            options.setdefault('max_concurrency', max_concurrency)
+            log.info("Discord recommends %d shards (identify concurrency %d)", shard_count,
+                     options['max_concurrency'])
+        # Never fewer shards than workers, so every worker has something to do
+        shard_count = max(shard_count, workers)
+
+        cluster = Cluster(target, workers, shard_count, **options)
+        loop = asyncio.get_running_loop()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(signum, cluster.stop)
+        await cluster.run()
+
+    asyncio.run(main())
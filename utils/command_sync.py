@@ -0,0 +1,87 @@
+import asyncio
+import hashlib
+import json
+import logging
+from pathlib import Path
+
+import discord
+
+from utils.files import write_json
+
+log = logging.getLogger(__name__)
+
+ROOT_PATH = Path(__file__).resolve().parent.parent
+FINGERPRINT_PATH = ROOT_PATH / 'data' / 'command_tree.hash'
+
+
+def fingerprint(tree, guild: discord.abc.Snowflake = None) -> str:
+    """
+    Hash the commands that a sync would upload, so unchanged trees can skip the sync.
+
+    The hash covers every command's serialized payload (names, descriptions,
+    options, permissions, localizations) and the application ID, and doesn't
+    depend on the order the commands were registered in.
+
+    Args:
+        tree: The bot's CommandTree.
+        guild: The guild whose commands to hash, or None for the global commands.
+
+    Returns:
+        str: The hex SHA-256 of the payload.
+    """
+    payload = sorted((command.to_dict(tree) for command in tree.get_commands(guild=guild)),
+                     key=lambda command: (command.get('type', 1), command['name']))
+    text = json.dumps({'application_id': tree.client.application_id, 'commands': payload},
+                      sort_keys=True, separators=(',', ':'), ensure_ascii=False, default=str)
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def _read_fingerprints(path: Path) -> dict:
+    try:
+        return json.loads(path.read_text(encoding='utf-8'))
+    except (OSError, ValueError):
+        return {}
+
+
+def _write_fingerprints(path: Path, fingerprints: dict):
+    write_json(path, fingerprints, indent=4)
+
+
+async def sync_commands(tree, guild_id: int = None, force: bool = False, path=None) -> bool:
+    """
+    Sync the command tree with Discord, unless it is unchanged since the last sync.
+
+    With a guild ID (development), the global commands are copied to that
+    guild and synced there only, which takes effect immediately. Otherwise
+    they are synced globally. Each scope's fingerprint is kept in
+    data/command_tree.hash once its sync succeeds.
+
+    Args:
+        tree: The bot's CommandTree.
+        guild_id (int): The development guild, or None to sync globally.
+        force (bool): Sync even if the fingerprint is unchanged.
+        path: Where fingerprints are stored, data/command_tree.hash by default.
+
+    Returns:
+        bool: True if a sync was sent.
+    """
+    path = Path(path or FINGERPRINT_PATH)
+    guild = None
+    scope = 'global'
+    if guild_id is not None:
+        guild = discord.Object(id=guild_id)
+        scope = f'guild:{guild_id}'
+        tree.copy_global_to(guild=guild)
+
+    current = fingerprint(tree, guild)
+    fingerprints = await asyncio.to_thread(_read_fingerprints, path)
+    if not force and fingerprints.get(scope) == current:
+        log.info("Command tree of %d commands unchanged, skipping %s sync", len(tree.get_commands(guild=guild)), scope)
+        return False
+
+    synced = await tree.sync(guild=guild)
+    log.info("Synced %d commands (%s)", len(synced), scope)
+
+    fingerprints[scope] = current
+    await asyncio.to_thread(_write_fingerprints, path, fingerprints)
+    return True
@@ -0,0 +1,209 @@
+import asyncio
+import dataclasses
+import json
+import logging
+import os
+from pathlib import Path
+from types import MappingProxyType
+from typing import Mapping, Optional
+
+from dotenv import load_dotenv
+
+from utils.files import write_json
+
+log = logging.getLogger(__name__)
+
+ROOT_PATH = Path(__file__).resolve().parent.parent
+SETTINGS_PATH = ROOT_PATH / 'data' / 'settings.json'
+ENV_PATH = ROOT_PATH / '.env'
+
+# How often the settings files are checked for changes
+WATCH_INTERVAL = 5
+
+
+def _optional_int(value) -> Optional[int]:
+    return int(value) if value else None
+
+
+def _freeze(settings: dict) -> Mapping:
+    return MappingProxyType(dict(settings))
+
+
+@dataclasses.dataclass(frozen=True)
+class Settings:
+    """
+    An immutable snapshot of the bot's configuration.
+
+    Credentials come from the environment (and .env); everything else comes
+    from data/settings.json. A new snapshot replaces the old one on every
+    change, so readers never see a half-applied update.
+    """
+    bot_token: Optional[str] = None
+    guild_id: Optional[int] = None
+    finnhub_key: Optional[str] = None
+    polygon_key: Optional[str] = None
+    api_ninja_key: Optional[str] = None
+
+    # Settings applied to every guild, and per-guild overrides keyed by guild ID
+    guild_defaults: Mapping = dataclasses.field(default_factory=lambda: MappingProxyType({}))
+    guilds: Mapping = dataclasses.field(default_factory=lambda: MappingProxyType({}))
+
+    # Any other top-level section of settings.json, e.g. "rate_limits"
+    extra: Mapping = dataclasses.field(default_factory=lambda: MappingProxyType({}))
+
+    @classmethod
+    def from_sources(cls, file_settings: dict) -> 'Settings':
+        guilds = {int(guild_id): _freeze(settings) for guild_id, settings in file_settings.get('guilds', {}).items()}
+        extra = {key: value for key, value in file_settings.items() if key not in ('defaults', 'guilds')}
+        return cls(
+            bot_token=os.getenv('BOT_TOKEN'),
+            guild_id=_optional_int(os.getenv('GUILD_ID')),
+            finnhub_key=os.getenv('FINHUB_KEY'),
+            polygon_key=os.getenv('POLYGON_KEY'),
+            api_ninja_key=os.getenv('API_NINJA_KEY'),
+            guild_defaults=_freeze(file_settings.get('defaults', {})),
+            guilds=MappingProxyType(guilds),
+            extra=MappingProxyType(extra)
+        )
+
+    def to_file_settings(self) -> dict:
+        settings = {key: value for key, value in self.extra.items()}
+        settings['defaults'] = dict(self.guild_defaults)
+        settings['guilds'] = {str(guild_id): dict(values) for guild_id, values in self.guilds.items()}
+        return settings
+
+
+class Config:
+    """
+    Loads the configuration once and owns the long-lived API clients.
+
+    The current Settings snapshot is swapped atomically on reload or on a
+    per-guild update (copy-on-write), and watch() hot-reloads it when .env or
+    data/settings.json change on disk.
+    """
+
+    def __init__(self, settings_path=SETTINGS_PATH, env_path=ENV_PATH):
+        self.settings_path = Path(settings_path)
+        self.env_path = Path(env_path)
+        self.settings = Settings()
+        self._mtimes = None
+        self._finnhub = None
+        self._finnhub_key = None
+        self.reload()
+
+    def _file_mtimes(self) -> tuple:
+        mtimes = []
+        for path in (self.settings_path, self.env_path):
+            try:
+                mtimes.append(path.stat().st_mtime_ns)
+            except OSError:
+                mtimes.append(None)
+        return tuple(mtimes)
+
+    def _read_settings_file(self) -> dict:
+        try:
+            with open(self.settings_path, encoding='utf-8') as file:
+                text = file.read()
+        except OSError:
+            return {}
+        # The settings file starts out empty
+        return json.loads(text) if text.strip() else {}
+
+    def reload(self) -> bool:
+        """
+        Re-read .env and data/settings.json and swap in a new snapshot.
+
+        The previous snapshot is kept if the settings file is invalid.
+
+        Returns:
+            bool: True if the new settings were applied.
+        """
+        self._mtimes = self._file_mtimes()
+        load_dotenv(self.env_path, override=True)
+        try:
+            self.settings = Settings.from_sources(self._read_settings_file())
+        except (ValueError, TypeError, AttributeError) as e:
+            log.error("Invalid settings in %s, keeping the previous settings: %s", self.settings_path, e)
+            return False
+        return True
+
+    async def watch(self, interval: float = WATCH_INTERVAL):
+        """
+        Reload whenever .env or data/settings.json change. Runs until cancelled.
+        """
+        while True:
+            await asyncio.sleep(interval)
+            mtimes = await asyncio.to_thread(self._file_mtimes)
+            if mtimes != self._mtimes:
+                await asyncio.to_thread(self.reload)
+                log.info("Reloaded settings")
+
+    def guild(self, guild_id: int) -> Mapping:
+        """
+        Get a guild's settings, with the defaults applied.
+
+        Args:
+            guild_id (int): The guild ID, or None outside of a guild.
+
+        Returns:
+            Mapping: A read-only view of the guild's settings.
+        """
+        settings = self.settings
+        overrides = settings.guilds.get(guild_id)
+        if not overrides:
+            return settings.guild_defaults
+        return MappingProxyType({**settings.guild_defaults, **overrides})
+
+    async def set_guild(self, guild_id: int, key: str, value):
+        """
+        Update one of a guild's settings and save it to data/settings.json.
+
+        Args:
+            guild_id (int): The guild ID.
+            key (str): The setting name.
+            value: The new value; must be JSON serializable.
+        """
+        settings = self.settings
+        guilds = dict(settings.guilds)
+        guilds[guild_id] = _freeze({**settings.guilds.get(guild_id, {}), key: value})
+        self.settings = dataclasses.replace(settings, guilds=MappingProxyType(guilds))
+        await asyncio.to_thread(self._write_settings_file, self.settings.to_file_settings())
+
+    def _write_settings_file(self, file_settings: dict):
+        write_json(self.settings_path, file_settings, indent=4)
+        # Our own write shouldn't trigger a reload
+        self._mtimes = self._file_mtimes()
+
+    @property
+    def finnhub(self):
+        """
+        The long-lived Finnhub client, rebuilt only when the API key changes.
+        """
+        key = self.settings.finnhub_key
+        if self._finnhub is None or key != self._finnhub_key:
+            import finnhub
+            self._finnhub = finnhub.Client(api_key=key)
+            self._finnhub_key = key
+        return self._finnhub
+
+
+# The configuration loaded at startup
+_config = None
+
+
+def load_config() -> Config:
+    """
+    Load the configuration. Called once when the bot starts.
+    """
+    global _config
+    _config = Config()
+    return _config
+
+
+def get_config() -> Config:
+    """
+    Get the loaded configuration, loading it on first use.
+    """
+    if _config is None:
+        return load_config()
+    return _config
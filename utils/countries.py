@@ -0,0 +1,228 @@
+import asyncio
+import bisect
+import difflib
+import logging
+import time
+import unicodedata
+from pathlib import Path
+
+import aiohttp
+
+from utils import http
+from utils import rate_limit
+from utils.cache import normalize_key
+from utils.files import read_json, write_json
+
+log = logging.getLogger(__name__)
+
+# Bulk snapshot of every country; restcountries allows at most 10 fields on /all
+SNAPSHOT_URL = ('https://restcountries.com/v3.1/all'
+                '?fields=name,capital,population,area,currencies,languages,flags,cca2,cca3,altSpellings')
+SNAPSHOT_PATH = Path(__file__).resolve().parent.parent / 'data' / 'countries.json'
+
+# How often the snapshot is refreshed from the API
+REFRESH_INTERVAL = 7 * 24 * 3600
+
+# Placeholder shown when a country has no flag image
+NO_FLAG_URL = "https://via.placeholder.com/150?text=No+Image"
+
+# Match priorities, lowest wins when two countries share a key
+PRIORITY_CODE = 0
+PRIORITY_COMMON = 1
+PRIORITY_OFFICIAL = 2
+PRIORITY_ALT = 3
+
+# Minimum similarity for a fuzzy match
+FUZZY_CUTOFF = 0.75
+
+
+def format_country(country: dict) -> dict:
+    """
+    Convert a restcountries record into the structure used by the /country command.
+
+    Args:
+        country (dict): A single country as returned by restcountries.
+
+    Returns:
+        dict: The common and official names, capital, population, area, currency, language and flag URL.
+    """
+    # Handle currencies
+    currencies = ", ".join(
+        [f"{value.get('name', 'Unknown')} ({value.get('symbol', '')})"
+         for key, value in country.get("currencies", {}).items()]
+    )
+
+    # Handle languages
+    languages = ", ".join(country.get("languages", {}).values())
+
+    # Handle capital
+    capital = country.get("capital", [])
+    capital = ", ".join(capital) if capital else "Unknown"
+
+    # Handle flag
+    flag_url = country.get("flags", {}).get("png", "")
+    flag_url = flag_url if flag_url else NO_FLAG_URL
+
+    return {
+        "name": {
+            "common": country.get("name", {}).get("common", "Unknown"),
+            "official": country.get("name", {}).get("official", "Unknown")
+        },
+        "capital": capital,
+        "population": country.get("population", "Unknown"),
+        "area": country.get("area", "Unknown"),
+        "currency": currencies if currencies else "Unknown",
+        "language": languages if languages else "Unknown",
+        "flag": flag_url
+    }
+
+
+def _normalize(text: str) -> str:
+    # Fold accents as well as case, so "bharat" matches "Bhārat"
+    text = unicodedata.normalize('NFKD', text)
+    text = ''.join(char for char in text if not unicodedata.combining(char))
+    return normalize_key(text)[0]
+
+
+class CountryIndex:
+    """
+    In-memory indexes over a restcountries snapshot: exact, then prefix, then fuzzy matches on codes and names.
+    """
+
+    def __init__(self, countries: list):
+        self.countries = [format_country(country) for country in countries]
+        self._populations = [country.get("population") or 0 for country in countries]
+
+        # Exact key -> (priority, country position)
+        self._exact = {}
+        for position, country in enumerate(countries):
+            name = country.get("name", {})
+            for code in (country.get("cca2"), country.get("cca3")):
+                self._add(code, PRIORITY_CODE, position)
+            self._add(name.get("common"), PRIORITY_COMMON, position)
+            self._add(name.get("official"), PRIORITY_OFFICIAL, position)
+            for spelling in country.get("altSpellings", []):
+                self._add(spelling, PRIORITY_ALT, position)
+
+        # Sorted names for prefix matching with bisect; codes are excluded
+        self._names = sorted(key for key, (priority, _) in self._exact.items() if priority != PRIORITY_CODE)
+
+    def _add(self, key, priority, position):
+        if not key:
+            return
+        key = _normalize(key)
+        current = self._exact.get(key)
+        if current is None or (priority, -self._populations[position]) < \
+                (current[0], -self._populations[current[1]]):
+            self._exact[key] = (priority, position)
+
+    def _prefix_matches(self, prefix: str) -> list:
+        start = bisect.bisect_left(self._names, prefix)
+        matches = []
+        for key in self._names[start:]:
+            if not key.startswith(prefix):
+                break
+            matches.append(self._exact[key])
+        return matches
+
+    def lookup(self, query: str) -> dict:
+        """
+        Find the best matching country.
+
+        Args:
+            query (str): A country name, alternative spelling or ISO code.
+
+        Returns:
+            dict: The formatted country, or None if nothing matches.
+        """
+        key = _normalize(query)
+        if not key:
+            return None
+
+        # Exact match on a code or any name
+        match = self._exact.get(key)
+        if match is not None:
+            return self.countries[match[1]]
+
+        # Prefix match, preferring common names and then larger countries
+        matches = self._prefix_matches(key)
+        if matches:
+            priority, position = min(matches, key=lambda match: (match[0], -self._populations[match[1]]))
+            return self.countries[position]
+
+        # Fuzzy match for typos
+        close = difflib.get_close_matches(key, self._names, n=1, cutoff=FUZZY_CUTOFF)
+        if close:
+            return self.countries[self._exact[close[0]][1]]
+
+        return None
+
+    def __len__(self):
+        return len(self.countries)
+
+
+# The index currently being served, replaced atomically on refresh
+_index = None
+_loaded_at = 0.0
+
+
+def get_index() -> CountryIndex:
+    """
+    Get the loaded country index, or None if no snapshot has been loaded yet.
+    """
+    return _index
+
+
+def _install(countries: list, loaded_at: float):
+    global _index, _loaded_at
+    _index = CountryIndex(countries)
+    _loaded_at = loaded_at
+
+
+async def load_snapshot() -> bool:
+    """
+    Load the snapshot file from data/ and build the index.
+
+    Returns:
+        bool: True if a snapshot was loaded.
+    """
+    try:
+        countries, modified_at = await asyncio.to_thread(read_json, SNAPSHOT_PATH)
+    except (OSError, ValueError) as e:
+        log.warning("Could not load country snapshot: %s", e)
+        return False
+
+    await asyncio.to_thread(_install, countries, modified_at)
+    return True
+
+
+async def refresh_snapshot() -> bool:
+    """
+    Download a fresh snapshot from restcountries, save it to data/ and rebuild the index.
+    The current index keeps being served if the download fails.
+
+    Returns:
+        bool: True if the snapshot was refreshed.
+    """
+    try:
+        response = await http.get(SNAPSHOT_URL, priority=rate_limit.BACKGROUND)
+        response.raise_for_status()
+        countries = response.json()
+    except (aiohttp.ClientError, ValueError) as e:
+        log.warning("Error refreshing country snapshot: %s", e)
+        return False
+
+    if not isinstance(countries, list) or not countries:
+        log.warning("Unexpected data structure for country snapshot")
+        return False
+
+    await asyncio.to_thread(write_json, SNAPSHOT_PATH, countries)
+    await asyncio.to_thread(_install, countries, time.time())
+    return True
+
+
+def snapshot_is_stale() -> bool:
+    """
+    Check whether the loaded snapshot is missing or older than REFRESH_INTERVAL.
+    """
+    return _index is None or time.time() - _loaded_at > REFRESH_INTERVAL
@@ -0,0 +1,390 @@
+import asyncio
+import contextlib
+import json
+import logging
+import re
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from utils import cache
+
+log = logging.getLogger(__name__)
+
+ROOT_PATH = Path(__file__).resolve().parent.parent
+DATABASE_PATH = ROOT_PATH / 'data' / 'bot.db'
+SCHEMA_PATH = ROOT_PATH / 'data' / 'database.sql'
+
+# Pending writes are flushed in one transaction this often, or sooner once this many are queued
+WRITE_INTERVAL = 1.0
+WRITE_BATCH_SIZE = 500
+
+# The most entries preloaded into each persistent cache on startup
+PRELOAD_LIMIT = 1000
+
+# How often expired entries are deleted, hit counts decayed and free pages returned
+COMPACT_INTERVAL = 6 * 3600
+
+# Marks the start of a migration in data/database.sql
+MIGRATION_MARKER = re.compile(r'^-- migration: (\d+)\s*$', re.MULTILINE)
+
+# The database currently open, owned by the bot (see Sharmouta.setup_hook)
+_database = None
+
+
+def load_migrations(schema_path=SCHEMA_PATH) -> list:
+    """
+    Split the schema file into its numbered migrations.
+
+    Returns:
+        list: (version, sql) pairs in version order.
+
+    Raises:
+        ValueError: If the versions aren't 1, 2, 3, ... in order.
+    """
+    text = Path(schema_path).read_text(encoding='utf-8')
+    markers = list(MIGRATION_MARKER.finditer(text))
+    migrations = []
+    for position, marker in enumerate(markers):
+        end = markers[position + 1].start() if position + 1 < len(markers) else len(text)
+        migrations.append((int(marker.group(1)), text[marker.end():end]))
+
+    if [version for version, _ in migrations] != list(range(1, len(migrations) + 1)):
+        raise ValueError(f"Migrations in {schema_path} must be numbered 1, 2, 3, ... in order")
+    return migrations
+
+
+def _split_statements(sql: str) -> list:
+    """
+    Split a migration into its statements.
+    """
+    statements = []
+    current = ''
+    for line in sql.splitlines(keepends=True):
+        current += line
+        if sqlite3.complete_statement(current):
+            statements.append(current.strip())
+            current = ''
+    # Whatever is left after the last statement may only be comments
+    if any(line.strip() and not line.strip().startswith('--') for line in current.splitlines()):
+        raise ValueError(f"Incomplete SQL statement in migration: {current.strip()}")
+    return statements
+
+
+def _encode_key(key) -> str:
+    return json.dumps(key, ensure_ascii=False, separators=(',', ':'))
+
+
+def _decode_key(text: str):
+    # Keys are tuples (see cache.normalize_key), which JSON stores as lists
+    def to_tuple(value):
+        return tuple(to_tuple(item) for item in value) if isinstance(value, list) else value
+    return to_tuple(json.loads(text))
+
+
+class Database:
+    """
+    The bot's SQLite database, in WAL mode.
+
+    Every SQLite call runs on one dedicated thread, so the event loop never
+    blocks on disk I/O and the connection is never shared between threads.
+    Cache writes and hit counts are queued in memory and written in batches,
+    one transaction per batch, by a background writer.
+    """
+
+    def __init__(self, path=DATABASE_PATH, schema_path=SCHEMA_PATH):
+        self.path = Path(path)
+        self.schema_path = Path(schema_path)
+        self._connection = None
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='database')
+
+        self._pending = {}  # (cache, key) -> (value, expires_at), the latest write wins
+        self._hits = {}     # (cache, key) -> hits since the last flush
+        self._flush_needed = asyncio.Event()
+
+        # The writer and compaction tasks, started by open_database
+        self.tasks = []
+
+        # Counters
+        self.writes = 0
+        self.flushes = 0
+        self.dropped = 0
+
+    async def _run(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    async def open(self):
+        """
+        Open the database and apply any pending migrations.
+        """
+        await self._run(self._open)
+
+    def _open(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._connection = sqlite3.connect(self.path, isolation_level=None)
+        self._connection.execute('PRAGMA journal_mode = WAL')
+        self._connection.execute('PRAGMA synchronous = NORMAL')
+        self._connection.execute('PRAGMA busy_timeout = 5000')
+        # Only takes effect on a new database, before the first table is created
+        self._connection.execute('PRAGMA auto_vacuum = INCREMENTAL')
+        self._migrate()
+
+    def _migrate(self):
+        for version, sql in load_migrations(self.schema_path):
+            # IMMEDIATE takes the write lock before reading the version, so processes
+            # sharing the database (cluster workers) don't apply the same migration twice
+            with self._transaction('IMMEDIATE'):
+                if self._connection.execute('PRAGMA user_version').fetchone()[0] >= version:
+                    continue
+                for statement in _split_statements(sql):
+                    self._connection.execute(statement)
+                self._connection.execute(f'PRAGMA user_version = {version}')
+            log.info("Applied database migration %d", version)
+
+    async def close(self):
+        """
+        Flush pending writes and close the database.
+        """
+        await self.flush()
+        await self._run(self._connection.close)
+        self._executor.shutdown(wait=True)
+
+    def put(self, cache_name: str, key, value, ttl: float):
+        """
+        Queue a cache entry to be written. Doesn't block.
+        """
+        self._pending[(cache_name, key)] = (value, time.time() + ttl)
+        if len(self._pending) >= WRITE_BATCH_SIZE:
+            self._flush_needed.set()
+
+    def touch(self, cache_name: str, key):
+        """
+        Count a cache hit, so the entry is more likely to be preloaded. Doesn't block.
+        """
+        entry = (cache_name, key)
+        self._hits[entry] = self._hits.get(entry, 0) + 1
+
+    async def flush(self):
+        """
+        Write everything queued so far in one transaction.
+        """
+        if not self._pending and not self._hits:
+            return
+        pending, self._pending = self._pending, {}
+        hits, self._hits = self._hits, {}
+        try:
+            await self._run(self._write, pending, hits)
+        except sqlite3.Error as e:
+            self.dropped += len(pending)
+            log.error("Failed to write %d cache entries: %s", len(pending), e)
+
+    def _write(self, pending: dict, hits: dict):
+        now = time.time()
+        rows = []
+        for (cache_name, key), (value, expires_at) in pending.items():
+            try:
+                rows.append((cache_name, _encode_key(key), json.dumps(value, ensure_ascii=False),
+                             expires_at, hits.pop((cache_name, key), 0), now))
+            except (TypeError, ValueError):
+                # Not JSON serializable; the entry just stays in memory
+                self.dropped += 1
+
+        with self._transaction():
+            self._connection.executemany(
+                'INSERT INTO cache_entries (cache, key, value, expires_at, hits, updated_at) '
+                'VALUES (?, ?, ?, ?, ?, ?) '
+                'ON CONFLICT (cache, key) DO UPDATE SET value = excluded.value, '
+                'expires_at = excluded.expires_at, hits = hits + excluded.hits, updated_at = excluded.updated_at',
+                rows)
+            self._connection.executemany(
+                'UPDATE cache_entries SET hits = hits + ? WHERE cache = ? AND key = ?',
+                [(count, cache_name, _encode_key(key)) for (cache_name, key), count in hits.items()])
+        self.writes += len(rows)
+        self.flushes += 1
+
+    @contextlib.contextmanager
+    def _transaction(self, mode: str = ''):
+        self._connection.execute(f'BEGIN {mode}')
+        try:
+            yield
+        except BaseException:
+            self._connection.execute('ROLLBACK')
+            raise
+        self._connection.execute('COMMIT')
+
+    async def run_writer(self, interval: float = WRITE_INTERVAL):
+        """
+        Flush queued writes every interval seconds, or sooner when a batch fills up. Runs until cancelled.
+        """
+        while True:
+            try:
+                await asyncio.wait_for(self._flush_needed.wait(), interval)
+            except asyncio.TimeoutError:
+                pass
+            self._flush_needed.clear()
+            await self.flush()
+
+    async def hottest(self, cache_name: str, limit: int = PRELOAD_LIMIT) -> list:
+        """
+        Get a cache's most hit entries that haven't expired.
+
+        Returns:
+            list: (key, value, seconds to live) tuples, hottest first.
+        """
+        return await self._run(self._hottest, cache_name, limit)
+
+    def _hottest(self, cache_name: str, limit: int) -> list:
+        now = time.time()
+        rows = self._connection.execute(
+            'SELECT key, value, expires_at FROM cache_entries WHERE cache = ? AND expires_at > ? '
+            'ORDER BY hits DESC LIMIT ?', (cache_name, now, limit)).fetchall()
+        return [(_decode_key(key), json.loads(value), expires_at - now) for key, value, expires_at in rows]
+
+    async def get(self, cache_name: str, key):
+        """
+        Read one entry straight from the database.
+
+        Returns:
+            tuple: (value, seconds to live), or None if the entry is absent or expired.
+        """
+        return await self._run(self._get, cache_name, key)
+
+    def _get(self, cache_name: str, key):
+        now = time.time()
+        row = self._connection.execute(
+            'SELECT value, expires_at FROM cache_entries WHERE cache = ? AND key = ? AND expires_at > ?',
+            (cache_name, _encode_key(key), now)).fetchone()
+        return None if row is None else (json.loads(row[0]), row[1] - now)
+
+    async def execute(self, sql: str, parameters=()) -> list:
+        """
+        Run one statement, in a transaction of its own, for modules keeping their own tables (e.g. reminders).
+
+        Returns:
+            list: The rows it returned.
+        """
+        return await self._run(self._execute, sql, parameters)
+
+    def _execute(self, sql: str, parameters) -> list:
+        return self._connection.execute(sql, parameters).fetchall()
+
+    async def compact(self):
+        """
+        Delete expired entries, halve hit counts so hotness follows recent demand,
+        and give free pages and the write-ahead log back to the file system.
+        """
+        await self.flush()
+        deleted = await self._run(self._compact)
+        log.info("Compacted database, deleted %d expired cache entries", deleted)
+
+    def _compact(self) -> int:
+        with self._transaction():
+            deleted = self._connection.execute('DELETE FROM cache_entries WHERE expires_at <= ?',
+                                               (time.time(),)).rowcount
+            self._connection.execute('UPDATE cache_entries SET hits = hits / 2 WHERE hits > 0')
+        self._connection.execute('PRAGMA incremental_vacuum')
+        self._connection.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+        self._connection.execute('PRAGMA optimize')
+        return deleted
+
+    async def run_compaction(self, interval: float = COMPACT_INTERVAL):
+        """
+        Compact every interval seconds. Runs until cancelled.
+        """
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.compact()
+            except sqlite3.Error as e:
+                log.error("Failed to compact database: %s", e)
+
+    def stats(self) -> dict:
+        return {
+            'pending': len(self._pending),
+            'writes': self.writes,
+            'flushes': self.flushes,
+            'dropped': self.dropped
+        }
+
+
+async def preload(database: Database, limit: int = PRELOAD_LIMIT) -> int:
+    """
+    Warm up every persistent cache with its hottest entries from the database.
+
+    Returns:
+        int: The number of entries loaded.
+    """
+    loaded = 0
+    # A copy, since caches register themselves as their modules are imported
+    for name, ttl_cache in list(cache.CACHES.items()):
+        if not ttl_cache.persist:
+            continue
+        entries = await database.hottest(name, min(limit, ttl_cache.maxsize))
+        # Load the coldest first, so the hottest end up most recently used
+        for key, value, ttl in reversed(entries):
+            ttl_cache.load(key, value, ttl)
+        loaded += len(entries)
+    return loaded
+
+
+async def warm_caches(database: Database = None) -> int:
+    """
+    Preload every persistent cache defined so far, logging how many entries were loaded.
+
+    Returns:
+        int: The number of entries loaded.
+    """
+    database = database or _database
+    loaded = await preload(database)
+    log.info("Preloaded %d cache entries from %s", loaded, database.path)
+    return loaded
+
+
+def get_database() -> Database:
+    """
+    Get the open database, or None if it isn't open.
+    """
+    return _database
+
+
+async def open_database(path=None, warm: bool = True, shared: bool = False) -> Database:
+    """
+    Open the database, warm up the persistent caches from it, and start the
+    background writer and compaction.
+
+    Args:
+        path: The database file, data/bot.db by default.
+        warm (bool): Preload the persistent caches. Pass False if the modules
+            defining them aren't imported yet, and call warm_caches once they are.
+        shared (bool): Other processes use the same database (cluster mode), so
+            cache misses are looked up in it before fetching.
+
+    Returns:
+        Database: The open database.
+    """
+    global _database
+    database = Database(path or DATABASE_PATH)
+    await database.open()
+    if warm:
+        await warm_caches(database)
+
+    database.tasks = [asyncio.create_task(database.run_writer()),
+                      asyncio.create_task(database.run_compaction())]
+    cache.set_store(database, shared=shared)
+    _database = database
+    return database
+
+
+async def close_database():
+    """
+    Stop writing through to the database, flush what is queued and close it.
+    """
+    global _database
+    if _database is None:
+        return
+    cache.set_store(None)
+    for task in _database.tasks:
+        task.cancel()
+    await _database.close()
+    _database = None
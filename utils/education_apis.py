@@ -1,29 +1,76 @@
-import requests
-import os
-from dotenv import load_dotenv
+import logging
 
-# Load the environment variables
-load_dotenv()
-API_NINJA_KEY = os.getenv('API_NINJA_KEY')
-SCIENCE_FACT_KEY = os.getenv('SCIENTIFIC-FACTS-KEY')
+from utils import countries
+from utils import http
+from utils import rate_limit
+from utils.cache import cached, POSITIVE, NEGATIVE
+from utils.config import get_config
+from utils.pool import Pool
+from utils.singleflight import coalesced
 
-def fetch_random_fact():
+log = logging.getLogger(__name__)
+
+# How long lookups are cached; country and planet data almost never change
+COUNTRY_TTL = 7 * 24 * 3600
+CELESTIAL_TTL = 7 * 24 * 3600
+NOT_FOUND_TTL = 3600
+
+# Facts asked for per request (the most API Ninjas returns at once),
+# how many are kept ready, and how few trigger a refill
+FACT_BATCH = 30
+FACT_POOL_CAPACITY = 60
+FACT_POOL_LOW_WATER = 15
+
+def classify_lookup(data):
+    """
+    Cache classifier for lookups returning a dict with an "error" key on failure.
+    Only "not found" errors are cached; transient API errors are retried.
+    """
+    if "error" not in data:
+        return POSITIVE
+    return NEGATIVE if data.get("not_found") else None
+
+async def fetch_random_facts():
+    """
+    Fetch a batch of random facts from API Ninjas.
+
+    Returns:
+        list: The facts.
+        None: If the API returns an error.
+    """
     api_url = "https://api.api-ninjas.com/v1/facts"
-    api_key = API_NINJA_KEY  # Replace with your actual API key
+    api_key = get_config().settings.api_ninja_key
     headers = {"X-Api-Key": api_key}
 
-    response = requests.get(api_url, headers=headers)
-    if response.status_code == 200:
-        data = response.json()
-        return data[0]["fact"] if data else "No facts found."
-    else:
-        return f"Error: {response.status_code} - {response.text}"
+    try:
+        response = await http.get(api_url, params={"limit": FACT_BATCH}, headers=headers, upstream='api_ninjas',
+                                  priority=rate_limit.BACKGROUND)
+        if response.status == 200:
+            return [item["fact"] for item in response.json() if item.get("fact")]
+        log.warning("API Ninjas returned %s for facts: %s", response.status, response.text)
+        return None
+    except Exception as e:
+        log.warning("Error fetching facts from API Ninjas: %s", e)
+        return None
+
+# Refilled in the background, so /fact doesn't wait on API Ninjas
+random_facts = Pool('facts', fetch_random_facts, key=lambda fact: fact, capacity=FACT_POOL_CAPACITY,
+                    low_water=FACT_POOL_LOW_WATER)
 
-def fetch_celestial_body(body_name):
+async def fetch_random_fact(audience=None):
+    """
+    Get a random fact from the prefetched pool, not repeating recent ones to the audience (e.g. a guild ID).
+    """
+    return await random_facts.take(audience)
+
+@cached('celestial', ttl=CELESTIAL_TTL, negative_ttl=NOT_FOUND_TTL, maxsize=256,
+        classify=classify_lookup, persist=True)
+@coalesced('celestial')
+async def fetch_celestial_body(body_name):
     api_url = f"https://api.le-systeme-solaire.net/rest/bodies/{body_name.lower()}"
     try:
-        response = requests.get(api_url)
-        if response.status_code == 200:
+        response = await http.get(api_url)
+        if response.status == 200:
             data = response.json()
             if "name" in data:
                 return {
@@ -35,55 +82,44 @@ def fetch_celestial_body(body_name):
                     "orbit": f"{data.get('sideralOrbit', 'N/A')} Earth days"
                 }
             else:
-                return {"error": "No details found for this celestial body."}
+                return {"error": "No details found for this celestial body.", "not_found": True}
+        elif response.status == 404:
+            return {"error": "No details found for this celestial body.", "not_found": True}
         else:
-            return {"error": f"API returned {response.status_code}: {response.text}"}
+            return {"error": f"API returned {response.status}: {response.text}"}
     except Exception as e:
         return {"error": str(e)}
 
-import requests
+async def fetch_country(country):
+    """
+    Look up a country, answering from the local snapshot index when it is loaded.
+    """
+    index = countries.get_index()
+    if index is None:
+        return await fetch_country_live(country)
+
+    data = index.lookup(country)
+    if data is None:
+        return {"error": "No details found for this country.", "not_found": True}
+    return data
 
-def fetch_country(country):
+@cached('country', ttl=COUNTRY_TTL, negative_ttl=NOT_FOUND_TTL, maxsize=512,
+        classify=classify_lookup, persist=True)
+@coalesced('country')
+async def fetch_country_live(country):
     api_url = f"https://restcountries.com/v3.1/name/{country}"
 
     try:
-        response = requests.get(api_url)
-        if response.status_code == 200:
+        response = await http.get(api_url)
+        if response.status == 200:
             data = response.json()
             if data:
-                # Handle currencies
-                currencies = ", ".join(
-                    [f"{value.get('name', 'Unknown')} ({value.get('symbol', '')})"
-                     for key, value in data[0].get("currencies", {}).items()]
-                )
-
-                # Handle languages
-                languages = ", ".join(data[0].get("languages", {}).values())
-
-                # Handle capital
-                capital = data[0].get("capital", [])
-                capital = ", ".join(capital) if capital else "Unknown"
-
-                # Handle flag
-                flag_url = data[0].get("flags", {}).get("png", "")
-                flag_url = flag_url if flag_url else "https://via.placeholder.com/150?text=No+Image"
-
-                # Return structured data
-                return {
-                    "name": {
-                        "common": data[0].get("name", {}).get("common", "Unknown"),
-                        "official": data[0].get("name", {}).get("official", "Unknown")
-                    },
-                    "capital": capital,
-                    "population": data[0].get("population", "Unknown"),
-                    "area": data[0].get("area", "Unknown"),
-                    "currency": currencies if currencies else "Unknown",
-                    "language": languages if languages else "Unknown",
-                    "flag": flag_url
-                }
+                return countries.format_country(data[0])
             else:
-                return {"error": "No details found for this country."}
+                return {"error": "No details found for this country.", "not_found": True}
+        elif response.status == 404:
+            return {"error": "No details found for this country.", "not_found": True}
         else:
-            return {"error": f"API returned {response.status_code}: {response.text}"}
+            return {"error": f"API returned {response.status}: {response.text}"}
     except Exception as e:
         return {"error": str(e)}
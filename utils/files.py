@@ -0,0 +1,43 @@
+import json
+import os
+from pathlib import Path
+
+
+def write_atomically(path, write, binary: bool = False):
+    """
+    Replace a file so a crash never leaves it truncated: write to a temporary file, sync it and swap it in.
+
+    Args:
+        path: The file to replace.
+        write: Callable taking the open temporary file and writing the new contents.
+        binary (bool): Open the temporary file in binary mode.
+    """
+    path = Path(path)
+    temporary_path = path.with_name(path.name + '.tmp')
+    try:
+        with open(temporary_path, 'wb' if binary else 'w', encoding=None if binary else 'utf-8') as file:
+            write(file)
+            file.flush()
+            os.fsync(file.fileno())
+    except BaseException:
+        temporary_path.unlink(missing_ok=True)
+        raise
+    os.replace(temporary_path, path)
+
+
+def write_json(path, data, **kwargs):
+    """
+    Replace a JSON file atomically. Keyword arguments are passed to json.dump.
+    """
+    write_atomically(path, lambda file: json.dump(data, file, ensure_ascii=False, **kwargs))
+
+
+def read_json(path) -> tuple:
+    """
+    Read a JSON file.
+
+    Returns:
+        tuple: The parsed contents, and the file's modification time.
+    """
+    with open(path, encoding='utf-8') as file:
+        return json.load(file), os.path.getmtime(path)
@@ -0,0 +1,178 @@
+import asyncio
+import json
+import time
+from urllib.parse import urlsplit
+
+import aiohttp
+
+from utils import metrics
+from utils import rate_limit
+from utils import resilience
+
+# Connection pool settings for the shared client session
+CONNECTION_LIMIT = 100          # Total open connections across all hosts
+CONNECTION_LIMIT_PER_HOST = 10  # Open connections to a single upstream
+DNS_CACHE_TTL = 300             # Seconds to keep resolved addresses
+KEEPALIVE_TIMEOUT = 30          # Seconds to keep idle connections open
+
+# The shared client session, owned by the bot (see Sharmouta.setup_hook)
+_session = None
+
+# Upstream hosts whose requests are sent to another base URL instead, e.g. a
+# local stand-in server (see benchmarks/)
+_redirects = {}
+
+
+class HTTPStatusError(aiohttp.ClientError):
+    """Raised by Response.raise_for_status for 4xx and 5xx responses."""
+
+    def __init__(self, status: int, text: str, url: str):
+        super().__init__(f"{status} for {url}")
+        self.status = status
+        self.text = text
+        self.url = url
+
+
+class Response:
+    """
+    A fully read HTTP response.
+
+    The body is read before the connection goes back to the pool, so callers
+    don't need to manage the aiohttp response context themselves.
+    """
+
+    def __init__(self, status: int, text: str, url: str):
+        self.status = status
+        self.text = text
+        self.url = url
+
+    def json(self):
+        """
+        Decode the body as JSON.
+
+        Raises:
+            ValueError: If the body is not valid JSON.
+        """
+        return json.loads(self.text)
+
+    def raise_for_status(self):
+        """
+        Raise an HTTPStatusError if the response is a 4xx or 5xx.
+        """
+        if self.status >= 400:
+            raise HTTPStatusError(self.status, self.text, self.url)
+
+
+async def open_session() -> aiohttp.ClientSession:
+    """
+    Create the shared client session with keep-alive pooling and DNS caching.
+
+    Returns:
+        aiohttp.ClientSession: The shared session.
+    """
+    global _session
+    if _session is None or _session.closed:
+        connector = aiohttp.TCPConnector(
+            limit=CONNECTION_LIMIT,
+            limit_per_host=CONNECTION_LIMIT_PER_HOST,
+            ttl_dns_cache=DNS_CACHE_TTL,
+            keepalive_timeout=KEEPALIVE_TIMEOUT
+        )
+        _session = aiohttp.ClientSession(connector=connector)
+    return _session
+
+
+async def close_session():
+    """
+    Close the shared client session and release its pooled connections.
+    """
+    global _session
+    if _session is not None and not _session.closed:
+        await _session.close()
+    _session = None
+
+
+def get_session() -> aiohttp.ClientSession:
+    """
+    Get the shared client session.
+
+    Raises:
+        RuntimeError: If the session has not been opened yet.
+    """
+    if _session is None or _session.closed:
+        raise RuntimeError("HTTP session is not open; call open_session() first")
+    return _session
+
+
+def redirect_upstream(host: str, base_url: str = None):
+    """
+    Send every request for host to base_url instead, keeping the path and query.
+
+    Timeouts, circuit breakers and metrics still use the original host.
+
+    Args:
+        host (str): The upstream host, e.g. "en.wikipedia.org".
+        base_url (str): The URL to send its requests to, or None to stop redirecting.
+    """
+    if base_url is None:
+        _redirects.pop(host, None)
+    else:
+        _redirects[host] = base_url.rstrip('/')
+
+
+def is_retryable_status(response: Response) -> bool:
+    return response.status >= 500 or response.status == 429
+
+
+async def get(url: str, params: dict = None, headers: dict = None, upstream: str = None,
+              priority: int = rate_limit.INTERACTIVE, retries: int = resilience.RETRIES,
+              hedge_after: float = None, timeout: float = None) -> Response:
+    """
+    Send a GET request through the shared client session.
+
+    The request gets a timeout derived from the command's remaining time
+    budget, is retried with jittered backoff on connection errors, timeouts,
+    5xx and 429 responses, and fails fast while the host's circuit is open.
+
+    Args:
+        url (str): The URL to request.
+        params (dict): Optional query string parameters.
+        headers (dict): Optional request headers.
+        upstream (str): The rate limited upstream this request counts against, if any.
+        priority (int): rate_limit.INTERACTIVE or rate_limit.BACKGROUND.
+        retries (int): How many times to retry a failed request.
+        hedge_after (float): If set, send a hedged duplicate request after this many seconds.
+        timeout (float): Seconds per attempt instead of the host's timeout, e.g. for a bulk download.
+
+    Returns:
+        Response: The fully read response.
+
+    Raises:
+        RateLimitBusy: If the upstream's rate limit can't be met in time.
+        CircuitOpenError: If the host is failing and its circuit is open.
+        aiohttp.ServerTimeoutError: If no response arrived in time.
+    """
+    async def send():
+        if upstream is not None:
+            await rate_limit.acquire(upstream, priority, resilience.current_deadline())
+
+        started_at = time.monotonic()
+        try:
+            async with get_session().get(target, params=params, headers=headers) as response:
+                text = await response.text()
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            metrics.UPSTREAM_REQUESTS.inc(host=host, status=type(e).__name__)
+            raise
+        finally:
+            metrics.UPSTREAM_LATENCY.observe(time.monotonic() - started_at, host=host)
+        metrics.UPSTREAM_REQUESTS.inc(host=host, status=response.status)
+        return Response(response.status, text, str(response.url))
+
+    parts = urlsplit(url)
+    host = parts.hostname
+    target = url
+    if host in _redirects:
+        target = _redirects[host] + parts.path + (f'?{parts.query}' if parts.query else '')
+
+    return await resilience.call(host, send, retries=retries, is_failure=is_retryable_status,
+                                 hedge_after=hedge_after, timeout=timeout)
@@ -0,0 +1,162 @@
+import contextvars
+import datetime
+import json
+import logging
+import logging.handlers
+import queue
+import random
+import sys
+import uuid
+
+# Default level for loggers without their own level in data/settings.json
+DEFAULT_LEVEL = 'INFO'
+
+# Attributes every LogRecord has; anything else on a record came from `extra`
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+# Context attached to every record logged while handling an interaction
+interaction_id = contextvars.ContextVar('interaction_id', default=None)
+trace_id = contextvars.ContextVar('trace_id', default=None)
+command = contextvars.ContextVar('command', default=None)
+guild_id = contextvars.ContextVar('guild_id', default=None)
+
+# The background thread writing records, started by setup_logging
+_listener = None
+
+
+def bind_interaction(interaction):
+    """
+    Attach an interaction's IDs to every record logged while handling it.
+
+    Each interaction gets a fresh trace ID so its records can be followed
+    across modules, including upstream calls made on its behalf.
+    """
+    interaction_id.set(interaction.id)
+    trace_id.set(uuid.uuid4().hex[:16])
+    command.set(interaction.command.qualified_name if interaction.command else None)
+    guild_id.set(interaction.guild_id)
+
+
+class ContextFilter(logging.Filter):
+    """
+    Copies the current interaction context, and any fixed fields, onto each record.
+    """
+
+    def __init__(self, fields: dict = None):
+        super().__init__()
+        self.fields = fields or {}
+
+    def filter(self, record):
+        for key, value in self.fields.items():
+            # A field passed in `extra` wins
+            if not hasattr(record, key):
+                setattr(record, key, value)
+        record.interaction_id = interaction_id.get()
+        record.trace_id = trace_id.get()
+        record.command = command.get()
+        record.guild_id = guild_id.get()
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Keeps only a fraction of DEBUG records, so high-volume debug events stay affordable.
+
+    The rate comes from a `sample_rate` passed in `extra`, then from the most
+    specific configured logger prefix, and defaults to keeping everything.
+    """
+
+    def __init__(self, sample_rates: dict = None):
+        super().__init__()
+        self.sample_rates = sample_rates or {}
+
+    def _configured_rate(self, name: str) -> float:
+        while name:
+            if name in self.sample_rates:
+                return self.sample_rates[name]
+            name = name.rpartition('.')[0]
+        return 1.0
+
+    def filter(self, record):
+        if record.levelno > logging.DEBUG:
+            return True
+        rate = getattr(record, 'sample_rate', None)
+        if rate is None:
+            rate = self._configured_rate(record.name)
+        return rate >= 1.0 or random.random() < rate
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    Formats records as one JSON object per line.
+    """
+
+    def format(self, record):
+        entry = {
+            'time': datetime.datetime.fromtimestamp(record.created, datetime.timezone.utc).isoformat(),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage()
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRIBUTES and key != 'sample_rate' and value is not None:
+                entry[key] = value
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    def prepare(self, record):
+        # Only merge the message arguments here; JSON formatting and I/O happen on the listener thread
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+
+def setup_logging(settings: dict = None, fields: dict = None):
+    """
+    Send all logging through a queue to a JSON-lines handler on a background thread.
+
+    Args:
+        settings (dict): The "logging" section of data/settings.json:
+            level (str): The root level, e.g. "INFO".
+            levels (dict): Levels per logger name, e.g. {"discord": "WARNING"}.
+            sample_rates (dict): Fraction of DEBUG records kept per logger name.
+        fields (dict): Added to every record, e.g. the cluster worker it comes from.
+    """
+    global _listener
+    settings = settings or {}
+
+    if _listener is not None:
+        _listener.stop()
+
+    stream_handler = logging.StreamHandler(sys.stdout)
+    stream_handler.setFormatter(JsonFormatter())
+
+    log_queue = queue.SimpleQueue()
+    queue_handler = _QueueHandler(log_queue)
+    queue_handler.addFilter(SamplingFilter(settings.get('sample_rates')))
+    queue_handler.addFilter(ContextFilter(fields))
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(settings.get('level', DEFAULT_LEVEL))
+
+    for name, level in settings.get('levels', {}).items():
+        logging.getLogger(name).setLevel(level)
+
+    _listener = logging.handlers.QueueListener(log_queue, stream_handler, respect_handler_level=True)
+    _listener.start()
+
+
+def shutdown_logging():
+    """
+    Flush queued records and stop the background thread.
+    """
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
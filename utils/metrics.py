@@ -0,0 +1,331 @@
+import asyncio
+import bisect
+import logging
+import time
+from collections import defaultdict, deque
+
+from utils.cache import CACHES
+from utils.pool import POOLS
+from utils.rate_limit import LIMITERS
+from utils.refresher import DATASETS
+from utils.resilience import BREAKERS
+
+log = logging.getLogger(__name__)
+
+# Default histogram buckets in seconds, from 5ms to 30s
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# Quantiles reported for every histogram, from a window of recent observations
+QUANTILES = (0.5, 0.95, 0.99)
+QUANTILE_WINDOW = 1024
+
+# Where the Prometheus endpoint listens unless data/settings.json sets "metrics"
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 9108
+
+# How often the event loop lag is sampled, in seconds
+LOOP_LAG_INTERVAL = 0.5
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names: tuple, values: tuple, extra: dict = None) -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    for name, value in (extra or {}).items():
+        pairs.append(f'{name}="{_escape(value)}"')
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class Metric:
+    kind = 'untyped'
+
+    def __init__(self, name: str, help: str, labels: tuple = ()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        REGISTRY.register(self)
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(labels.get(name, '') for name in self.labels)
+
+    def render(self) -> list:
+        return [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.kind}']
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def __init__(self, name: str, help: str, labels: tuple = ()):
+        super().__init__(name, help, labels)
+        self._values = defaultdict(float)
+
+    def inc(self, amount: float = 1, **labels):
+        self._values[self._key(labels)] += amount
+
+    def render(self) -> list:
+        lines = super().render()
+        for key, value in self._values.items():
+            lines.append(f'{self.name}{_format_labels(self.labels, key)} {value}')
+        return lines
+
+
+class Gauge(Metric):
+    kind = 'gauge'
+
+    def __init__(self, name: str, help: str, labels: tuple = ()):
+        super().__init__(name, help, labels)
+        self._values = defaultdict(float)
+
+    def set(self, value: float, **labels):
+        self._values[self._key(labels)] = value
+
+    def inc(self, amount: float = 1, **labels):
+        self._values[self._key(labels)] += amount
+
+    def dec(self, amount: float = 1, **labels):
+        self._values[self._key(labels)] -= amount
+
+    def render(self) -> list:
+        lines = super().render()
+        for key, value in self._values.items():
+            lines.append(f'{self.name}{_format_labels(self.labels, key)} {value}')
+        return lines
+
+
+class Histogram(Metric):
+    """
+    A Prometheus histogram that also reports p50/p95/p99 over recent observations.
+
+    The quantiles are exported as a separate gauge family, <name>_quantile,
+    since a histogram's buckets are cumulative over the process lifetime.
+    """
+    kind = 'histogram'
+
+    def __init__(self, name: str, help: str, labels: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+        self._counts = defaultdict(lambda: [0] * (len(self.buckets) + 1))
+        self._sums = defaultdict(float)
+        self._recent = defaultdict(lambda: deque(maxlen=QUANTILE_WINDOW))
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        self._counts[key][bisect.bisect_left(self.buckets, value)] += 1
+        self._sums[key] += value
+        self._recent[key].append(value)
+
+    def quantile(self, fraction: float, **labels) -> float:
+        recent = sorted(self._recent.get(self._key(labels), ()))
+        if not recent:
+            return 0.0
+        return recent[min(len(recent) - 1, int(fraction * len(recent)))]
+
+    def render(self) -> list:
+        lines = super().render()
+        for key, counts in self._counts.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                labels = _format_labels(self.labels, key, {'le': bound})
+                lines.append(f'{self.name}_bucket{labels} {cumulative}')
+            cumulative += counts[-1]
+            labels = _format_labels(self.labels, key, {'le': '+Inf'})
+            lines.append(f'{self.name}_bucket{labels} {cumulative}')
+            lines.append(f'{self.name}_sum{_format_labels(self.labels, key)} {self._sums[key]}')
+            lines.append(f'{self.name}_count{_format_labels(self.labels, key)} {cumulative}')
+
+        lines.append(f'# TYPE {self.name}_quantile gauge')
+        for key, recent in self._recent.items():
+            ordered = sorted(recent)
+            for fraction in QUANTILES:
+                value = ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+                labels = _format_labels(self.labels, key, {'quantile': fraction})
+                lines.append(f'{self.name}_quantile{labels} {value}')
+        return lines
+
+
+class Registry:
+    """
+    Holds every metric, plus collectors that read other modules' counters at scrape time.
+    """
+
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+
+    def register(self, metric: Metric):
+        self._metrics.append(metric)
+
+    def add_collector(self, collector):
+        """
+        Add a callable returning extra exposition lines, called on every scrape.
+        """
+        self._collectors.append(collector)
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        for collector in self._collectors:
+            try:
+                lines.extend(collector())
+            except Exception:
+                log.exception("Metrics collector %s failed", collector.__name__)
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+# Commands
+COMMAND_LATENCY = Histogram('discord_command_duration_seconds', 'Time from interaction creation to command completion',
+                            ('command', 'status'))
+FIRST_RESPONSE = Histogram('discord_command_first_response_seconds',
+                           'Time from interaction creation to the first response or defer', ('command', 'deferred'))
+INTERACTIONS_IN_FLIGHT = Gauge('discord_interactions_in_flight', 'Interactions currently being handled')
+
+# Upstreams
+UPSTREAM_LATENCY = Histogram('upstream_request_duration_seconds', 'Upstream request latency', ('host',))
+UPSTREAM_REQUESTS = Counter('upstream_requests_total', 'Upstream requests by host and status', ('host', 'status'))
+
+# Event loop and gateway
+LOOP_LAG = Histogram('event_loop_lag_seconds', 'How late the event loop woke a sleeping task',
+                     buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0))
+GATEWAY_EVENTS = Counter('discord_gateway_events_total', 'Gateway connects, disconnects and resumes', ('event',))
+
+# Autocomplete
+AUTOCOMPLETE_ANSWERS = Counter('autocomplete_answers_total', 'Autocomplete answers by where they came from',
+                               ('suggester', 'source'))
+AUTOCOMPLETE_LATENCY = Histogram('autocomplete_duration_seconds', 'Time from interaction creation to the suggestions',
+                                 ('suggester',), buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5))
+
+
+def registry_stats(registry: dict) -> dict:
+    """
+    Get the counters of everything in a registry, such as cache.CACHES or pool.POOLS, by name.
+    """
+    # A copy, since modules register new entries as they are imported
+    return {name: item.stats() for name, item in list(registry.items())}
+
+
+def _cache_lines() -> list:
+    stats = registry_stats(CACHES)
+    lines = ['# TYPE response_cache_hit_ratio gauge']
+    for name, values in stats.items():
+        lines.append(f'response_cache_hit_ratio{{cache="{name}"}} {values["hit_ratio"]}')
+    for field in ('hits', 'misses', 'evictions', 'shared_hits'):
+        lines.append(f'# TYPE response_cache_{field}_total counter')
+        for name, values in stats.items():
+            lines.append(f'response_cache_{field}_total{{cache="{name}"}} {values[field]}')
+    lines.append('# TYPE response_cache_entries gauge')
+    for name, values in stats.items():
+        lines.append(f'response_cache_entries{{cache="{name}"}} {values["size"]}')
+    return lines
+
+
+def _rate_limit_lines() -> list:
+    lines = ['# TYPE rate_limit_queue_depth gauge']
+    stats = registry_stats(LIMITERS)
+    for upstream, values in stats.items():
+        lines.append(f'rate_limit_queue_depth{{upstream="{upstream}"}} {values["queue_depth"]}')
+    lines.append('# TYPE rate_limit_wait_seconds_total counter')
+    for upstream, values in stats.items():
+        lines.append(f'rate_limit_wait_seconds_total{{upstream="{upstream}"}} {values["total_wait"]}')
+    lines.append('# TYPE rate_limit_rejected_total counter')
+    for upstream, values in stats.items():
+        lines.append(f'rate_limit_rejected_total{{upstream="{upstream}"}} {values["rejected"]}')
+    return lines
+
+
+def _circuit_lines() -> list:
+    lines = ['# TYPE upstream_circuit_open gauge']
+    for host, breaker in BREAKERS.items():
+        lines.append(f'upstream_circuit_open{{host="{host}"}} {int(breaker.state != "closed")}')
+    return lines
+
+
+def _dataset_lines() -> list:
+    lines = ['# TYPE refreshed_dataset_age_seconds gauge']
+    stats = registry_stats(DATASETS)
+    for name, values in stats.items():
+        if values['age'] is not None:
+            lines.append(f'refreshed_dataset_age_seconds{{dataset="{name}"}} {values["age"]}')
+    lines.append('# TYPE refreshed_dataset_failures_total counter')
+    for name, values in stats.items():
+        lines.append(f'refreshed_dataset_failures_total{{dataset="{name}"}} {values["failures"]}')
+    return lines
+
+
+def _pool_lines() -> list:
+    stats = registry_stats(POOLS)
+    lines = ['# TYPE pool_items gauge']
+    for name, values in stats.items():
+        lines.append(f'pool_items{{pool="{name}"}} {values["size"]}')
+    for metric, key in (('pool_taken_total', 'taken'), ('pool_empty_waits_total', 'waits'),
+                        ('pool_repeats_total', 'repeats'), ('pool_refill_failures_total', 'refill_failures')):
+        lines.append(f'# TYPE {metric} counter')
+        for name, values in stats.items():
+            lines.append(f'{metric}{{pool="{name}"}} {values[key]}')
+    return lines
+
+
+REGISTRY.add_collector(_cache_lines)
+REGISTRY.add_collector(_rate_limit_lines)
+REGISTRY.add_collector(_circuit_lines)
+REGISTRY.add_collector(_dataset_lines)
+REGISTRY.add_collector(_pool_lines)
+
+
+def start_command(interaction):
+    """
+    Called for every app command before it runs, from the command tree's interaction check.
+    """
+    interaction.extras['started_at'] = time.monotonic()
+    INTERACTIONS_IN_FLIGHT.inc()
+
+
+def record_command(interaction, status):
+    """
+    Record a finished app command's latency and status.
+    """
+    started_at = interaction.extras.pop('started_at', None)
+    if started_at is None:
+        return
+    INTERACTIONS_IN_FLIGHT.dec()
+    name = interaction.command.qualified_name if interaction.command else 'unknown'
+    COMMAND_LATENCY.observe(time.monotonic() - started_at, command=name, status=status)
+
+
+async def monitor_loop_lag(interval: float = LOOP_LAG_INTERVAL):
+    """
+    Measure how late the event loop wakes up a sleeping task. Runs until cancelled.
+    """
+    while True:
+        started_at = time.monotonic()
+        await asyncio.sleep(interval)
+        LOOP_LAG.observe(max(0.0, time.monotonic() - started_at - interval))
+
+
+async def _handle_metrics(request):
+    from aiohttp import web
+    return web.Response(text=REGISTRY.render(), content_type='text/plain', charset='utf-8',
+                        headers={'X-Content-Type-Options': 'nosniff'})
+
+
+async def start_server(host: str = DEFAULT_HOST, port: int = DEFAULT_PORT) -> 'web.AppRunner':
+    """
+    Serve the metrics in Prometheus text format at /metrics on the running event loop.
+
+    Returns:
+        web.AppRunner: The runner; call cleanup() on it to stop the server.
+    """
+    # aiohttp's server side is only needed here, so it isn't imported on every startup
+    from aiohttp import web
+
+    app = web.Application()
+    app.router.add_get('/metrics', _handle_metrics)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
@@ -0,0 +1,122 @@
+import asyncio
+import logging
+
+import discord
+
+log = logging.getLogger(__name__)
+
+# Seconds without a button press before a view stops and drops its pages
+VIEW_TIMEOUT = 180
+
+
+class PaginatedView(discord.ui.View):
+    """
+    Previous/Next buttons over results fetched one page at a time.
+
+    Only the first page is fetched before the command answers. Later pages are
+    fetched when the user first pages forward to them, using the continuation
+    token the previous page returned, and kept for the rest of the session so
+    paging back and forth costs nothing. On timeout the buttons are removed
+    from the message and the pages dropped.
+
+    Args:
+        fetch_page: Async callable taking a continuation token (None for the
+            first page) and returning (items, next token or None), or None on errors.
+        render: Callable taking (items, page number from 0) and returning a discord.Embed.
+        owner_id (int): The only user allowed to press the buttons.
+        timeout (float): Seconds without a press before the view stops.
+    """
+
+    def __init__(self, fetch_page, render, owner_id: int, timeout: float = VIEW_TIMEOUT):
+        super().__init__(timeout=timeout)
+        self.fetch_page = fetch_page
+        self.render = render
+        self.owner_id = owner_id
+        self.interaction = None  # The latest interaction whose response shows the view
+
+        self.pages = []
+        self.next_token = None
+        self.current = 0
+        self._lock = asyncio.Lock()
+
+    def has_more(self) -> bool:
+        return self.current + 1 < len(self.pages) or self.next_token is not None
+
+    async def first_page(self) -> list:
+        """
+        Fetch the first page.
+
+        Returns:
+            list: Its items.
+            None: If fetching it fails.
+        """
+        if not await self._fetch_next():
+            return None
+        return self.pages[0]
+
+    async def _fetch_next(self) -> bool:
+        page = await self.fetch_page(self.next_token)
+        if page is None:
+            return False
+        items, self.next_token = page
+        self.pages.append(items)
+        return True
+
+    def message(self) -> dict:
+        """
+        The send_message keyword arguments showing the current page, with the buttons if there is more than one.
+        """
+        self.previous_page.disabled = self.current == 0
+        self.next_page.disabled = not self.has_more()
+        message = {'embed': self.render(self.pages[self.current], self.current)}
+        if len(self.pages) > 1 or self.next_token is not None:
+            message['view'] = self
+        else:
+            # Nothing to page; discord.py doesn't accept view=None, so the key is left out
+            self.stop()
+        return message
+
+    async def interaction_check(self, interaction) -> bool:
+        if interaction.user.id != self.owner_id:
+            await interaction.response.send_message("Only the person who ran the command can turn its pages.",
+                                                    ephemeral=True)
+            return False
+        # Its token edits the same message, and stays valid longer than the command's
+        self.interaction = interaction
+        return True
+
+    async def _show(self, interaction):
+        if interaction.response.is_done():
+            await interaction.edit_original_response(**self.message())
+        else:
+            await interaction.response.edit_message(**self.message())
+
+    @discord.ui.button(label='Previous', style=discord.ButtonStyle.secondary)
+    async def previous_page(self, interaction, button):
+        self.current = max(0, self.current - 1)
+        await self._show(interaction)
+
+    @discord.ui.button(label='Next', style=discord.ButtonStyle.primary)
+    async def next_page(self, interaction, button):
+        if self._lock.locked() or self.current + 1 == len(self.pages) and self.next_token is not None:
+            # The page is being fetched, which may take longer than the interaction's 3 seconds
+            await interaction.response.defer()
+
+        async with self._lock:
+            if self.current + 1 == len(self.pages) and self.next_token is not None:
+                if not await self._fetch_next():
+                    await interaction.followup.send("Couldn't load the next page, try again in a moment.",
+                                                    ephemeral=True)
+                    return
+            if self.current + 1 < len(self.pages):
+                self.current += 1
+            await self._show(interaction)
+
+    async def on_timeout(self):
+        self.pages.clear()
+        if self.interaction is None:
+            return
+        try:
+            await self.interaction.edit_original_response(view=None)
+        except discord.HTTPException as e:
+            log.debug("Could not remove the page buttons: %s", e)
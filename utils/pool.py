@@ -0,0 +1,168 @@
+import asyncio
+import contextvars
+import logging
+from collections import deque
+
+from utils.cache import MISSING, TTLCache
+
+log = logging.getLogger(__name__)
+
+# Refill batches in a row that may add nothing new before a refill gives up,
+# so an upstream repeating itself doesn't keep it busy forever
+MAX_EMPTY_BATCHES = 3
+
+# Items already served to an audience that take() moves past before serving one anyway
+MAX_SKIPS = 8
+
+# Audiences whose recently served items are remembered, and for how long
+MAX_AUDIENCES = 10_000
+RECENT_TTL = 24 * 3600
+
+# Every pool created, by name
+POOLS = {}
+
+
+class Pool:
+    """
+    A buffer of interchangeable items, such as random articles, fetched from the upstream in batches.
+
+    take() pops the oldest item in O(1), so commands never wait on the network
+    while the pool holds anything. Once it drops below `low_water`, a single
+    background refill fetches batches until it holds `capacity` items again.
+    Only an empty pool makes take() wait, for the refill in flight.
+
+    Items a batch repeats from the pool are dropped, and items recently served
+    to an audience (a guild, or a user in DMs) are moved to the back of the
+    pool rather than served to it again.
+
+    Args:
+        name (str): Used in logs and metrics.
+        fetch: Async callable returning a list of items, or None on errors.
+        key: Callable returning an item's identity, for deduplication.
+        capacity (int): Items a refill fills the pool up to.
+        low_water (int): A refill starts when the pool holds fewer items than this.
+        recent (int): Items remembered per audience.
+    """
+
+    def __init__(self, name: str, fetch, key, capacity: int, low_water: int, recent: int = 100):
+        self.name = name
+        self.fetch = fetch
+        self.key = key
+        self.capacity = capacity
+        self.low_water = low_water
+        self.recent = recent
+
+        self._items = deque()
+        self._keys = set()  # Keys of the items in the pool
+        self._served = TTLCache(f'pool_{name}_served', maxsize=MAX_AUDIENCES, ttl=RECENT_TTL)
+        self._task = None
+
+        # Counters
+        self.taken = 0
+        self.waits = 0  # take() calls that found the pool empty
+        self.repeats = 0  # Items served to an audience that had seen them recently
+        self.refill_failures = 0
+
+        POOLS[name] = self
+
+    def __len__(self):
+        return len(self._items)
+
+    def is_refilling(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def refill(self) -> asyncio.Task:
+        """
+        Start filling the pool up to capacity in the background, unless a refill is already running.
+
+        Returns:
+            asyncio.Task: The refill in flight.
+        """
+        if not self.is_refilling():
+            # A fresh context, so the refill doesn't inherit the deadline and log fields of the command that started it
+            self._task = asyncio.create_task(self._refill(), context=contextvars.Context())
+        return self._task
+
+    async def _refill(self):
+        empty_batches = 0
+        while len(self._items) < self.capacity and empty_batches < MAX_EMPTY_BATCHES:
+            try:
+                batch = await self.fetch()
+            except Exception as e:
+                log.warning("Error refilling the %s pool: %s", self.name, e)
+                batch = None
+            if batch is None:
+                self.refill_failures += 1
+                return
+
+            added = 0
+            for item in batch:
+                key = self.key(item)
+                if key not in self._keys:
+                    self._keys.add(key)
+                    self._items.append(item)
+                    added += 1
+            empty_batches = 0 if added else empty_batches + 1
+
+    def _recent(self, audience) -> tuple:
+        recent = self._served.get(audience)
+        if recent is MISSING:
+            recent = (deque(), set())
+            self._served.set(audience, recent)
+        return recent
+
+    def _pop(self, audience):
+        order, seen = self._recent(audience)
+        item = None
+        for _ in range(min(MAX_SKIPS, len(self._items))):
+            item = self._items.popleft()
+            if self.key(item) not in seen:
+                break
+            # Still good for everyone else
+            self._items.append(item)
+            item = None
+        if item is None:
+            item = self._items.popleft()
+
+        key = self.key(item)
+        self._keys.discard(key)
+        if key in seen:
+            self.repeats += 1
+        else:
+            if len(order) >= self.recent:
+                seen.discard(order.popleft())
+            order.append(key)
+            seen.add(key)
+        return item
+
+    async def take(self, audience=None):
+        """
+        Take an item, preferring ones not recently served to the audience.
+
+        Args:
+            audience: Who the item is for, such as a guild ID.
+
+        Returns:
+            The item, or None if the pool is empty and refilling it failed.
+        """
+        if not self._items:
+            self.waits += 1
+            # Shielded, since other callers may be waiting on the same refill
+            await asyncio.shield(self.refill())
+            if not self._items:
+                return None
+
+        item = self._pop(audience)
+        self.taken += 1
+        if len(self._items) < self.low_water:
+            self.refill()
+        return item
+
+    def stats(self) -> dict:
+        return {
+            'size': len(self._items),
+            'taken': self.taken,
+            'waits': self.waits,
+            'repeats': self.repeats,
+            'refill_failures': self.refill_failures,
+        }
@@ -0,0 +1,240 @@
+import asyncio
+import json
+import logging
+import time
+from array import array
+from collections import OrderedDict
+
+import aiohttp
+
+from utils import http
+
+log = logging.getLogger(__name__)
+
+# Finnhub's real-time trades websocket
+FINNHUB_WS_URL = 'wss://ws.finnhub.io'
+
+# Finnhub's free tier allows 50 symbols per connection
+SUBSCRIPTION_LIMIT = 50
+
+# A symbol is subscribed once it has been asked for this many times within DEMAND_WINDOW seconds
+HOT_THRESHOLD = 3
+DEMAND_WINDOW = 300
+
+# Open and previous close only come from REST, so a quote is re-seeded after this many seconds
+SEED_TTL = 3600
+
+# Reconnect backoff bounds, in seconds
+RECONNECT_MIN_DELAY = 1
+RECONNECT_MAX_DELAY = 60
+
+# Positions in a quote array, named after Finnhub's REST quote fields
+CURRENT, OPEN, HIGH, LOW, PREVIOUS_CLOSE, SEEDED_AT = range(6)
+
+
+class QuoteBook:
+    """
+    Live quotes for the most requested symbols, fed by Finnhub's trade websocket.
+
+    Each quote is a small array of doubles (last, open, high, low, previous
+    close and seed time). Open and previous close are seeded from a REST quote;
+    trades then move the last price, high and low. Symbols are subscribed once
+    they get hot and the least recently requested one is unsubscribed when the
+    subscription limit is reached.
+    """
+
+    def __init__(self, token: str, url: str = FINNHUB_WS_URL, limit: int = SUBSCRIPTION_LIMIT,
+                 hot_threshold: int = HOT_THRESHOLD):
+        self.token = token
+        self.url = url
+        self.limit = limit
+        self.hot_threshold = hot_threshold
+
+        self._quotes = {}
+        self._subscribed = OrderedDict()  # Least to most recently requested
+        self._demand = {}                 # Symbol -> (request count, window start)
+        self._websocket = None
+
+        # Counters
+        self.hits = 0
+        self.misses = 0
+        self.trades = 0
+        self.evictions = 0
+
+    def get(self, symbol: str) -> dict:
+        """
+        Get a live quote for a subscribed symbol.
+
+        Args:
+            symbol (str): The ticker symbol, upper case.
+
+        Returns:
+            dict: The quote in Finnhub's REST format (c, o, h, l, pc), or None if
+                the symbol isn't subscribed or its seed is too old.
+        """
+        quote = self._quotes.get(symbol)
+        if symbol not in self._subscribed or quote is None or time.time() - quote[SEEDED_AT] > SEED_TTL:
+            self.misses += 1
+            return None
+
+        self._subscribed.move_to_end(symbol)
+        self.hits += 1
+        return {
+            'c': quote[CURRENT],
+            'o': quote[OPEN],
+            'h': quote[HIGH],
+            'l': quote[LOW],
+            'pc': quote[PREVIOUS_CLOSE]
+        }
+
+    def record_demand(self, symbol: str, rest_quote: dict):
+        """
+        Record a REST-served request for a symbol and subscribe it once it is hot.
+
+        Args:
+            symbol (str): The ticker symbol, upper case.
+            rest_quote (dict): The REST quote that was served, used to seed the book.
+        """
+        now = time.time()
+        seed = None
+        if rest_quote and rest_quote.get('pc'):
+            seed = array('d', [
+                rest_quote['c'], rest_quote['o'], rest_quote['h'], rest_quote['l'], rest_quote['pc'], now
+            ])
+
+        # Only subscribed symbols keep a quote, so typing tickers doesn't grow the book
+        if symbol in self._subscribed:
+            if seed is not None:
+                self._quotes[symbol] = seed
+            self._subscribed.move_to_end(symbol)
+            return
+
+        count, window_start = self._demand.get(symbol, (0, now))
+        if now - window_start > DEMAND_WINDOW:
+            count, window_start = 0, now
+        count += 1
+        self._demand[symbol] = (count, window_start)
+
+        if count >= self.hot_threshold and seed is not None:
+            del self._demand[symbol]
+            self._subscribe(symbol)
+            self._quotes[symbol] = seed
+
+        # Keep the demand table from growing without bound
+        if len(self._demand) > self.limit * 100:
+            self._demand = {key: value for key, value in self._demand.items() if now - value[1] <= DEMAND_WINDOW}
+
+    def _subscribe(self, symbol: str):
+        while len(self._subscribed) >= self.limit:
+            evicted, _ = self._subscribed.popitem(last=False)
+            self._quotes.pop(evicted, None)
+            self.evictions += 1
+            self._send({'type': 'unsubscribe', 'symbol': evicted})
+
+        self._subscribed[symbol] = None
+        self._send({'type': 'subscribe', 'symbol': symbol})
+
+    def _send(self, message: dict):
+        # Subscriptions made while disconnected are sent on reconnect
+        if self._websocket is not None and not self._websocket.closed:
+            asyncio.ensure_future(self._websocket.send_str(json.dumps(message)))
+
+    def _apply_trades(self, trades: list):
+        for trade in trades:
+            quote = self._quotes.get(trade.get('s'))
+            if quote is None:
+                continue
+            price = trade.get('p')
+            if not isinstance(price, (int, float)):
+                continue
+            quote[CURRENT] = price
+            if price > quote[HIGH]:
+                quote[HIGH] = price
+            if price < quote[LOW]:
+                quote[LOW] = price
+            self.trades += 1
+
+    async def run(self):
+        """
+        Keep the websocket connected and apply trades as they arrive. Runs until cancelled.
+        """
+        delay = RECONNECT_MIN_DELAY
+        while True:
+            try:
+                async with http.get_session().ws_connect(self.url, params={'token': self.token},
+                                                         heartbeat=30) as websocket:
+                    self._websocket = websocket
+                    delay = RECONNECT_MIN_DELAY
+                    # A copy, since commands reorder the subscriptions while this waits on the socket
+                    for symbol in list(self._subscribed):
+                        await websocket.send_str(json.dumps({'type': 'subscribe', 'symbol': symbol}))
+
+                    async for message in websocket:
+                        if message.type != aiohttp.WSMsgType.TEXT:
+                            break
+                        data = json.loads(message.data)
+                        if data.get('type') == 'trade':
+                            self._apply_trades(data.get('data', []))
+
+            except (aiohttp.ClientError, ValueError) as e:
+                log.warning("Finnhub websocket error: %s", e)
+            except Exception:
+                # Anything else would end the task and leave the book serving frozen prices
+                log.exception("Unexpected error in the Finnhub websocket loop")
+            finally:
+                self._websocket = None
+
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, RECONNECT_MAX_DELAY)
+
+    def stats(self) -> dict:
+        return {
+            'subscribed': len(self._subscribed),
+            'quotes': len(self._quotes),
+            'hits': self.hits,
+            'misses': self.misses,
+            'trades': self.trades,
+            'evictions': self.evictions
+        }
+
+
+# The quote book currently running, if any
+_quote_book = None
+
+
+def get_quote_book() -> QuoteBook:
+    """
+    Get the running quote book, or None if it isn't running.
+    """
+    return _quote_book
+
+
+def start_quote_book(token: str, **kwargs) -> asyncio.Task:
+    """
+    Start the quote book in the background.
+
+    Args:
+        token (str): The Finnhub API key.
+        **kwargs: Passed to QuoteBook, e.g. url for a local stand-in server.
+
+    Returns:
+        asyncio.Task: The task running the websocket; cancel it to stop.
+    """
+    global _quote_book
+    book = _quote_book = QuoteBook(token, **kwargs)
+    task = asyncio.create_task(book.run())
+    task.add_done_callback(lambda _: _clear_quote_book(book))
+    return task
+
+
+def _clear_quote_book(book: QuoteBook):
+    # Once its task has stopped the book no longer updates, so its prices must not be served
+    global _quote_book
+    if _quote_book is book:
+        _quote_book = None
+
+
+def stop_quote_book(task: asyncio.Task):
+    global _quote_book
+    task.cancel()
+    _quote_book = None
@@ -0,0 +1,251 @@
+import asyncio
+import logging
+import mmap
+import random
+import struct
+from pathlib import Path
+
+import aiohttp
+
+from utils import http
+from utils import rate_limit
+from utils.files import write_atomically
+
+log = logging.getLogger(__name__)
+
+# Compact corpus built on first start by build_corpus, or by scripts/build_quran_corpus.py
+CORPUS_PATH = Path(__file__).resolve().parent.parent / 'data' / 'quran.bin'
+
+# The alquran.cloud editions the corpus is built from
+EDITION_URL = "https://api.alquran.cloud/v1/quran/{edition}"
+ARABIC_EDITION = 'quran-uthmani'
+ENGLISH_EDITION = 'en.pickthall'
+
+# A whole edition is a few megabytes, far more than a normal request
+DOWNLOAD_TIMEOUT = 60.0
+
+# File layout (all integers little-endian):
+#   header:      magic, ayah count, surah count, offset of the text blob
+#   surah table: first ayah index, ayah count, name offset, name length (one row per surah)
+#   ayah table:  arabic offset, arabic length, english offset, english length,
+#                surah number, number in surah (one row per ayah)
+#   text blob:   UTF-8 text, with offsets relative to the start of the blob
+MAGIC = b'QRN1'
+HEADER = struct.Struct('<4sIII')
+SURAH_ROW = struct.Struct('<HHII')
+AYAH_ROW = struct.Struct('<IIIIHH')
+
+AYAH_COUNT = 6236
+SURAH_COUNT = 114
+
+
+class QuranCorpus:
+    """
+    Memory-mapped Quran corpus with Arabic and English text; each lookup reads one fixed-size row and a text slice.
+    """
+
+    def __init__(self, path=None):
+        path = path or CORPUS_PATH
+        self._file = open(path, 'rb')
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, self.ayah_count, self.surah_count, self._text_offset = HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC:
+            self.close()
+            raise ValueError(f"{path} is not a Quran corpus file")
+
+        self._surah_offset = HEADER.size
+        self._ayah_offset = self._surah_offset + self.surah_count * SURAH_ROW.size
+
+    def close(self):
+        self._map.close()
+        self._file.close()
+
+    def _text(self, offset: int, length: int) -> str:
+        start = self._text_offset + offset
+        return self._map[start:start + length].decode('utf-8')
+
+    def surah(self, surah: int) -> dict:
+        """
+        Get a surah's name and its position in the ayah table.
+
+        Args:
+            surah (int): The surah number, from 1 to 114.
+
+        Returns:
+            dict: The surah's English name, first ayah index and ayah count.
+        """
+        if not 1 <= surah <= self.surah_count:
+            raise IndexError(f"Surah {surah} does not exist")
+        first_ayah, ayah_count, name_offset, name_length = \
+            SURAH_ROW.unpack_from(self._map, self._surah_offset + (surah - 1) * SURAH_ROW.size)
+        return {
+            'name': self._text(name_offset, name_length),
+            'first_ayah': first_ayah,
+            'ayah_count': ayah_count
+        }
+
+    def verse(self, number: int) -> dict:
+        """
+        Get a verse by its number across the whole Quran.
+
+        Args:
+            number (int): The verse number, from 1 to 6236.
+
+        Returns:
+            dict: The Arabic and English text, surah name, surah number and number in surah.
+        """
+        if not 1 <= number <= self.ayah_count:
+            raise IndexError(f"Verse {number} does not exist")
+        arabic_offset, arabic_length, english_offset, english_length, surah, number_in_surah = \
+            AYAH_ROW.unpack_from(self._map, self._ayah_offset + (number - 1) * AYAH_ROW.size)
+        return {
+            'arabic': self._text(arabic_offset, arabic_length),
+            'english': self._text(english_offset, english_length),
+            'surah': surah,
+            'surah_name': self.surah(surah)['name'],
+            'number_in_surah': number_in_surah
+        }
+
+    def by_reference(self, surah: int, ayah: int) -> dict:
+        """
+        Get a verse by surah:ayah reference, e.g. 2:255.
+        """
+        info = self.surah(surah)
+        if not 1 <= ayah <= info['ayah_count']:
+            raise IndexError(f"Surah {surah} has no verse {ayah}")
+        return self.verse(info['first_ayah'] + ayah)
+
+    def verse_range(self, surah: int, start: int, end: int) -> list:
+        """
+        Get the verses start to end (inclusive) of a surah.
+        """
+        info = self.surah(surah)
+        if not 1 <= start <= end <= info['ayah_count']:
+            raise IndexError(f"Surah {surah} has no verses {start}-{end}")
+        return [self.verse(info['first_ayah'] + ayah) for ayah in range(start, end + 1)]
+
+    def random_verse(self) -> dict:
+        return self.verse(random.randint(1, self.ayah_count))
+
+
+def combine_editions(arabic: list, english: list) -> list:
+    """
+    Pair the surahs of the Arabic and English editions, in the shape write_corpus takes.
+
+    Args:
+        arabic (list): The surahs of an alquran.cloud /v1/quran/<edition> response.
+        english (list): The same for the English edition.
+
+    Raises:
+        ValueError: If the editions don't have every surah and ayah.
+    """
+    surahs = [{
+        'name': arabic_surah['englishName'],
+        'ayahs': [
+            {
+                'arabic': arabic_ayah['text'],
+                'english': english_ayah['text'],
+                'number_in_surah': arabic_ayah['numberInSurah']
+            }
+            for arabic_ayah, english_ayah in zip(arabic_surah['ayahs'], english_surah['ayahs'])
+        ]
+    } for arabic_surah, english_surah in zip(arabic, english)]
+
+    ayah_count = sum(len(surah['ayahs']) for surah in surahs)
+    if len(surahs) != SURAH_COUNT or ayah_count != AYAH_COUNT:
+        raise ValueError(f"Expected {SURAH_COUNT} surahs and {AYAH_COUNT} ayahs, got {len(surahs)} and {ayah_count}")
+    return surahs
+
+
+def write_corpus(path, surahs: list):
+    """
+    Write a corpus file atomically.
+
+    Args:
+        path: Where to write the corpus.
+        surahs (list): One dict per surah with its English name and a list of
+            ayahs, each a dict with the Arabic text, English text and number in surah.
+    """
+    blob = bytearray()
+
+    def add_text(text: str):
+        data = text.encode('utf-8')
+        offset = len(blob)
+        blob.extend(data)
+        return offset, len(data)
+
+    surah_rows = []
+    ayah_rows = []
+    for surah_number, surah in enumerate(surahs, start=1):
+        name_offset, name_length = add_text(surah['name'])
+        surah_rows.append(SURAH_ROW.pack(len(ayah_rows), len(surah['ayahs']), name_offset, name_length))
+        for ayah in surah['ayahs']:
+            arabic = add_text(ayah['arabic'])
+            english = add_text(ayah['english'])
+            ayah_rows.append(AYAH_ROW.pack(*arabic, *english, surah_number, ayah['number_in_surah']))
+
+    text_offset = HEADER.size + len(surah_rows) * SURAH_ROW.size + len(ayah_rows) * AYAH_ROW.size
+    def write(file):
+        file.write(HEADER.pack(MAGIC, len(ayah_rows), len(surah_rows), text_offset))
+        file.write(b''.join(surah_rows))
+        file.write(b''.join(ayah_rows))
+        file.write(blob)
+
+    write_atomically(path, write, binary=True)
+
+
+# The corpus currently being served
+_corpus = None
+
+
+def get_corpus() -> QuranCorpus:
+    """
+    Get the loaded corpus, or None if it hasn't been built or loaded.
+    """
+    return _corpus
+
+
+def load_corpus(path=None) -> bool:
+    """
+    Open the corpus file, from CORPUS_PATH unless another path is given.
+
+    Returns:
+        bool: True if the corpus was loaded.
+    """
+    global _corpus
+    try:
+        _corpus = QuranCorpus(path)
+    except (OSError, ValueError) as e:
+        log.warning("Could not load Quran corpus: %s", e)
+        return False
+    return True
+
+
+async def build_corpus() -> bool:
+    """
+    Download both editions from alquran.cloud, write the corpus to CORPUS_PATH and load it.
+
+    Returns:
+        bool: True if the corpus was built.
+    """
+    editions = []
+    for edition in (ARABIC_EDITION, ENGLISH_EDITION):
+        try:
+            response = await http.get(EDITION_URL.format(edition=edition), priority=rate_limit.BACKGROUND,
+                                      timeout=DOWNLOAD_TIMEOUT)
+            response.raise_for_status()
+            editions.append(response.json()['data']['surahs'])
+        except (aiohttp.ClientError, ValueError, KeyError, TypeError) as e:
+            log.warning("Error downloading the %s edition of the Quran: %s", edition, e)
+            return False
+
+    try:
+        surahs = combine_editions(*editions)
+    except (KeyError, TypeError, ValueError) as e:
+        log.warning("Unexpected data structure for the Quran editions: %s", e)
+        return False
+
+    await asyncio.to_thread(write_corpus, CORPUS_PATH, surahs)
+    log.info("Built the Quran corpus", extra={'path': str(CORPUS_PATH)})
+    return load_corpus()
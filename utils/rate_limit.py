@@ -0,0 +1,172 @@
+import asyncio
+import heapq
+import itertools
+import time
+
+from utils.config import get_config
+
+# Priority lanes; lower values are served first
+INTERACTIVE = 0
+BACKGROUND = 1
+
+# Discord drops an interaction that isn't answered within 3 seconds
+INTERACTION_DEADLINE = 3.0
+
+# Default limits per upstream, overridable in data/settings.json under "rate_limits":
+#   rate:      requests per second, on average
+#   burst:     requests allowed back to back
+#   max_queue: callers allowed to wait for a token
+DEFAULT_LIMITS = {
+    'finnhub': {'rate': 1.0, 'burst': 30, 'max_queue': 100},         # 60 calls/minute
+    'polygon': {'rate': 5 / 60, 'burst': 5, 'max_queue': 20},        # 5 calls/minute
+    'api_ninjas': {'rate': 1.0, 'burst': 10, 'max_queue': 50},
+    'discord': {'rate': 40.0, 'burst': 40, 'max_queue': 1000},       # Background sends, e.g. reminders
+}
+
+
+class RateLimitBusy(Exception):
+    """
+    Raised when a request can't get a token before its deadline, or the wait queue is full.
+    """
+
+    def __init__(self, upstream: str, wait: float = None):
+        super().__init__(f"{upstream} is busy right now, please try again in a few seconds.")
+        self.upstream = upstream
+        self.wait = wait
+
+
+class RateLimiter:
+    """
+    A token bucket for one upstream, with a bounded priority wait queue.
+
+    Callers take a token immediately while the bucket has one and nobody is
+    waiting; otherwise they queue by priority and a dispatcher hands out
+    tokens as they refill. A caller whose estimated wait would pass its
+    deadline is rejected with RateLimitBusy straight away rather than queued.
+    """
+
+    def __init__(self, name: str, rate: float, burst: int, max_queue: int):
+        self.name = name
+        self.rate = rate
+        self.burst = burst
+        self.max_queue = max_queue
+
+        self._tokens = float(burst)
+        self._updated_at = time.monotonic()
+        self._waiters = []  # Heap of (priority, sequence, future)
+        self._sequence = itertools.count()
+        self._dispatcher = None
+
+        # Metrics
+        self.granted = 0
+        self.rejected = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated_at) * self.rate)
+        self._updated_at = now
+
+    def _estimate_wait(self, priority: int) -> float:
+        ahead = sum(1 for waiter in self._waiters if waiter[0] <= priority and not waiter[2].done())
+        return max(0.0, (ahead + 1 - self._tokens) / self.rate)
+
+    async def acquire(self, priority: int = INTERACTIVE, deadline: float = None):
+        """
+        Wait for a token.
+
+        Args:
+            priority (int): INTERACTIVE or BACKGROUND.
+            deadline (float): time.monotonic() by which the token is needed. Interactive
+                requests default to the interaction deadline; background requests wait as long as needed.
+
+        Raises:
+            RateLimitBusy: If the token can't be had in time or the queue is full.
+        """
+        self._refill()
+        if not self._waiters and self._tokens >= 1:
+            self._tokens -= 1
+            self.granted += 1
+            return
+
+        started_at = time.monotonic()
+        if deadline is None and priority == INTERACTIVE:
+            deadline = started_at + INTERACTION_DEADLINE
+
+        wait = self._estimate_wait(priority)
+        if len(self._waiters) >= self.max_queue or (deadline is not None and started_at + wait > deadline):
+            self.rejected += 1
+            raise RateLimitBusy(self.name, wait)
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._sequence), future))
+        if self._dispatcher is None or self._dispatcher.done():
+            self._dispatcher = asyncio.create_task(self._dispatch())
+
+        await future
+        waited = time.monotonic() - started_at
+        self.total_wait += waited
+        self.max_wait = max(self.max_wait, waited)
+
+    async def _dispatch(self):
+        while self._waiters:
+            self._refill()
+            if self._tokens < 1:
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+                continue
+
+            _, _, future = heapq.heappop(self._waiters)
+            # Skip callers that gave up (e.g. were cancelled) while queued
+            if future.done():
+                continue
+            self._tokens -= 1
+            self.granted += 1
+            future.set_result(None)
+
+    def queue_depth(self) -> int:
+        return sum(1 for waiter in self._waiters if not waiter[2].done())
+
+    def stats(self) -> dict:
+        return {
+            'queue_depth': self.queue_depth(),
+            'tokens': self._tokens,
+            'granted': self.granted,
+            'rejected': self.rejected,
+            'total_wait': self.total_wait,
+            'max_wait': self.max_wait
+        }
+
+
+# Limiters created so far, by upstream
+LIMITERS = {}
+
+
+def get_limiter(upstream: str) -> RateLimiter:
+    """
+    Get the limiter for an upstream, creating it from the configured limits.
+
+    Returns:
+        RateLimiter: The limiter, or None if the upstream has no limits.
+    """
+    limiter = LIMITERS.get(upstream)
+    if limiter is None:
+        configured = get_config().settings.extra.get('rate_limits', {})
+        limits = {**DEFAULT_LIMITS.get(upstream, {}), **configured.get(upstream, {})}
+        if not limits:
+            return None
+        limiter = LIMITERS[upstream] = RateLimiter(
+            upstream, limits['rate'], limits.get('burst', 1), limits.get('max_queue', 100))
+    return limiter
+
+
+async def acquire(upstream: str, priority: int = INTERACTIVE, deadline: float = None):
+    """
+    Wait for a token for an upstream. Upstreams without limits return immediately.
+
+    Raises:
+        RateLimitBusy: If the token can't be had before the deadline.
+    """
+    limiter = get_limiter(upstream)
+    if limiter is not None:
+        await limiter.acquire(priority, deadline)
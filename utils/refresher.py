@@ -0,0 +1,235 @@
+import asyncio
+import contextvars
+import logging
+import time
+
+from utils import database
+
+log = logging.getLogger(__name__)
+
+# A failed refresh is retried after this many seconds, doubling with each
+# consecutive failure up to the dataset's own interval
+RETRY_INTERVAL = 60
+
+# Persisted snapshots are kept this long, so a restart while the upstream is down still has data
+PERSIST_TTL = 7 * 24 * 3600
+
+# The key a dataset's snapshot is persisted under, in the cache store
+SNAPSHOT_KEY = ('snapshot',)
+
+# The scheduler sleeps at least this long between passes
+MIN_SLEEP = 1.0
+
+# Every dataset registered, by name
+DATASETS = {}
+
+# Set to wake the scheduler early, when a dataset registers or a refresh finishes
+_wakeup = None
+
+
+class Dataset:
+    """
+    The last good value of a slow-changing upstream dataset, refreshed in the background.
+
+    Reads never wait on the network: get() returns the value held in memory,
+    however old, and starts a refresh in the background if it is stale
+    (stale-while-revalidate). A failed refresh keeps the last good value and
+    is retried with backoff. With persist set, each good value is also written
+    to the cache store, and restored from it on startup.
+
+    Args:
+        name (str): Used in logs, metrics and the store.
+        fetch: Async callable returning the new value, or None on errors.
+        interval (float): Seconds before the value is stale and refreshed.
+        retry_interval (float): Seconds before the first retry after a failure.
+        persist (bool): Keep the last good value across restarts; it must be JSON serializable.
+    """
+
+    def __init__(self, name: str, fetch, interval: float, retry_interval: float = RETRY_INTERVAL,
+                 persist: bool = False):
+        self.name = name
+        self.fetch = fetch
+        self.interval = interval
+        self.retry_interval = retry_interval
+        self.persist = persist
+
+        self.value = None
+        self.updated_at = None  # Wall clock time the value was fetched at
+
+        # Counters
+        self.refreshes = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+
+        self._refreshed_at = None  # time.monotonic() of the value
+        self._attempted_at = 0.0
+        self._task = None
+
+    def get(self):
+        """
+        Get the last good value without waiting, starting a background refresh if it is stale.
+
+        Returns:
+            The value, or None if none has been fetched yet.
+        """
+        if self.is_stale():
+            self.revalidate()
+        return self.value
+
+    def age(self) -> float:
+        """
+        Seconds since the value was fetched, or None if there is no value.
+        """
+        return None if self._refreshed_at is None else time.monotonic() - self._refreshed_at
+
+    def is_stale(self) -> bool:
+        return self._refreshed_at is None or self.age() > self.interval
+
+    def is_refreshing(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def next_due(self) -> float:
+        """
+        The time.monotonic() at which the next refresh should start.
+        """
+        if self.consecutive_failures:
+            backoff = self.retry_interval * 2 ** (self.consecutive_failures - 1)
+            return self._attempted_at + min(backoff, self.interval)
+        if self._refreshed_at is None:
+            return self._attempted_at
+        return self._refreshed_at + self.interval
+
+    def revalidate(self, force: bool = False) -> asyncio.Task:
+        """
+        Start a refresh in the background, unless one is running or a failed one is backing off.
+
+        Returns:
+            asyncio.Task: The refresh in flight, or None.
+        """
+        if not self.is_refreshing() and (force or time.monotonic() >= self.next_due()):
+            # A fresh context, so a refresh started from get() doesn't inherit the command's deadline and log fields
+            self._task = asyncio.create_task(self.refresh(), context=contextvars.Context())
+        return self._task
+
+    async def refresh(self) -> bool:
+        """
+        Fetch the dataset now, keeping the last good value if that fails.
+
+        Returns:
+            bool: True if the value was refreshed.
+        """
+        self._attempted_at = time.monotonic()
+        try:
+            value = await self.fetch()
+        except Exception as e:
+            log.warning("Error refreshing %s: %s", self.name, e)
+            value = None
+
+        try:
+            if value is None:
+                self.failures += 1
+                self.consecutive_failures += 1
+                log.warning("Refreshing %s failed %d times in a row; serving the last good value",
+                            self.name, self.consecutive_failures)
+                return False
+
+            self.value = value
+            self.updated_at = time.time()
+            self._refreshed_at = time.monotonic()
+            self.refreshes += 1
+            self.consecutive_failures = 0
+
+            store = database.get_database()
+            if self.persist and store is not None:
+                store.put(self.name, SNAPSHOT_KEY, {'value': value, 'updated_at': self.updated_at}, PERSIST_TTL)
+            return True
+        finally:
+            if _wakeup is not None:
+                _wakeup.set()
+
+    async def restore(self):
+        """
+        Load the persisted value, if there is one and nothing newer has been fetched.
+        """
+        store = database.get_database()
+        if not self.persist or store is None or self.value is not None:
+            return
+        entry = await store.get(self.name, SNAPSHOT_KEY)
+        if entry is None:
+            return
+
+        snapshot, _ = entry
+        self.value = snapshot['value']
+        self.updated_at = snapshot['updated_at']
+        # Dated from when it was fetched, so it is refreshed straight away if it is already stale
+        self._refreshed_at = time.monotonic() - max(0.0, time.time() - self.updated_at)
+
+    def stats(self) -> dict:
+        return {
+            'age': self.age(),
+            'refreshes': self.refreshes,
+            'failures': self.failures,
+            'consecutive_failures': self.consecutive_failures,
+        }
+
+
+def register(name: str, fetch, interval: float, retry_interval: float = RETRY_INTERVAL,
+             persist: bool = False) -> Dataset:
+    """
+    Register a dataset to be kept fresh by the scheduler (see Dataset for the arguments).
+
+    Returns:
+        Dataset: The dataset; read it with get().
+    """
+    dataset = DATASETS[name] = Dataset(name, fetch, interval, retry_interval=retry_interval, persist=persist)
+    if _wakeup is not None:
+        _wakeup.set()
+    return dataset
+
+
+def get_dataset(name: str) -> Dataset:
+    return DATASETS.get(name)
+
+
+async def run_refresher():
+    """
+    Restore persisted datasets, then refresh each one whenever it is due. Runs until cancelled.
+    """
+    global _wakeup
+    _wakeup = asyncio.Event()
+    await asyncio.gather(*(dataset.restore() for dataset in list(DATASETS.values())))
+
+    try:
+        while True:
+            _wakeup.clear()
+            now = time.monotonic()
+            for dataset in list(DATASETS.values()):
+                if not dataset.is_refreshing() and dataset.next_due() <= now:
+                    dataset.revalidate(force=True)
+
+            # Refreshes in flight wake the scheduler when they finish
+            due = [dataset.next_due() for dataset in DATASETS.values() if not dataset.is_refreshing()]
+            delay = max(MIN_SLEEP, min(due, default=now + 3600) - time.monotonic())
+            try:
+                await asyncio.wait_for(_wakeup.wait(), delay)
+            except asyncio.TimeoutError:
+                pass
+    finally:
+        _wakeup = None
+        for dataset in DATASETS.values():
+            if dataset.is_refreshing():
+                dataset._task.cancel()
+
+
+def start_refresher() -> asyncio.Task:
+    """
+    Start the scheduler in the background, once the datasets have been registered.
+
+    Returns:
+        asyncio.Task: The scheduler task; cancel it (or call stop_refresher) to stop.
+    """
+    return asyncio.create_task(run_refresher())
+
+
+def stop_refresher(task: asyncio.Task):
+    task.cancel()
@@ -0,0 +1,622 @@
+import asyncio
+import heapq
+import json
+import logging
+import re
+import sqlite3
+import time
+from collections import defaultdict, namedtuple
+from pathlib import Path
+
+from utils.files import write_json
+
+log = logging.getLogger(__name__)
+
+ROOT_PATH = Path(__file__).resolve().parent.parent
+SNAPSHOT_PATH = ROOT_PATH / 'data' / 'reminders.json'
+LOG_PATH = ROOT_PATH / 'data' / 'reminders.log'
+
+# Queued log entries are appended to the log this often
+FLUSH_INTERVAL = 1.0
+
+# A snapshot replaces the log once it has this many entries, or after this many seconds
+SNAPSHOT_EVERY = 10_000
+SNAPSHOT_INTERVAL = 600
+
+# A due reminder waits up to this many seconds for others due just after it, so they fire in one batch
+BATCH_WINDOW = 0.25
+
+# The most reminders taken off the heap at once, so one busy second doesn't stall the loop
+MAX_BATCH = 1000
+
+# Failed deliveries are retried this many seconds later, up to MAX_ATTEMPTS times in total
+RETRY_DELAY = 60
+MAX_ATTEMPTS = 3
+
+# Rebuild the heap once it holds this many more entries than there are reminders
+HEAP_SLACK = 10_000
+
+# Longest delay accepted by parse_duration
+MAX_DELAY = 365 * 24 * 3600
+
+# Units are matched as whole words only, so "2 months" is rejected rather than read as 2 minutes;
+# every spelling of a unit starts with the letter it is keyed by
+DURATION_UNITS = {'s': 1, 'm': 60, 'h': 3600, 'd': 24 * 3600, 'w': 7 * 24 * 3600}
+DURATION_PART = re.compile(r'(\d+)\s*(seconds?|secs?|s|minutes?|mins?|m|hours?|hrs?|h|days?|d|weeks?|w)(?![a-z])',
+                           re.IGNORECASE)
+
+# A tuple keeps 100k pending reminders small, and is stored as a plain JSON list
+Reminder = namedtuple('Reminder', 'id due_at user_id channel_id guild_id message attempts')
+
+
+def parse_duration(text: str) -> int:
+    """
+    Parse a delay like "90s", "10m", "1h30m" or "2 days".
+
+    Returns:
+        int: The delay in seconds, or None if the text isn't a valid delay.
+    """
+    text = text.strip()
+    parts = list(DURATION_PART.finditer(text))
+    if not parts or DURATION_PART.sub('', text).strip(' ,'):
+        return None
+    seconds = sum(int(part.group(1)) * DURATION_UNITS[part.group(2)[0].lower()] for part in parts)
+    return seconds if 0 < seconds <= MAX_DELAY else None
+
+
+class ReminderStore:
+    """
+    Persists reminders as a snapshot plus an append-only log of changes, folded into a new snapshot once it grows.
+    """
+
+    def __init__(self, snapshot_path=None, log_path=None):
+        # The defaults are read when the store is created, so they can be pointed elsewhere
+        self.snapshot_path = Path(snapshot_path or SNAPSHOT_PATH)
+        self.log_path = Path(log_path or LOG_PATH)
+        self._pending = []
+        self._lock = asyncio.Lock()
+        self.log_entries = 0
+        self.snapshot_at = time.monotonic()
+
+    def load(self) -> tuple:
+        """
+        Read the snapshot and replay the log. Blocking; run it in a thread.
+
+        Returns:
+            tuple: The pending reminders by ID, and the next free ID.
+        """
+        reminders = {}
+        next_id = 1
+        try:
+            text = self.snapshot_path.read_text(encoding='utf-8')
+        except FileNotFoundError:
+            text = ''
+        if text.strip():
+            snapshot = json.loads(text)
+            next_id = snapshot['next_id']
+            for row in snapshot['reminders']:
+                reminder = Reminder(*row)
+                reminders[reminder.id] = reminder
+
+        try:
+            with open(self.log_path, encoding='utf-8') as file:
+                for line in file:
+                    try:
+                        operation, payload = json.loads(line)
+                    except ValueError:
+                        # A crash mid-write can leave a truncated last line
+                        log.warning("Skipping corrupt reminder log line: %r", line[:100])
+                        continue
+                    if operation == 'add':
+                        reminder = Reminder(*payload)
+                        reminders[reminder.id] = reminder
+                        next_id = max(next_id, reminder.id + 1)
+                    elif operation == 'remove':
+                        for reminder_id in payload:
+                            reminders.pop(reminder_id, None)
+                    self.log_entries += 1
+        except FileNotFoundError:
+            pass
+
+        return reminders, next_id
+
+    def append(self, operation: str, payload):
+        """
+        Queue a log entry. Doesn't block.
+        """
+        self._pending.append(json.dumps([operation, payload], ensure_ascii=False, separators=(',', ':')))
+
+    async def flush(self):
+        """
+        Append the queued entries to the log.
+        """
+        async with self._lock:
+            if not self._pending:
+                return
+            lines, self._pending = self._pending, []
+            await asyncio.to_thread(self._append_lines, lines)
+            self.log_entries += len(lines)
+
+    def _append_lines(self, lines: list):
+        with open(self.log_path, 'a', encoding='utf-8') as file:
+            file.write('\n'.join(lines) + '\n')
+
+    async def snapshot(self, reminders, next_id: int):
+        """
+        Write every pending reminder to a new snapshot and empty the log.
+
+        Args:
+            reminders: The pending reminders.
+            next_id (int): The next free reminder ID.
+        """
+        async with self._lock:
+            # The snapshot covers every queued entry; anything queued from here on goes into the new log
+            self._pending.clear()
+            rows = [list(reminder) for reminder in reminders]
+            await asyncio.to_thread(self._write_snapshot, rows, next_id)
+            self.log_entries = 0
+            self.snapshot_at = time.monotonic()
+
+    def _write_snapshot(self, rows: list, next_id: int):
+        write_json(self.snapshot_path, {'version': 1, 'next_id': next_id, 'reminders': rows}, separators=(',', ':'))
+        # Only truncate the log once the snapshot that replaces it is in place
+        with open(self.log_path, 'w', encoding='utf-8'):
+            pass
+
+    def needs_snapshot(self) -> bool:
+        return self.log_entries >= SNAPSHOT_EVERY or (
+            self.log_entries > 0 and time.monotonic() - self.snapshot_at >= SNAPSHOT_INTERVAL)
+
+
+class ReminderScheduler:
+    """
+    Fires reminders in batches from a single loop over a heap of due times.
+
+    Args:
+        store (ReminderStore): Where changes are persisted.
+        deliver: Async callable taking a list of due reminders and returning
+            the ones that failed and should be retried.
+    """
+
+    def __init__(self, store: ReminderStore, deliver):
+        self.store = store
+        self.deliver = deliver
+        self._reminders = {}
+        self._heap = []                     # (due_at, id), possibly with stale entries
+        self._by_user = defaultdict(set)    # User ID -> reminder IDs
+        self._next_id = 1
+        self._wakeup = asyncio.Event()
+        self._deliveries = set()
+        self._in_flight = {}                # ID -> reminder, while being delivered
+
+        # Counters
+        self.fired = 0
+        self.retried = 0
+        self.failed = 0
+
+    async def load(self):
+        """
+        Load the persisted reminders. Reminders that came due while the bot was down fire right away.
+        """
+        reminders, self._next_id = await asyncio.to_thread(self.store.load)
+        self._load(reminders.values())
+
+    def _load(self, reminders):
+        self._reminders = {reminder.id: reminder for reminder in reminders}
+        self._by_user.clear()
+        for reminder in self._reminders.values():
+            self._by_user[reminder.user_id].add(reminder.id)
+        self._rebuild_heap()
+        self._wakeup.set()
+
+    def _rebuild_heap(self):
+        self._heap = [(reminder.due_at, reminder.id) for reminder in self._reminders.values()]
+        heapq.heapify(self._heap)
+
+    def _schedule(self, reminder: Reminder):
+        self._reminders[reminder.id] = reminder
+        self._by_user[reminder.user_id].add(reminder.id)
+        if not self._heap or reminder.due_at < self._heap[0][0]:
+            self._wakeup.set()
+        heapq.heappush(self._heap, (reminder.due_at, reminder.id))
+
+    def _insert(self, reminder: Reminder):
+        self._schedule(reminder)
+        self.store.append('add', list(reminder))
+
+    def _discard(self, reminder: Reminder):
+        del self._reminders[reminder.id]
+        ids = self._by_user[reminder.user_id]
+        ids.discard(reminder.id)
+        if not ids:
+            del self._by_user[reminder.user_id]
+
+    async def add(self, due_at: float, user_id: int, channel_id: int, guild_id: int, message: str) -> Reminder:
+        """
+        Schedule a reminder.
+
+        Args:
+            due_at (float): When to fire, as a Unix time.
+            user_id (int): The user to remind.
+            channel_id (int): The channel to remind them in.
+            guild_id (int): The guild, or None in DMs.
+            message (str): The reminder text.
+
+        Returns:
+            Reminder: The scheduled reminder.
+        """
+        reminder = Reminder(self._next_id, due_at, user_id, channel_id, guild_id, message, 0)
+        self._next_id += 1
+        self._insert(reminder)
+        return reminder
+
+    async def cancel(self, reminder_id: int, user_id: int = None) -> bool:
+        """
+        Cancel a reminder, optionally only if it belongs to user_id.
+
+        Returns:
+            bool: True if the reminder was cancelled.
+        """
+        reminder = self._reminders.get(reminder_id)
+        if reminder is None or (user_id is not None and reminder.user_id != user_id):
+            return False
+        self._discard(reminder)
+        self.store.append('remove', [reminder_id])
+        self._trim_heap()
+        return True
+
+    def _trim_heap(self):
+        if len(self._heap) > len(self._reminders) + HEAP_SLACK:
+            self._rebuild_heap()
+
+    async def for_user(self, user_id: int) -> list:
+        """
+        Get a user's pending reminders, soonest first.
+        """
+        return sorted((self._reminders[reminder_id] for reminder_id in self._by_user.get(user_id, ())),
+                      key=lambda reminder: reminder.due_at)
+
+    async def count_for_user(self, user_id: int) -> int:
+        return len(self._by_user.get(user_id, ()))
+
+    def __len__(self):
+        return len(self._reminders)
+
+    def reminders(self):
+        return self._reminders.values()
+
+    def _pop_due(self, now: float) -> list:
+        batch = []
+        while self._heap and self._heap[0][0] <= now and len(batch) < MAX_BATCH:
+            due_at, reminder_id = heapq.heappop(self._heap)
+            reminder = self._reminders.get(reminder_id)
+            # Skip entries left behind by cancellations and retries
+            if reminder is None or reminder.due_at != due_at:
+                continue
+            self._discard(reminder)
+            batch.append(reminder)
+        return batch
+
+    async def run(self):
+        """
+        Fire reminders as they come due. Runs until cancelled.
+        """
+        while True:
+            batch = self._pop_due(time.time())
+            if batch:
+                self._in_flight.update((reminder.id, reminder) for reminder in batch)
+                # Deliver in the background so a slow batch doesn't hold up the next one
+                task = asyncio.create_task(self._fire(batch))
+                self._deliveries.add(task)
+                task.add_done_callback(self._deliveries.discard)
+                await asyncio.sleep(0)
+                continue
+
+            self._wakeup.clear()
+            # Sleep until BATCH_WINDOW after the earliest is due, or until an earlier one is added
+            timeout = self._heap[0][0] - time.time() + BATCH_WINDOW if self._heap else None
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _fire(self, batch: list):
+        try:
+            failed = await self.deliver(batch)
+        except Exception:
+            log.exception("Failed to deliver %d reminders", len(batch))
+            failed = batch
+
+        for reminder in batch:
+            del self._in_flight[reminder.id]
+        failed_ids = {reminder.id for reminder in failed}
+        self.store.append('remove', [reminder.id for reminder in batch if reminder.id not in failed_ids])
+        self.fired += len(batch) - len(failed)
+
+        retry_at = time.time() + RETRY_DELAY
+        for reminder in failed:
+            if reminder.attempts + 1 < MAX_ATTEMPTS:
+                self.retried += 1
+                self._insert(reminder._replace(due_at=retry_at, attempts=reminder.attempts + 1))
+            else:
+                self.failed += 1
+                self.store.append('remove', [reminder.id])
+
+    async def persist(self):
+        """
+        Flush the log regularly and fold it into a snapshot once it grows. Runs until cancelled.
+        """
+        while True:
+            await asyncio.sleep(FLUSH_INTERVAL)
+            await self.save()
+
+    async def save(self, snapshot: bool = False):
+        """
+        Flush the log, and write a snapshot if it is due or snapshot is True.
+        """
+        await self.store.flush()
+        if snapshot or self.store.needs_snapshot():
+            # Reminders being delivered stay in the snapshot until their removal is logged
+            reminders = list(self._reminders.values()) + list(self._in_flight.values())
+            await self.store.snapshot(reminders, self._next_id)
+
+    def stats(self) -> dict:
+        stats = {
+            'pending': len(self._reminders),
+            'heap': len(self._heap),
+            'fired': self.fired,
+            'retried': self.retried,
+            'failed': self.failed
+        }
+        if self.store is not None:
+            stats['log_entries'] = self.store.log_entries
+        return stats
+
+
+# The reminders table's columns in Reminder's order, see data/database.sql
+REMINDER_COLUMNS = ', '.join(Reminder._fields)
+
+
+def _id_list(reminders) -> tuple:
+    # Bound as one JSON array, read back with json_each, however many reminders there are
+    return (json.dumps([reminder.id for reminder in reminders]),)
+
+
+class SharedReminderScheduler(ReminderScheduler):
+    """
+    A cluster worker's scheduler, keeping reminders in the database all workers share.
+    Any worker lists and cancels them; each is fired by the worker that added it.
+
+    Args:
+        database (Database): The database shared by the cluster.
+        worker_id (int): This worker, which owns the reminders it adds.
+        deliver: As for ReminderScheduler.
+    """
+
+    def __init__(self, database, worker_id: int, deliver):
+        super().__init__(None, deliver)
+        self.database = database
+        self.worker_id = worker_id
+
+    async def load(self):
+        """
+        Load the reminders this worker owns. Reminders that came due while it was down fire right away.
+        """
+        rows = await self.database.execute(f'SELECT {REMINDER_COLUMNS} FROM reminders WHERE owner = ?',
+                                           (self.worker_id,))
+        self._load(Reminder(*row) for row in rows)
+
+    async def add(self, due_at: float, user_id: int, channel_id: int, guild_id: int, message: str) -> Reminder:
+        rows = await self.database.execute(
+            'INSERT INTO reminders (due_at, user_id, channel_id, guild_id, message, owner) '
+            'VALUES (?, ?, ?, ?, ?, ?) RETURNING id',
+            (due_at, user_id, channel_id, guild_id, message, self.worker_id))
+        reminder = Reminder(rows[0][0], due_at, user_id, channel_id, guild_id, message, 0)
+        self._schedule(reminder)
+        return reminder
+
+    async def cancel(self, reminder_id: int, user_id: int = None) -> bool:
+        rows = await self.database.execute(
+            'DELETE FROM reminders WHERE id = ? AND user_id = coalesce(?, user_id) RETURNING id', (reminder_id, user_id))
+        if not rows:
+            return False
+        # Not here if another worker owns it; that worker skips it once it comes due
+        reminder = self._reminders.get(reminder_id)
+        if reminder is not None:
+            self._discard(reminder)
+            self._trim_heap()
+        return True
+
+    async def for_user(self, user_id: int) -> list:
+        rows = await self.database.execute(
+            f'SELECT {REMINDER_COLUMNS} FROM reminders WHERE user_id = ? ORDER BY due_at', (user_id,))
+        return [Reminder(*row) for row in rows]
+
+    async def count_for_user(self, user_id: int) -> int:
+        rows = await self.database.execute('SELECT count(*) FROM reminders WHERE user_id = ?', (user_id,))
+        return rows[0][0]
+
+    async def adopt_orphans(self, workers: int) -> int:
+        """
+        Take over the reminders of workers that are no longer part of the cluster, after it shrank.
+
+        Returns:
+            int: The number of reminders taken over.
+        """
+        rows = await self.database.execute(
+            f'UPDATE reminders SET owner = ? WHERE owner >= ? RETURNING {REMINDER_COLUMNS}', (self.worker_id, workers))
+        for row in rows:
+            self._schedule(Reminder(*row))
+        return len(rows)
+
+    async def _fire(self, batch: list):
+        for reminder in batch:
+            del self._in_flight[reminder.id]
+        retry_at = time.time() + RETRY_DELAY
+
+        try:
+            rows = await self.database.execute(
+                'SELECT id FROM reminders WHERE id IN (SELECT value FROM json_each(?))', _id_list(batch))
+        except sqlite3.Error as e:
+            log.error("Failed to look up %d due reminders, retrying them later: %s", len(batch), e)
+            for reminder in batch:
+                self._schedule(reminder._replace(due_at=retry_at))
+            return
+        # The rest were cancelled on another worker
+        pending_ids = {row[0] for row in rows}
+        batch = [reminder for reminder in batch if reminder.id in pending_ids]
+        if not batch:
+            return
+
+        try:
+            failed = await self.deliver(batch)
+        except Exception:
+            log.exception("Failed to deliver %d reminders", len(batch))
+            failed = batch
+        self.fired += len(batch) - len(failed)
+
+        failed_ids = {reminder.id for reminder in failed}
+        done = [reminder for reminder in batch if reminder.id not in failed_ids]
+        retries = []
+        for reminder in failed:
+            if reminder.attempts + 1 < MAX_ATTEMPTS:
+                retries.append(reminder._replace(due_at=retry_at, attempts=reminder.attempts + 1))
+            else:
+                self.failed += 1
+                done.append(reminder)
+
+        try:
+            if done:
+                await self.database.execute(
+                    'DELETE FROM reminders WHERE id IN (SELECT value FROM json_each(?))', _id_list(done))
+            for reminder in retries:
+                # Unless it was cancelled while being delivered
+                if await self.database.execute('UPDATE reminders SET due_at = ?, attempts = ? WHERE id = ? RETURNING id',
+                                               (reminder.due_at, reminder.attempts, reminder.id)):
+                    self.retried += 1
+                    self._schedule(reminder)
+        except sqlite3.Error as e:
+            # Still in the table, so they fire again once this worker restarts
+            log.error("Failed to record %d fired reminders: %s", len(batch), e)
+
+    async def save(self, snapshot: bool = False):
+        """
+        Nothing to do; every change is already in the database.
+        """
+
+
+# The scheduler currently running, if any
+_scheduler = None
+
+
+# The files of a cluster worker's store, see worker_store
+WORKER_FILE = re.compile(r'reminders\.(\d+)\.(?:json|log)')
+
+
+def worker_store(worker_id: int) -> ReminderStore:
+    """
+    Get the store of a cluster worker running without a database. Worker 0 uses the same files as a single process.
+    """
+    if worker_id == 0:
+        return ReminderStore()
+    return ReminderStore(SNAPSHOT_PATH.with_name(f'reminders.{worker_id}.json'),
+                         LOG_PATH.with_name(f'reminders.{worker_id}.log'))
+
+
+def orphaned_workers(workers: int) -> list:
+    """
+    Find workers that left reminders behind but are no longer part of the cluster, after it shrank.
+
+    Returns:
+        list: Their worker IDs.
+    """
+    worker_ids = set()
+    for path in SNAPSHOT_PATH.parent.glob('reminders.*'):
+        match = WORKER_FILE.fullmatch(path.name)
+        if match and int(match.group(1)) >= workers:
+            worker_ids.add(int(match.group(1)))
+    return sorted(worker_ids)
+
+
+async def adopt_store(scheduler: ReminderScheduler, store: ReminderStore) -> int:
+    """
+    Move every reminder of another store into a scheduler, with new IDs, then delete the store's files.
+
+    Returns:
+        int: The number of reminders moved.
+    """
+    reminders, _ = await asyncio.to_thread(store.load)
+    for reminder in sorted(reminders.values(), key=lambda reminder: reminder.due_at):
+        await scheduler.add(reminder.due_at, reminder.user_id, reminder.channel_id, reminder.guild_id,
+                            reminder.message)
+    # Safely in our own files before theirs are gone
+    await scheduler.save(snapshot=True)
+    for path in (store.snapshot_path, store.log_path):
+        path.unlink(missing_ok=True)
+    return len(reminders)
+
+
+async def adopt_table(scheduler: ReminderScheduler, database) -> int:
+    """
+    Move the reminders a cluster left in the database into a single process's scheduler, with new IDs.
+
+    Returns:
+        int: The number of reminders moved.
+    """
+    rows = await database.execute(f'SELECT {REMINDER_COLUMNS} FROM reminders ORDER BY due_at')
+    if not rows:
+        return 0
+    for reminder in map(Reminder._make, rows):
+        await scheduler.add(reminder.due_at, reminder.user_id, reminder.channel_id, reminder.guild_id,
+                            reminder.message)
+    # Safely in our own files before they leave the table
+    await scheduler.save(snapshot=True)
+    await database.execute('DELETE FROM reminders WHERE id IN (SELECT value FROM json_each(?))',
+                           (json.dumps([row[0] for row in rows]),))
+    return len(rows)
+
+
+def get_scheduler() -> ReminderScheduler:
+    """
+    Get the running scheduler, or None if it isn't running.
+    """
+    return _scheduler
+
+
+async def start_scheduler(deliver, store: ReminderStore = None, database=None, worker_id: int = 0) -> list:
+    """
+    Load the persisted reminders and start firing them.
+
+    Args:
+        deliver: The scheduler's deliver callback.
+        store (ReminderStore): Defaults to data/reminders.json and data/reminders.log.
+        database (Database): Keep the reminders in this database, shared by a
+            cluster's workers, instead of a store.
+        worker_id (int): With database, the cluster worker this process runs.
+
+    Returns:
+        list: The scheduler and persistence tasks; pass them to stop_scheduler.
+    """
+    global _scheduler
+    if database is not None:
+        scheduler = SharedReminderScheduler(database, worker_id, deliver)
+    else:
+        scheduler = ReminderScheduler(store or ReminderStore(), deliver)
+    await scheduler.load()
+    _scheduler = scheduler
+    tasks = [asyncio.create_task(scheduler.run())]
+    if scheduler.store is not None:
+        tasks.append(asyncio.create_task(scheduler.persist()))
+    return tasks
+
+
+async def stop_scheduler(tasks: list):
+    """
+    Stop firing reminders and write a final snapshot.
+    """
+    global _scheduler
+    for task in tasks:
+        task.cancel()
+    if _scheduler is not None:
+        await _scheduler.save(snapshot=True)
+        _scheduler = None
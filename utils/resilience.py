@@ -0,0 +1,256 @@
+import asyncio
+import contextvars
+import datetime
+import logging
+import random
+import time
+
+import aiohttp
+
+log = logging.getLogger(__name__)
+
+# Discord drops an interaction that isn't answered within 3 seconds; after a
+# defer, followups can be sent for 15 minutes
+INTERACTION_DEADLINE = 3.0
+FOLLOWUP_DEADLINE = 15 * 60
+
+# Time kept back from the interaction budget to actually send the response
+RESPONSE_MARGIN = 0.3
+
+# Per-host request timeouts in seconds, and the default for other hosts
+TIMEOUTS = {
+    'en.wikipedia.org': 2.5,
+    'finnhub.io': 4.0,
+    'api.polygon.io': 5.0,
+    'api.api-ninjas.com': 3.0,
+    'restcountries.com': 10.0,
+}
+DEFAULT_TIMEOUT = 5.0
+
+# Retries for idempotent requests, with full-jitter exponential backoff
+RETRIES = 2
+BACKOFF_BASE = 0.2
+BACKOFF_MAX = 2.0
+
+# Consecutive failures that open a host's circuit, and how long it stays open
+FAILURE_THRESHOLD = 5
+RESET_TIMEOUT = 30.0
+
+# Errors worth retrying: connection problems and timeouts
+RETRYABLE_ERRORS = (aiohttp.ClientConnectionError, asyncio.TimeoutError, OSError)
+
+# The time.monotonic() by which the current command must have its data
+_deadline = contextvars.ContextVar('deadline', default=None)
+
+
+class CircuitOpenError(aiohttp.ClientConnectionError):
+    """
+    Raised instead of calling a host whose circuit is open.
+    """
+
+    def __init__(self, host: str):
+        super().__init__(f"{host} is not responding right now")
+        self.host = host
+
+
+def set_deadline(seconds: float):
+    """
+    Give the current command `seconds` from now to fetch its data.
+    """
+    _deadline.set(time.monotonic() + seconds)
+
+
+def set_interaction_deadline(interaction, responded: bool = False):
+    """
+    Derive the current command's deadline from the interaction's remaining time budget.
+
+    Args:
+        interaction: The discord.Interaction being handled.
+        responded (bool): Whether the interaction was already deferred, which extends the budget.
+    """
+    budget = FOLLOWUP_DEADLINE if responded else INTERACTION_DEADLINE
+    elapsed = (datetime.datetime.now(datetime.timezone.utc) - interaction.created_at).total_seconds()
+    set_deadline(budget - max(0.0, elapsed) - RESPONSE_MARGIN)
+
+
+def current_deadline() -> float:
+    """
+    Get the current command's deadline as a time.monotonic() value, or None outside a command.
+    """
+    return _deadline.get()
+
+
+def remaining() -> float:
+    """
+    Get the seconds left before the current deadline, or None if there is none.
+    """
+    deadline = _deadline.get()
+    return None if deadline is None else deadline - time.monotonic()
+
+
+def timeout_for(host: str, timeout: float = None) -> float:
+    """
+    Get the timeout for a request to host: its own timeout (or the given one), capped by the time left.
+    """
+    timeout = TIMEOUTS.get(host, DEFAULT_TIMEOUT) if timeout is None else timeout
+    left = remaining()
+    return timeout if left is None else min(timeout, left)
+
+
+class CircuitBreaker:
+    """
+    Fails fast while a host is down.
+
+    After FAILURE_THRESHOLD consecutive failures the circuit opens and calls
+    raise CircuitOpenError without touching the network. Once RESET_TIMEOUT
+    has passed a single probe is let through: success closes the circuit,
+    failure opens it again.
+    """
+
+    def __init__(self, host: str, failure_threshold: int = FAILURE_THRESHOLD, reset_timeout: float = RESET_TIMEOUT):
+        self.host = host
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = 'closed'
+        self.failures = 0
+        self.opened_at = 0.0
+        self.rejected = 0
+        self._probing = False
+
+    def check(self):
+        """
+        Raises:
+            CircuitOpenError: If the circuit is open.
+        """
+        if self.state == 'closed':
+            return
+        if self.state == 'open' and time.monotonic() - self.opened_at >= self.reset_timeout:
+            self.state = 'half_open'
+            self._probing = False
+        if self.state == 'half_open' and not self._probing:
+            self._probing = True
+            return
+        self.rejected += 1
+        raise CircuitOpenError(self.host)
+
+    def record_success(self):
+        self.state = 'closed'
+        self.failures = 0
+        self._probing = False
+
+    def record_failure(self):
+        self.failures += 1
+        if self.state == 'half_open' or self.failures >= self.failure_threshold:
+            if self.state != 'open':
+                log.warning("Circuit opened for %s after %d failures", self.host, self.failures)
+            self.state = 'open'
+            self.opened_at = time.monotonic()
+            self._probing = False
+
+
+# Circuit breakers by host
+BREAKERS = {}
+
+
+def get_breaker(host: str) -> CircuitBreaker:
+    breaker = BREAKERS.get(host)
+    if breaker is None:
+        breaker = BREAKERS[host] = CircuitBreaker(host)
+    return breaker
+
+
+def backoff(attempt: int) -> float:
+    """
+    Full-jitter exponential backoff for the given attempt, starting at 0.
+    """
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+
+
+async def hedged(factory, hedge_after: float):
+    """
+    Start a call and, if it hasn't finished after hedge_after seconds, start a
+    second identical one. The first to succeed wins and the other is cancelled.
+
+    Args:
+        factory: A callable returning a new awaitable for each attempt.
+        hedge_after (float): Seconds to wait before sending the hedge.
+    """
+    first = asyncio.ensure_future(factory())
+    pending = {first}
+    # Every started attempt is cancelled on the way out, including when the caller is cancelled while waiting
+    try:
+        done, pending = await asyncio.wait(pending, timeout=hedge_after)
+        if done:
+            return first.result()
+
+        pending.add(asyncio.ensure_future(factory()))
+        error = None
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    return task.result()
+                error = task.exception()
+        raise error
+    finally:
+        for task in pending:
+            task.cancel()
+
+
+async def call(host: str, factory, retries: int = RETRIES, is_failure=None, hedge_after: float = None,
+               timeout: float = None):
+    """
+    Call an upstream with a deadline-aware timeout, retries and a circuit breaker.
+
+    Only use this for idempotent calls, since they may be sent more than once.
+
+    Args:
+        host (str): The upstream host, used for its timeout and circuit breaker.
+        factory: A callable returning a new awaitable for each attempt.
+        retries (int): How many times to retry after the first attempt.
+        is_failure: Optional callback marking a result as a failure worth retrying (e.g. a 503).
+            The last such result is returned if every attempt fails.
+        hedge_after (float): If set, send a hedged second request after this many seconds.
+        timeout (float): Seconds per attempt instead of the host's timeout, e.g. for a bulk download.
+
+    Raises:
+        CircuitOpenError: If the host's circuit is open.
+        aiohttp.ServerTimeoutError: If the deadline runs out.
+    """
+    breaker = get_breaker(host)
+    result = None
+    error = None
+
+    for attempt in range(retries + 1):
+        breaker.check()
+        attempt_timeout = timeout_for(host, timeout)
+        if attempt_timeout <= 0:
+            break
+
+        try:
+            if hedge_after is not None and hedge_after < attempt_timeout:
+                result = await asyncio.wait_for(hedged(factory, hedge_after), attempt_timeout)
+            else:
+                result = await asyncio.wait_for(factory(), attempt_timeout)
+        except RETRYABLE_ERRORS as e:
+            breaker.record_failure()
+            result, error = None, e
+        else:
+            if is_failure is None or not is_failure(result):
+                breaker.record_success()
+                return result
+            breaker.record_failure()
+            error = None
+
+        # Don't sleep past the deadline
+        delay = backoff(attempt)
+        left = remaining()
+        if attempt == retries or (left is not None and left <= delay):
+            break
+        await asyncio.sleep(delay)
+
+    if result is not None:
+        return result
+    if error is not None and not isinstance(error, asyncio.TimeoutError):
+        raise error
+    raise aiohttp.ServerTimeoutError(f"Timed out waiting for {host}")
@@ -0,0 +1,67 @@
+import asyncio
+import datetime
+
+from utils import metrics
+from utils import resilience
+
+# Defer if the data isn't ready this many seconds after the interaction was created,
+# leaving time for the defer itself to reach Discord within the 3-second deadline
+DEFER_AFTER = 2.0
+
+# Once a command can defer, its upstream calls may take this long
+FETCH_DEADLINE = 10.0
+
+
+def _elapsed(interaction) -> float:
+    return (datetime.datetime.now(datetime.timezone.utc) - interaction.created_at).total_seconds()
+
+
+def _record_first_response(interaction, deferred: bool):
+    name = interaction.command.qualified_name if interaction.command else 'unknown'
+    metrics.FIRST_RESPONSE.observe(_elapsed(interaction), command=name, deferred=str(deferred).lower())
+
+
+async def respond(interaction, fetch, render, enrich=None):
+    """
+    Fetch a command's data and answer the interaction without missing its deadline.
+
+    If the data is ready quickly (e.g. served from a cache) the interaction is
+    answered directly. Otherwise it is deferred before Discord's 3-second
+    deadline and the answer is sent as a followup once the data arrives.
+
+    Args:
+        interaction: The discord.Interaction to answer.
+        fetch: An awaitable producing the command's data.
+        render: A callable turning the data into send_message keyword arguments
+            (content, embed, ephemeral, ...). An ephemeral answer stays private
+            even after deferring, and isn't enriched.
+        enrich: Optional async callable taking the data and returning keyword
+            arguments for edit_original_response, or None. Used to edit in
+            richer data, such as a thumbnail, after the first answer is sent.
+    """
+    # The command may now take longer than 3 seconds since it can defer
+    resilience.set_deadline(FETCH_DEADLINE)
+    task = asyncio.ensure_future(fetch)
+
+    done, _ = await asyncio.wait({task}, timeout=max(0.0, DEFER_AFTER - _elapsed(interaction)))
+    if done:
+        data = task.result()
+        await interaction.response.send_message(**render(data))
+        _record_first_response(interaction, deferred=False)
+    else:
+        await interaction.response.defer(thinking=True)
+        _record_first_response(interaction, deferred=True)
+        data = await task
+        message = render(data)
+        if message.get('ephemeral'):
+            # The thinking message is public, so an answer meant to be private replaces it as a new message
+            await interaction.delete_original_response()
+            await interaction.followup.send(**message)
+            return
+        await interaction.followup.send(**message)
+
+    if enrich is not None:
+        changes = await enrich(data)
+        if changes:
+            await interaction.edit_original_response(**changes)
+
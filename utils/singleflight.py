@@ -0,0 +1,97 @@
+import asyncio
+import functools
+import inspect
+
+from utils.cache import call_key, normalize_key
+
+# Every SingleFlight group created, by name, so their counters can be reported
+GROUPS = {}
+
+
+class SingleFlight:
+    """
+    Coalesce concurrent calls for the same key into a single in-flight call.
+
+    The first caller for a key starts the call; everyone who asks for the same
+    key before it finishes awaits the same task and gets the same result or
+    exception. The call runs in its own task, so a caller being cancelled
+    (for example by a timeout) doesn't cancel it for the others.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._calls = {}
+
+        # Counters: calls that went upstream vs. calls that joined one in flight
+        self.executed = 0
+        self.shared = 0
+
+        GROUPS[name] = self
+
+    async def do(self, key, func, *args, **kwargs):
+        """
+        Run func(*args, **kwargs) unless a call for key is already in flight, then await its result.
+
+        Args:
+            key: The normalized key identifying the call.
+            func: The coroutine function to call.
+            *args: Positional arguments for func.
+            **kwargs: Keyword arguments for func.
+
+        Returns:
+            The result of the shared call.
+        """
+        task = self._calls.get(key)
+        if task is None:
+            self.executed += 1
+            task = asyncio.ensure_future(func(*args, **kwargs))
+            self._calls[key] = task
+            task.add_done_callback(functools.partial(self._forget, key))
+        else:
+            self.shared += 1
+
+        return await asyncio.shield(task)
+
+    def _forget(self, key, task):
+        if self._calls.get(key) is task:
+            del self._calls[key]
+        # Mark the exception as retrieved in case every caller was cancelled
+        if not task.cancelled():
+            task.exception()
+
+    def in_flight(self) -> int:
+        return len(self._calls)
+
+    def stats(self) -> dict:
+        return {
+            'executed': self.executed,
+            'shared': self.shared,
+            'in_flight': len(self._calls)
+        }
+
+
+def coalesced(name: str, key=normalize_key):
+    """
+    Coalesce concurrent calls of an async function with the same arguments.
+
+    Arguments are normalized with normalize_key, so "/stock tsla" and
+    "/stock TSLA" in the same second share one upstream request.
+
+    Args:
+        name (str): The group name, used when reporting counters.
+        key: Callable building the key from the arguments, for lookups where case matters.
+    """
+    make_key = key
+    group = SingleFlight(name)
+
+    def decorator(func):
+        signature = inspect.signature(func)
+
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            return await group.do(call_key(signature, make_key, args, kwargs), func, *args, **kwargs)
+
+        wrapper.single_flight = group
+        return wrapper
+
+    return decorator
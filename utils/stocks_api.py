@@ -1,17 +1,142 @@
-import requests
-from dotenv import load_dotenv
-import os
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
 
-def dividends(symbol):
-    load_dotenv()
-    api_key = os.getenv('POLYGON_KEY')
+from utils import http
+from utils import metrics
+from utils import rate_limit
+from utils import resilience
+from utils.config import get_config
+from utils.quote_book import get_quote_book
+from utils.cache import cached, classify_optional
+from utils.singleflight import coalesced
+
+# How long stock data is cached: quotes move constantly, profiles and dividends rarely
+QUOTE_TTL = 15
+COMPANY_PROFILE_TTL = 3 * 24 * 3600
+DIVIDENDS_TTL = 12 * 3600
+NOT_FOUND_TTL = 600
+
+FINNHUB_HOST = 'finnhub.io'
+
+# Watchlists: the most symbols per request, and how many quotes are fetched at once across all requests
+MAX_WATCHLIST_SYMBOLS = 25
+WATCHLIST_CONCURRENCY = 8
+_watchlist_semaphore = asyncio.Semaphore(WATCHLIST_CONCURRENCY)
+
+# Why get_quotes has no quote for a symbol: Finnhub doesn't know it, or couldn't be asked
+# (rate limit busy, circuit open, timeout or another error)
+QUOTE_NOT_FOUND = 'not_found'
+QUOTE_UNAVAILABLE = 'unavailable'
+
+# The blocking Finnhub SDK runs on its own threads, enough for a full watchlist at once. A timed-out call
+# can't be stopped, so calls that hang can tie these up but never the default executor other modules use.
+FINNHUB_THREADS = WATCHLIST_CONCURRENCY
+_finnhub_executor = ThreadPoolExecutor(max_workers=FINNHUB_THREADS, thread_name_prefix='finnhub')
+
+def finnhub_client():
+    # The client is created once and owned by the config
+    return get_config().finnhub
+
+async def finnhub_call(method, *args, priority=rate_limit.INTERACTIVE, timeout=None, **kwargs):
+    """
+    Call a Finnhub client method with rate limiting, a timeout, retries and a circuit breaker.
+
+    priority is the rate limit lane and timeout overrides the per-attempt timeout;
+    the other arguments are passed to the method.
+    """
+    async def send():
+        await rate_limit.acquire('finnhub', priority, resilience.current_deadline())
+        started_at = time.monotonic()
+        try:
+            # The Finnhub SDK is blocking, so run it off the event loop; the client is looked up
+            # there too, since the first lookup imports the SDK (and requests), which is slow
+            result = await asyncio.get_running_loop().run_in_executor(
+                _finnhub_executor, lambda: getattr(finnhub_client(), method)(*args, **kwargs))
+        except Exception as e:
+            metrics.UPSTREAM_REQUESTS.inc(host=FINNHUB_HOST, status=type(e).__name__)
+            raise
+        finally:
+            metrics.UPSTREAM_LATENCY.observe(time.monotonic() - started_at, host=FINNHUB_HOST)
+        metrics.UPSTREAM_REQUESTS.inc(host=FINNHUB_HOST, status=200)
+        return result
+
+    return await resilience.call(FINNHUB_HOST, send, timeout=timeout)
+
+@cached('finnhub_quote', ttl=QUOTE_TTL, negative_ttl=QUOTE_TTL, maxsize=2048)
+@coalesced('finnhub_quote')
+async def fetch_quote(symbol):
+    return await finnhub_call('quote', symbol)
+
+async def get_quote(symbol):
+    """
+    Get a quote, from the live quote book when the symbol is subscribed and from REST otherwise.
+    """
+    symbol = symbol.strip().upper()
+    book = get_quote_book()
+    if book is not None:
+        quote = book.get(symbol)
+        if quote is not None:
+            return quote
+
+    quote = await fetch_quote(symbol)
+    if book is not None:
+        book.record_demand(symbol, quote)
+    return quote
+
+async def _bounded_quote(symbol):
+    async with _watchlist_semaphore:
+        return await get_quote(symbol)
+
+async def get_quotes(symbols):
+    """
+    Fetch quotes for several symbols concurrently, through the same path as get_quote.
+
+    Args:
+        symbols (list): The ticker symbols.
+
+    Returns:
+        dict: Each symbol mapped to its quote, or to QUOTE_NOT_FOUND or QUOTE_UNAVAILABLE if there is none.
+    """
+    results = await asyncio.gather(*(_bounded_quote(symbol) for symbol in symbols), return_exceptions=True)
+    quotes = {}
+    for symbol, result in zip(symbols, results):
+        if isinstance(result, Exception) or not isinstance(result, dict):
+            quotes[symbol] = QUOTE_UNAVAILABLE
+        elif not result.get('pc'):
+            # Finnhub answers unknown symbols with an all-zero quote
+            quotes[symbol] = QUOTE_NOT_FOUND
+        else:
+            quotes[symbol] = result
+    return quotes
+
+@cached('finnhub_profile', ttl=COMPANY_PROFILE_TTL, negative_ttl=NOT_FOUND_TTL, maxsize=2048,
+        persist=True)
+@coalesced('finnhub_profile')
+async def fetch_company_profile(symbol):
+    # The cache key ignores case, so the upstream must too
+    symbol = symbol.strip().upper()
+    return await finnhub_call('company_profile2', symbol=symbol)
+
+@coalesced('finnhub_symbol_lookup')
+async def symbol_lookup(query):
+    return await finnhub_call('symbol_lookup', query)
+
+@cached('dividends', ttl=DIVIDENDS_TTL, negative_ttl=NOT_FOUND_TTL, maxsize=1024,
+        classify=classify_optional, persist=True)
+@coalesced('dividends')
+async def dividends(symbol):
+    # The cache key ignores case, so the upstream must too
+    symbol = symbol.strip().upper()
+    api_key = get_config().settings.polygon_key
     api_url = f"https://api.polygon.io/v3/reference/dividends?ticker={symbol}&limit=1&apiKey={api_key}"
-    response = requests.get(api_url)
-    if response.status_code == 200:
+    response = await http.get(api_url, upstream='polygon')
+    if response.status == 200:
         data = response.json()
         if data and 'results' in data and len(data['results']) > 0:
             return data['results'][0]
         else:
-            return None
+            # An empty result means the ticker pays no dividends, which is worth caching
+            return {}
     else:
         return None
@@ -0,0 +1,219 @@
+import asyncio
+import bisect
+import heapq
+import logging
+import re
+import sys
+import time
+from array import array
+from pathlib import Path
+
+from utils import rate_limit
+from utils.files import read_json, write_json
+from utils.stocks_api import finnhub_call, symbol_lookup
+
+log = logging.getLogger(__name__)
+
+# Exchanges whose full listings are downloaded from Finnhub's /stock/symbol
+EXCHANGES = ('US',)
+SNAPSHOT_PATH = Path(__file__).resolve().parent.parent / 'data' / 'symbols.json'
+
+# How often the listings are downloaded again
+REFRESH_INTERVAL = 24 * 3600
+
+# The US listing is a few megabytes, far more than a normal request
+DOWNLOAD_TIMEOUT = 60.0
+
+# Listing types in the order they are preferred when ranking equally good matches
+TYPE_PRIORITY = {'Common Stock': 0, 'ETP': 1, 'ADR': 2, 'REIT': 3}
+OTHER_TYPE_PRIORITY = len(TYPE_PRIORITY)
+
+# Description words shorter than this are only matched together with other words,
+# since a single letter prefixes a large part of the listing
+MIN_WORD_PREFIX = 2
+
+# Splits descriptions and queries into words
+WORD = re.compile(r'[^\W_]+')
+
+
+def _words(text: str) -> list:
+    return WORD.findall(text.casefold())
+
+
+class SymbolIndex:
+    """
+    In-memory index over exchange listings, for ranked symbol and company name search.
+    """
+
+    def __init__(self, rows: list):
+        rows = sorted((row for row in rows if row[0]), key=lambda row: row[0])
+        self.symbols = [sys.intern(row[0]) for row in rows]
+        self.descriptions = [row[1] for row in rows]
+        self.types = [sys.intern(row[2]) for row in rows]
+
+        # Within a match tier, common stock first, then shorter symbols; precomputed so ranking is over integers
+        order = sorted(range(len(rows)), key=lambda position: (
+            TYPE_PRIORITY.get(self.types[position], OTHER_TYPE_PRIORITY), len(self.symbols[position]),
+            self.symbols[position]))
+        self._rank = array('I', bytes(4 * len(rows)))
+        for rank, position in enumerate(order):
+            self._rank[position] = rank
+
+        # Sorted description words next to the listing each belongs to, so a word prefix is a bisect
+        postings = []
+        first_postings = []
+        for position, description in enumerate(self.descriptions):
+            words = [sys.intern(word) for word in _words(description)]
+            postings.extend((word, position) for word in set(words))
+            if words:
+                first_postings.append((words[0], position))
+        postings.sort()
+        first_postings.sort()
+        self._words = [word for word, _ in postings]
+        self._word_rows = array('I', (position for _, position in postings))
+        self._first_words = [word for word, _ in first_postings]
+        self._first_word_rows = array('I', (position for _, position in first_postings))
+
+    @staticmethod
+    def _prefix_rows(words: list, rows: array, prefix: str) -> set:
+        start = bisect.bisect_left(words, prefix)
+        end = bisect.bisect_left(words, prefix + '\U0010ffff', start)
+        return set(rows[start:end])
+
+    def search(self, query: str, limit: int = 25) -> list:
+        """
+        Find the listings best matching a symbol or company name: the exact symbol, then symbols starting
+        with the query, then listings whose description starts with its first word, then the rest.
+
+        Args:
+            query (str): A symbol, or words from a company name.
+            limit (int): The most listings to return.
+
+        Returns:
+            list: Dicts with symbol, description and type, best match first.
+        """
+        best = []
+        symbol_matches = range(0)
+
+        symbol = query.strip().upper()
+        if symbol:
+            start = bisect.bisect_left(self.symbols, symbol)
+            end = bisect.bisect_left(self.symbols, symbol + '\U0010ffff', start)
+            symbol_matches = range(start, end)
+            if start < end and self.symbols[start] == symbol:
+                best.append(start)
+                start += 1
+            best.extend(heapq.nsmallest(limit - len(best), range(start, end), key=self._rank.__getitem__))
+
+        words = _words(query)
+        if len(best) < limit and words and (len(words) > 1 or len(words[0]) >= MIN_WORD_PREFIX):
+            # Intersect from the rarest word, so the sets stay small
+            matches = sorted((self._prefix_rows(self._words, self._word_rows, word) for word in words), key=len)
+            positions = matches[0].intersection(*matches[1:])
+            positions.difference_update(symbol_matches)
+            leading = positions & self._prefix_rows(self._first_words, self._first_word_rows, words[0])
+            for tier in (leading, positions - leading):
+                if len(best) >= limit:
+                    break
+                best.extend(heapq.nsmallest(limit - len(best), tier, key=self._rank.__getitem__))
+
+        return [{'symbol': self.symbols[position], 'description': self.descriptions[position],
+                 'type': self.types[position]} for position in best[:limit]]
+
+    def __contains__(self, symbol: str) -> bool:
+        position = bisect.bisect_left(self.symbols, symbol)
+        return position < len(self.symbols) and self.symbols[position] == symbol
+
+    def __len__(self):
+        return len(self.symbols)
+
+
+# The index currently being served, replaced atomically on refresh
+_index = None
+_loaded_at = 0.0
+
+
+def get_index() -> SymbolIndex:
+    """
+    Get the loaded symbol index, or None if no snapshot has been loaded yet.
+    """
+    return _index
+
+
+def _install(snapshot: dict, loaded_at: float):
+    global _index, _loaded_at
+    _index = SymbolIndex([row for rows in snapshot['exchanges'].values() for row in rows])
+    _loaded_at = loaded_at
+
+
+async def load_snapshot() -> bool:
+    """
+    Load the snapshot file from data/ and build the index.
+
+    Returns:
+        bool: True if a snapshot was loaded.
+    """
+    try:
+        snapshot, modified_at = await asyncio.to_thread(read_json, SNAPSHOT_PATH)
+    except (OSError, ValueError) as e:
+        log.warning("Could not load symbol snapshot: %s", e)
+        return False
+
+    await asyncio.to_thread(_install, snapshot, modified_at)
+    return True
+
+
+async def refresh_snapshot() -> bool:
+    """
+    Download every exchange's listing from Finnhub, save it to data/ and rebuild the index.
+    The current index keeps being served if any download fails.
+
+    Returns:
+        bool: True if the snapshot was refreshed.
+    """
+    exchanges = {}
+    for exchange in EXCHANGES:
+        try:
+            listing = await finnhub_call('stock_symbols', exchange, priority=rate_limit.BACKGROUND,
+                                         timeout=DOWNLOAD_TIMEOUT)
+        except Exception as e:
+            log.warning("Error refreshing the %s symbol listing: %s", exchange, e)
+            return False
+
+        if not isinstance(listing, list) or not listing:
+            log.warning("Unexpected data structure for the %s symbol listing", exchange)
+            return False
+        # Only what search and autocomplete show, which keeps the file and the index small
+        exchanges[exchange] = [[item.get('symbol', ''), item.get('description', ''), item.get('type', '')]
+                               for item in listing]
+
+    snapshot = {'exchanges': exchanges}
+    await asyncio.to_thread(write_json, SNAPSHOT_PATH, snapshot, separators=(',', ':'))
+    await asyncio.to_thread(_install, snapshot, time.time())
+    log.info("Refreshed symbol snapshot", extra={'symbols': len(_index)})
+    return True
+
+
+def snapshot_is_stale() -> bool:
+    """
+    Check whether the loaded snapshot is missing or older than REFRESH_INTERVAL.
+    """
+    return _index is None or time.time() - _loaded_at > REFRESH_INTERVAL
+
+
+async def search_symbols(query: str, limit: int = 25) -> list:
+    """
+    Search the local index, or Finnhub's live symbol search until a snapshot has been loaded.
+
+    Returns:
+        list: Dicts with symbol, description and type, best match first.
+        None: If the live search fails.
+    """
+    if _index is not None:
+        return _index.search(query, limit)
+
+    result = await symbol_lookup(query)
+    if not result or 'result' not in result:
+        return None
+    return [{'symbol': item.get('symbol', ''), 'description': item.get('description', ''),
+             'type': item.get('type', '')} for item in result['result'][:limit]]
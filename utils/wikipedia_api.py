@@ -1,83 +1,185 @@
-import requests
+import logging
+
+import aiohttp
+
+from utils import http
+from utils import rate_limit
+from utils import refresher
+from utils.autocomplete import PrefixSuggester
+from utils.cache import cached, classify_optional, POSITIVE, NEGATIVE
+from utils.pool import Pool
+from utils.singleflight import coalesced
+
+log = logging.getLogger(__name__)
 
 # Base Wikipedia API URL
 WIKIPEDIA_API_URL = 'https://en.wikipedia.org/w/api.php'
 
+# How long article metadata is cached
+ARTICLE_METADATA_TTL = 6 * 3600
+NOT_FOUND_TTL = 600
+
+# Maximum number of candidates a single search request can return with extracts
+MAX_SEARCH_CANDIDATES = 20
+
+# Search is latency critical, so a duplicate request is sent if the first is slow
+SEARCH_HEDGE_AFTER = 0.8
+
+# Trending articles: how many are shown, how many are asked for to have that many after
+# dropping the Main Page and special pages, and how often the list is refreshed
+TRENDING_ARTICLES = 10
+TRENDING_CANDIDATES = 20
+TRENDING_REFRESH_INTERVAL = 30 * 60
+
+# Random articles: how many one request asks for (the most pageimages returns thumbnails for),
+# how many are kept ready, and how few trigger a refill
+RANDOM_BATCH = 50
+RANDOM_POOL_CAPACITY = 100
+RANDOM_POOL_LOW_WATER = 25
+
+# Categories fetched per request, one page of /wiki_categories; the longest
+# category titles keep a page well within the embed description limit
+CATEGORY_PAGE_SIZE = 20
+
+# Autocomplete answers go stale with the next keystroke, so failed lookups aren't retried
+AUTOCOMPLETE_RETRIES = 0
+
+def title_key(title: str, *rest) -> tuple:
+    """
+    Cache key for lookups by article title. Titles are case-sensitive after the
+    first letter ("MIT" and "Mit" are different articles), so only whitespace
+    and underscores are collapsed and the first letter uppercased, as Wikipedia does.
+    """
+    title = ' '.join(title.replace('_', ' ').split())
+    return (title[:1].upper() + title[1:], *rest)
+
 # Utility function to search Wikipedia
-def search_wikipedia(term: str) -> dict:
+@coalesced('wiki_search')
+async def search_wikipedia_candidates(term: str, limit: int = 5) -> list:
     """
-    Search Wikipedia for the given term.
+    Search Wikipedia for the given term and return the top candidates.
+
+    The search, page images, intro extracts and canonical URLs are all fetched
+    in a single request using the search generator.
 
     Args:
         term (str): The term to search for.
+        limit (int): The number of candidates to return (at most 20).
 
     Returns:
-        dict: The first search result, including title, snippet, and URL.
-        None: If no results are found or an error occurs.
+        list: The candidates in search rank order, each including title, snippet, URL and image URL.
+        None: If an error occurs.
     """
+    limit = max(1, min(limit, MAX_SEARCH_CANDIDATES))
+
     # Define the API request parameters
     params = {
-        'action': 'query',        # API action to query Wikipedia
-        'format': 'json',         # Format of the response
-        'list': 'search',         # Specify a search query
-        'srsearch': term,         # The search term
-        'utf8': 1                # Ensure UTF-8 encoding
+        'action': 'query',                   # API action to query Wikipedia
+        'format': 'json',                    # Format of the response
+        'generator': 'search',               # Use the search results as the page set
+        'gsrsearch': term,                   # The search term
+        'gsrlimit': limit,                   # Number of search results
+        'prop': 'pageimages|extracts|info',  # Thumbnail, intro text and URL for every result
+        'piprop': 'thumbnail',
+        'pithumbsize': 300,
+        'pilimit': limit,
+        'exintro': 1,                        # Only the lead section
+        'explaintext': 1,                    # Plain text instead of HTML
+        'exsentences': 2,
+        'exlimit': limit,
+        'inprop': 'url',                     # Include the canonical URL
+        'utf8': 1                            # Ensure UTF-8 encoding
     }
 
     try:
         # Send a GET request to the Wikipedia API
-        response = requests.get(WIKIPEDIA_API_URL, params=params)
+        response = await http.get(WIKIPEDIA_API_URL, params=params, hedge_after=SEARCH_HEDGE_AFTER)
         response.raise_for_status()  # Raise an error for HTTP issues
 
         # Parse the JSON response
         data = response.json()
-        search_results = data.get('query', {}).get('search', [])
+        pages = data.get('query', {}).get('pages', {})
 
-        # Return None if no results are found
-        if not search_results:
-            return None
+        # Pages come back keyed by page ID, so restore the search rank order
+        candidates = []
+        for page in sorted(pages.values(), key=lambda page: page.get('index', 0)):
+            title = page['title']
+            candidates.append({
+                'title': title,
+                'snippet': page.get('extract', ''),
+                'url': page.get('fullurl', f"https://en.wikipedia.org/wiki/{title.replace(' ', '_')}"),
+                'image_url': page.get('thumbnail', {}).get('source')
+            })
 
-        # Extract the first result's title, snippet, and URL
-        result = search_results[0]
-        title = result['title']
-        snippet = result['snippet'].replace('<span class="searchmatch">', '').replace('</span>', '')
-        url = f"https://en.wikipedia.org/wiki/{title.replace(' ', '_')}"
+        return candidates
 
-        # Fetch the page image if available
-        image_params = {
-            'action': 'query',
-            'format': 'json',
-            'prop': 'pageimages',
-            'titles': title,
-            'pithumbsize': 300
-        }
-        image_response = requests.get(WIKIPEDIA_API_URL, params=image_params)
-        image_response.raise_for_status()
-        image_data = image_response.json()
-        page = image_data.get('query', {}).get('pages', {})
-        image_url = None
-        for page in page.values():
-            image_url = page.get('thumbnail', {}).get('source')
-            break
-
-        return {
-            'title': title,
-            'snippet': snippet,
-            'url': url,
-            'image_url': image_url
-        }
+    except (aiohttp.ClientError, ValueError) as e:
+        # Log the error and return None
+        log.warning("Error fetching data from Wikipedia API: %s", e)
+        return None
+
+async def opensearch_titles(prefix: str, limit: int = 10) -> list:
+    """
+    Find article titles starting with a prefix, for autocomplete.
+
+    Args:
+        prefix (str): What the user has typed so far.
+        limit (int): The number of titles to return.
+
+    Returns:
+        list: Matching titles, most relevant first.
+        None: If an error occurs.
+    """
+    params = {
+        'action': 'opensearch',
+        'format': 'json',
+        'search': prefix,
+        'limit': limit,
+        'namespace': 0,
+        'redirects': 'return',  # Redirect titles, e.g. "USA", match what was typed rather than their targets
+        'utf8': 1
+    }
+
+    try:
+        response = await http.get(WIKIPEDIA_API_URL, params=params, retries=AUTOCOMPLETE_RETRIES)
+        response.raise_for_status()
+
+        # [search term, [titles], [descriptions], [urls]]
+        data = response.json()
+        return list(data[1])
+
+    except (aiohttp.ClientError, ValueError, IndexError, TypeError) as e:
+        log.warning("Error fetching title suggestions from Wikipedia API: %s", e)
+        return None
+
+# Shared by every command taking an article title
+title_suggester = PrefixSuggester('wiki_titles', opensearch_titles)
+
+async def search_wikipedia(term: str) -> dict:
+    """
+    Search Wikipedia for the given term.
+
+    Args:
+        term (str): The term to search for.
+
+    Returns:
+        dict: The first search result, including title, snippet, URL and image URL.
+        None: If no results are found or an error occurs.
+    """
+    candidates = await search_wikipedia_candidates(term, limit=1)
 
-    except (requests.RequestException, ValueError) as e:
-        # Print error message and return None
-        print(f"Error fetching data from Wikipedia API: {e}")
+    # Return None if no results are found
+    if not candidates:
         return None
 
-def get_random_article() -> dict:
+    return candidates[0]
+
+async def fetch_random_articles() -> list:
     """
-    Get a random article from Wikipedia.
+    Fetch a batch of random articles from Wikipedia, with their thumbnails.
 
     Returns:
-        dict: The random article's title, URL, and image if available.
+        list: Dictionaries with each article's title, URL, and image if available.
         None: If an error occurs.
     """
     params = {
@@ -85,89 +187,154 @@ def get_random_article() -> dict:
         'format': 'json',
         'generator': 'random',
         'grnnamespace': 0,
+        'grnlimit': RANDOM_BATCH,
         'prop': 'pageimages|info',
         'inprop': 'url',
-        'pithumbsize': 500
+        'piprop': 'thumbnail',
+        'pithumbsize': 500,
+        'pilimit': RANDOM_BATCH
     }
 
     try:
-        response = requests.get(WIKIPEDIA_API_URL, params=params)
+        response = await http.get(WIKIPEDIA_API_URL, params=params, priority=rate_limit.BACKGROUND)
         response.raise_for_status()
-        data = response.json()
+        pages = response.json().get('query', {}).get('pages', {})
 
-        pages = data.get('query', {}).get('pages', {})
-        if not pages:
-            return None
+        return [{
+            'title': page['title'],
+            'url': page['fullurl'],
+            'image': page.get('thumbnail', {}).get('source')
+        } for page in pages.values()]
 
-        page = next(iter(pages.values()))
-        title = page['title']
-        url = page['fullurl']
-        image_url = page.get('thumbnail', {}).get('source')
+    except (aiohttp.ClientError, ValueError, KeyError) as e:
+        log.warning("Error fetching random articles from Wikipedia API: %s", e)
+        return None
 
-        return {
-            'title': title,
-            'url': url,
-            'image': image_url
-        }
+# Refilled in the background, so /random_wiki doesn't wait on Wikipedia
+random_articles = Pool('wiki_random', fetch_random_articles, key=lambda article: article['title'],
+                       capacity=RANDOM_POOL_CAPACITY, low_water=RANDOM_POOL_LOW_WATER)
 
-    except (requests.RequestException, ValueError) as e:
-        print(f"Error fetching random article from Wikipedia API: {e}")
-        return None
+async def get_random_article(audience=None) -> dict:
+    """
+    Get a random article from Wikipedia, from the prefetched pool.
+
+    Args:
+        audience: Who the article is for, such as a guild ID; recent articles aren't repeated to them.
+
+    Returns:
+        dict: The random article's title, URL, and image if available.
+        None: If the pool is empty and refilling it fails.
+    """
+    return await random_articles.take(audience)
 
-def get_trending_articles() -> list:
+async def fetch_trending_articles() -> list:
     """
-    Fetch the most viewed articles currently trending on Wikipedia.
+    Fetch the most viewed articles on Wikipedia, with their thumbnails and short extracts.
 
     Returns:
-        list: A list of dictionaries, each containing title, URL, and optionally an image.
+        list: Dictionaries with title, URL, extract, image URL and views, most viewed first.
         None: If an error occurs.
     """
     params = {
         'action': 'query',
         'format': 'json',
-        'list': 'mostviewed',  # Correct API parameter for trending articles
-        'pvimlimit': 10        # Limit to top 10 articles
+        'list': 'mostviewed',
+        'pvimlimit': TRENDING_CANDIDATES
     }
 
     try:
-        response = requests.get(WIKIPEDIA_API_URL, params=params)
+        response = await http.get(WIKIPEDIA_API_URL, params=params, priority=rate_limit.BACKGROUND)
         response.raise_for_status()
-        data = response.json()
-
-        # Debug: Print API response to verify structure
-        print(data)
-
-        # Access the most viewed articles
-        most_viewed = data.get('query', {}).get('mostviewed', [])
+        most_viewed = response.json().get('query', {}).get('mostviewed', [])
         if not isinstance(most_viewed, list):
-            print("Unexpected data structure for 'mostviewed':", most_viewed)
+            log.warning("Unexpected data structure for 'mostviewed': %r", most_viewed)
             return None
 
-        # Process the articles into a usable format
-        articles = []
-        for article in most_viewed:
-            title = article.get('title', 'No Title')
-            url = f"https://en.wikipedia.org/wiki/{title.replace(' ', '_')}"
-            articles.append({
+        # Articles only, without the Main Page and special pages, which are always near the top
+        articles = [article for article in most_viewed
+                    if article.get('ns', 0) == 0 and article.get('title') not in (None, 'Main Page')]
+        articles = articles[:TRENDING_ARTICLES]
+        if not articles:
+            return []
+
+        # Thumbnails, intro extracts and canonical URLs for all of them in a second request
+        titles = [article['title'] for article in articles]
+        params = {
+            'action': 'query',
+            'format': 'json',
+            'titles': '|'.join(titles),
+            'prop': 'pageimages|extracts|info',
+            'piprop': 'thumbnail',
+            'pithumbsize': 300,
+            'pilimit': len(titles),
+            'exintro': 1,
+            'explaintext': 1,
+            'exsentences': 2,
+            'exlimit': len(titles),
+            'inprop': 'url',
+            'redirects': 1,
+            'utf8': 1
+        }
+        response = await http.get(WIKIPEDIA_API_URL, params=params, priority=rate_limit.BACKGROUND)
+        response.raise_for_status()
+        query = response.json().get('query', {})
+        pages = {page.get('title'): page for page in query.get('pages', {}).values()}
+        # Titles the API normalized or followed a redirect from, to the page they ended up at
+        aliases = {alias['from']: alias['to'] for alias in query.get('normalized', []) + query.get('redirects', [])}
+
+        trending = []
+        for article in articles:
+            title = article['title']
+            resolved = aliases.get(title, title)
+            page = pages.get(aliases.get(resolved, resolved), {})
+            trending.append({
                 'title': title,
-                'url': url
+                'url': page.get('fullurl', f"https://en.wikipedia.org/wiki/{title.replace(' ', '_')}"),
+                'extract': page.get('extract', ''),
+                'image_url': page.get('thumbnail', {}).get('source'),
+                'views': article.get('count')
             })
+        return trending
+
+    except (aiohttp.ClientError, ValueError) as e:
+        log.warning("Error fetching trending articles from Wikipedia API: %s", e)
+        return None
+
+# Kept fresh in the background, so /trending_wiki never waits on Wikipedia
+trending_articles = refresher.register('wiki_trending', fetch_trending_articles, interval=TRENDING_REFRESH_INTERVAL,
+                                       persist=True)
 
-        return articles
+async def get_trending_articles() -> list:
+    """
+    Get the most viewed articles on Wikipedia, from the background refresher's last good snapshot.
 
-    except (requests.RequestException, ValueError) as e:
-        print(f"Error fetching trending articles from Wikipedia API: {e}")
+    Returns:
+        list: See fetch_trending_articles.
+        None: If no snapshot has been fetched yet.
+    """
+    return trending_articles.get()
+
+def classify_category_page(page) -> str:
+    """
+    Cache classifier for get_article_categories: errors aren't cached, articles without categories are "not found".
+    """
+    if page is None:
         return None
+    return POSITIVE if page['categories'] else NEGATIVE
 
-def get_article_categories(title: str) -> list:
+@cached('wiki_article_categories', ttl=ARTICLE_METADATA_TTL, negative_ttl=NOT_FOUND_TTL,
+        classify=classify_category_page, persist=True, key=title_key)
+@coalesced('wiki_article_categories', key=title_key)
+async def get_article_categories(title: str, continue_from: str = None) -> dict:
     """
-    Fetch the categories of a specific Wikipedia article.
+    Fetch one page of the categories of a specific Wikipedia article.
 
     Args:
         title (str): The title of the article.
+        continue_from (str): The continuation token of the previous page, or None for the first page.
 
     Returns:
-        list: A list of categories.
+        dict: The page's categories, and the token for the next page in 'continue' (None on the last page).
         None: If an error occurs.
     """
     params = {
@@ -175,11 +342,13 @@ def get_article_categories(title: str) -> list:
         'format': 'json',
         'titles': title,
         'prop': 'categories',
-        'cllimit': 'max'
+        'cllimit': CATEGORY_PAGE_SIZE
     }
+    if continue_from is not None:
+        params['clcontinue'] = continue_from
 
     try:
-        response = requests.get(WIKIPEDIA_API_URL, params=params)
+        response = await http.get(WIKIPEDIA_API_URL, params=params)
         response.raise_for_status()
         data = response.json()
 
@@ -190,13 +359,16 @@ def get_article_categories(title: str) -> list:
             for category in page.get('categories', []):
                 categories.append(category['title'])
 
-        return categories
+        return {'categories': categories, 'continue': data.get('continue', {}).get('clcontinue')}
 
-    except (requests.RequestException, ValueError) as e:
-        print(f"Error fetching categories for article '{title}': {e}")
+    except (aiohttp.ClientError, ValueError) as e:
+        log.warning("Error fetching categories for article '%s': %s", title, e)
         return None
 
-def get_article_sections(title: str) -> list:
+@cached('wiki_article_sections', ttl=ARTICLE_METADATA_TTL, negative_ttl=NOT_FOUND_TTL,
+        classify=classify_optional, persist=True, key=title_key)
+@coalesced('wiki_article_sections', key=title_key)
+async def get_article_sections(title: str) -> list:
     """
     Fetch the sections of a specific Wikipedia article.
 
@@ -215,13 +387,13 @@ def get_article_sections(title: str) -> list:
     }
 
     try:
-        response = requests.get(WIKIPEDIA_API_URL, params=params)
+        response = await http.get(WIKIPEDIA_API_URL, params=params)
         response.raise_for_status()
         data = response.json()
 
         sections = data.get('parse', {}).get('sections', [])
         return [{'title': section['line'], 'level': section['level']} for section in sections]
 
-    except (requests.RequestException, ValueError) as e:
-        print(f"Error fetching sections for article '{title}': {e}")
+    except (aiohttp.ClientError, ValueError) as e:
+        log.warning("Error fetching sections for article '%s': %s", title, e)
         return None
\ No newline at end of file